@@ -0,0 +1,316 @@
+import asyncio
+import threading
+import time
+
+from networking import CONNECTION_TIMEOUT, CommandChannel, CommandTimeout, PendingCommand, rc_sent, resolve
+from telemetry import TELLO_STATE_PORT, TelemetrySnapshot, parse_state, state_interval, state_invalid, state_packets
+
+
+class _CommandProtocol(asyncio.DatagramProtocol):
+    """Receives command replies on the command socket."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._on_reply(data)
+
+    def error_received(self, exc):
+        print(f"Command socket error: {exc}")
+
+
+class _StateProtocol(asyncio.DatagramProtocol):
+    """Receives the state string the drone pushes on port 8890."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._on_state(data)
+
+
+class AsyncTelloClient:
+    """
+    Tello client running entirely on one asyncio event loop.
+    The command, state and video-control (streamon/streamoff/setfps) traffic
+    all share the loop; no polling threads are involved.
+    """
+
+    def __init__(self, tello_ip='192.168.10.1', local_port=9010, state_port=TELLO_STATE_PORT):
+        self.TELLO_IP = tello_ip
+        self.TELLO_PORT = 8889
+        self.TELLO_ADDRESS = (self.TELLO_IP, self.TELLO_PORT)
+        self.LOCAL_PORT = local_port
+        self.STATE_PORT = state_port
+
+        self._cmd_transport = None
+        self._state_transport = None
+        self._watchdog = None
+
+        # Reply matching shared with networking.py; _pump() sends and resends
+        self.commands = CommandChannel()
+        self._timer = None
+
+        # Connection State
+        self.is_connected = False
+        self.last_response_time = None
+
+        # Status text fields
+        self.battery_text = "Battery:"
+        self.time_text = "Time:"
+        self.status_text = "Status: Disconnected"
+
+        self._snapshot = None
+        self._state_seq = 0
+
+        # Optional FlightRecorder that logs commands, replies and state packets
+        self.recorder = None
+
+    async def open(self):
+        """Binds the command and state sockets and starts the connection watchdog."""
+        loop = asyncio.get_running_loop()
+        self._cmd_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _CommandProtocol(self), local_addr=('0.0.0.0', self.LOCAL_PORT))
+        self._state_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _StateProtocol(self), local_addr=('0.0.0.0', self.STATE_PORT))
+        self._watchdog = loop.create_task(self._watch_connection())
+
+    async def close(self):
+        """Stops the watchdog and closes both sockets."""
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        resolve(self.commands.cancel("cancelled: client closed."))
+        for transport in (self._cmd_transport, self._state_transport):
+            if transport is not None:
+                transport.close()
+        self._cmd_transport = self._state_transport = None
+
+    def _on_reply(self, data):
+        resp = data.decode(encoding="utf-8", errors="ignore").strip()
+        if self.recorder is not None:
+            self.recorder.record_reply(resp)
+        self.last_response_time = time.time()
+        self.is_connected = True
+        self.status_text = "Status:" + resp
+        resolve(self.commands.on_reply(resp, time.monotonic()))
+        self._pump()
+
+    def _on_state(self, data):
+        if self.recorder is not None:
+            self.recorder.record_state(data)
+        fields = parse_state(data)
+        if not fields:
+            state_invalid.inc()
+            return
+        self._state_seq += 1
+        snapshot = TelemetrySnapshot(self._state_seq, time.time(), **fields)
+        state_packets.inc()
+        if self._snapshot is not None:
+            state_interval.record(snapshot.timestamp - self._snapshot.timestamp)
+        self._snapshot = snapshot
+        self.battery_text = f"Battery:{snapshot.bat}%"
+        self.time_text = f"Time:{snapshot.time}s"
+        self.last_response_time = snapshot.timestamp
+
+    def snapshot(self):
+        """Returns the latest TelemetrySnapshot, or None if nothing arrived yet."""
+        return self._snapshot
+
+    def send_rc(self, command):
+        """Sends an rc command. The drone does not reply to these."""
+        if self._send(command):
+            rc_sent.inc()
+
+    def _send(self, command):
+        """Sends a datagram to the drone. Returns False if the client is not open."""
+        if self._cmd_transport is None or self._cmd_transport.is_closing():
+            print(f"Cannot send '{command}': client is not open.")
+            return False
+        if self.recorder is not None:
+            self.recorder.record_command(command)
+        try:
+            self._cmd_transport.sendto(command.encode('utf-8'), self.TELLO_ADDRESS)
+        except OSError as e:
+            print(f"Error sending '{command}': {e}")
+            return False
+        return True
+
+    def _pump(self):
+        """Sends what the command channel has ready and arms the timer for its next deadline."""
+        now = time.monotonic()
+        to_send, finished = self.commands.poll(now)
+        resolve(finished)
+        for command in to_send:
+            self._send(command)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        deadline = self.commands.next_deadline()
+        if deadline is not None:
+            self._timer = asyncio.get_running_loop().call_later(max(0.0, deadline - now), self._pump)
+
+    async def command(self, command, timeout=None, retries=None):
+        """
+        Sends a command and returns the drone's reply ('ok', 'error', ...).
+        Commands are sent one at a time; only idempotent ones are resent when
+        the reply is lost (see networking.command_retries()).
+        Raises CommandTimeout if no reply arrived after all retries.
+        """
+        pending = PendingCommand(command, timeout, retries)
+        self.commands.submit(pending)
+        self._pump()
+        return await asyncio.wrap_future(pending.future)
+
+    async def urgent(self, command, timeout=None):
+        """
+        Sends a command (e.g. 'stop') right away, ahead of the queued ones, and
+        returns its reply. It is never resent. Raises CommandTimeout without a reply.
+        """
+        pending = PendingCommand(command, timeout, 0)
+        self.commands.submit_urgent(pending, time.monotonic())
+        self._send(command)
+        self._pump()
+        return await asyncio.wrap_future(pending.future)
+
+    async def connect(self):
+        """
+        Enters SDK mode by sending 'command' and waiting for 'ok'.
+        Returns True on success, False on failure.
+        """
+        try:
+            reply = await self.command('command', timeout=1.0, retries=4)
+        except CommandTimeout:
+            reply = None
+        if reply == 'ok':
+            self.is_connected = True
+            self.last_response_time = time.time()
+            print("Drone connected successfully!")
+            return True
+        print("Failed to connect to the drone. Please ensure it is on and connected to the same Wi-Fi network.")
+        return False
+
+    async def streamon(self):
+        """Starts the video stream on port 11111."""
+        return await self.command('streamon')
+
+    async def streamoff(self):
+        """Stops the video stream."""
+        return await self.command('streamoff')
+
+    async def _watch_connection(self):
+        """Marks the drone as disconnected when neither replies nor state arrive."""
+        while True:
+            await asyncio.sleep(0.5)
+            if (self.is_connected and self.last_response_time
+                    and time.time() - self.last_response_time > CONNECTION_TIMEOUT):
+                print("Connection to drone lost (timeout).")
+                self.is_connected = False
+                self.status_text = "Status: Disconnected"
+
+
+class AsyncTelloNetworking:
+    """
+    Synchronous facade over AsyncTelloClient with the same surface as TelloNetworking,
+    so TelloMovement and main.py work unchanged. The event loop runs on one thread.
+    """
+
+    def __init__(self, tello_ip='192.168.10.1', local_port=9010):
+        self.client = AsyncTelloClient(tello_ip, local_port)
+        self.TELLO_ADDRESS = self.client.TELLO_ADDRESS
+        self.loop = asyncio.new_event_loop()
+        self._thread = None
+
+    def start(self):
+        """Starts the event loop thread and opens the sockets."""
+        self._thread = threading.Thread(target=self.loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        try:
+            self._run(self.client.open()).result()
+        except OSError as e:
+            print(f"Error binding to socket: {e}")
+            print("Please ensure no other Tello scripts are running and try again.")
+            exit()
+
+    def stop(self):
+        """Closes the sockets and stops the event loop."""
+        if self._thread is None:
+            return
+        self._run(self.client.close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # State shared with the UI thread is read straight from the client
+    @property
+    def is_connected(self):
+        return self.client.is_connected
+
+    @is_connected.setter
+    def is_connected(self, value):
+        self.client.is_connected = value
+
+    @property
+    def battery_text(self):
+        return self.client.battery_text
+
+    @property
+    def time_text(self):
+        return self.client.time_text
+
+    @property
+    def status_text(self):
+        return self.client.status_text
+
+    @property
+    def telemetry(self):
+        return self.client
+
+    def connect(self):
+        """
+        Attempts to establish a connection by sending 'command' and waiting for 'ok'.
+        Returns True on success, False on failure.
+        """
+        return self._run(self.client.connect()).result()
+
+    def send_command(self, command, check_connection=True, timeout=None, retries=None, urgent=False):
+        """
+        Sends a command to the Tello drone, optionally checking the connection status first.
+        Returns a concurrent.futures.Future resolved with the reply, or None if not connected.
+        Urgent commands (e.g. 'stop') skip the queue and are never resent.
+        """
+        if check_connection and not self.is_connected:
+            print(f"Cannot send '{command}': Drone not connected.")
+            return None
+        if urgent:
+            return self._run(self.client.urgent(command, timeout))
+        return self._run(self.client.command(command, timeout, retries))
+
+    def execute(self, command, check_connection=True, timeout=None, retries=None):
+        """
+        Sends a command and blocks until its reply arrives.
+        Returns the reply, or None if the drone did not answer.
+        """
+        future = self.send_command(command, check_connection, timeout, retries)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except CommandTimeout as e:
+            print(e)
+            return None
+
+    def attach_recorder(self, recorder):
+        """Logs commands, replies and state packets to a FlightRecorder."""
+        self.client.recorder = recorder
+
+    def send_rc(self, command):
+        """Sends an rc command from any thread."""
+        self.loop.call_soon_threadsafe(self.client.send_rc, command)
@@ -0,0 +1,311 @@
+"""
+Benchmark of the vision hot paths of drone_linetrace.py and drone_qr.py.
+
+    python bench_vision.py --frames recorded_frames/ --output bench.json
+    python bench_vision.py --synthetic 300 --compare bench.json
+
+Each pipeline is run stage by stage over the same frame set. The result (JSON)
+holds per-stage latency percentiles, the bytes allocated per frame and the
+throughput of the whole chain. Pipelines with an alternative dilation also get
+a 'quality' entry: how far their mask and centroid are from the square kernel.
+With --compare the run is checked against an earlier result and the exit code
+is 1 if a stage got slower than --tolerance.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from line_tracker import DEFAULT_BOUNDS, LineTracker
+from qr_worker import TwoStageQrDecoder
+
+IMAGE_EXTENSIONS = ('*.png', '*.jpg', '*.jpeg', '*.bmp')
+
+
+def linetrace_stages(bounds=DEFAULT_BOUNDS):
+    """The processing chain of drone_linetrace.py, one function per stage."""
+    lower, upper = bounds
+    return [
+        ('resize', lambda img: cv2.resize(img, dsize=(480, 360))),
+        ('roi', lambda img: img[250:359, 0:479]),
+        ('cvtColor', lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2HSV)),
+        ('inRange', lambda img: cv2.inRange(img, lower, upper)),
+        ('dilate', lambda img: cv2.dilate(img, np.ones((15, 15), np.uint8), iterations=1)),
+        ('label', lambda img: cv2.connectedComponentsWithStats(img)),
+    ]
+
+
+def linetracker_stages(bounds=DEFAULT_BOUNDS):
+    """The same chain through LineTracker and its preallocated buffers."""
+    return LineTracker(*bounds).stages()
+
+
+def linetracker_lut_stages(bounds=DEFAULT_BOUNDS):
+    """LineTracker with the lookup-table classifier instead of cvtColor + inRange."""
+    return LineTracker(*bounds, classifier='lut').stages()
+
+
+def linetracker_track_stages(bounds=DEFAULT_BOUNDS):
+    """LineTracker in tracking mode: full labelling only when the track is lost."""
+    return LineTracker(*bounds, tracking=True).stages()
+
+
+def linetracker_separable_stages(bounds=DEFAULT_BOUNDS):
+    """LineTracker dilating with a row kernel and a column kernel."""
+    return LineTracker(*bounds, morphology='separable').stages()
+
+
+def linetracker_pyramid_stages(bounds=DEFAULT_BOUNDS):
+    """LineTracker dilating at half resolution."""
+    return LineTracker(*bounds, morphology='pyramid').stages()
+
+
+def qr_stages(bounds=None):
+    """The processing chain of drone_qr.py."""
+    qcd = cv2.QRCodeDetector()
+    return [
+        ('resize', lambda img: cv2.resize(img, (img.shape[1] // 3, img.shape[0] // 3))),
+        ('detectAndDecodeMulti', lambda img: qcd.detectAndDecodeMulti(img)),
+    ]
+
+
+def qr_two_stage_stages(bounds=None):
+    """Candidate detection on a small grey frame, decoding on full-resolution crops."""
+    decoder = TwoStageQrDecoder()
+    return [
+        ('detectAndDecodeCrops', decoder),
+    ]
+
+
+# Pipelines that can be selected with --pipeline
+PIPELINES = {
+    'linetrace': linetrace_stages,
+    'linetracker': linetracker_stages,
+    'linetracker-lut': linetracker_lut_stages,
+    'linetracker-pyramid': linetracker_pyramid_stages,
+    'linetracker-separable': linetracker_separable_stages,
+    'linetracker-track': linetracker_track_stages,
+    'qr': qr_stages,
+    'qr-two-stage': qr_two_stage_stages,
+}
+
+# Pipelines whose result is compared with the square dilation, and their morphology
+MORPHOLOGY_PIPELINES = {
+    'linetracker-pyramid': 'pyramid',
+    'linetracker-separable': 'separable',
+}
+
+
+def load_frames(path, limit=None):
+    """Loads frames from a directory of images or from a video file."""
+    frames = []
+    if os.path.isdir(path):
+        files = []
+        for pattern in IMAGE_EXTENSIONS:
+            files += glob.glob(os.path.join(path, pattern))
+        for name in sorted(files)[:limit]:
+            image = cv2.imread(name)
+            if image is not None:
+                frames.append(image)
+    else:
+        cap = cv2.VideoCapture(path)
+        while limit is None or len(frames) < limit:
+            ret, image = cap.read()
+            if not ret:
+                break
+            frames.append(image)
+        cap.release()
+    return frames
+
+
+def synthetic_frames(count, seed=0):
+    """Generates reproducible 960x720 frames with a yellow line on a noisy floor."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        image = rng.integers(40, 90, size=(720, 960, 3), dtype=np.uint8)
+        x = int(480 + 300 * np.sin(i / 20.0))
+        cv2.line(image, (x, 720), (480, 300), (0, 220, 230), 40)
+        frames.append(image)
+    return frames
+
+
+def percentiles(samples):
+    """Summarises latency samples (seconds) in milliseconds."""
+    ms = np.asarray(samples) * 1000.0
+    return {
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
+
+
+def run_pipeline(stages, frames, warmup=10, repeat=1):
+    """
+    Runs the stages over all frames and returns the per-stage statistics.
+    Timing and allocation tracing are done in separate passes so that
+    tracemalloc does not distort the latencies.
+    """
+    names = [name for name, _ in stages]
+    times = {name: [] for name in names}
+    totals = []
+
+    def run_once(frame, record):
+        value = frame
+        start = time.perf_counter()
+        for name, fn in stages:
+            t0 = time.perf_counter()
+            value = fn(value)
+            if record:
+                times[name].append(time.perf_counter() - t0)
+        if record:
+            totals.append(time.perf_counter() - start)
+
+    for frame in frames[:warmup]:
+        run_once(frame, False)
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            run_once(frame, True)
+    wall = time.perf_counter() - wall_start
+
+    # Allocation pass
+    allocated = {name: 0 for name in names}
+    tracemalloc.start()
+    for frame in frames:
+        value = frame
+        for name, fn in stages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            value = fn(value)
+            _, peak = tracemalloc.get_traced_memory()
+            allocated[name] += peak - before
+        del value
+    tracemalloc.stop()
+
+    result = {'stages': {}, 'frames': len(totals)}
+    for name in names:
+        stats = percentiles(times[name])
+        stats['alloc_bytes_per_frame'] = allocated[name] // max(1, len(frames))
+        result['stages'][name] = stats
+    result['total'] = percentiles(totals)
+    result['total']['alloc_bytes_per_frame'] = sum(
+        s['alloc_bytes_per_frame'] for s in result['stages'].values())
+    result['fps'] = len(totals) / wall if wall > 0 else 0.0
+    return result
+
+
+def morphology_quality(frames, morphology, bounds=DEFAULT_BOUNDS):
+    """Compares the dilated mask and the centroid of a morphology mode with 'square'."""
+    reference = LineTracker(*bounds)
+    tracker = LineTracker(*bounds, morphology=morphology)
+    ious = []
+    errors = []
+    mismatches = 0
+    for frame in frames:
+        expected = reference.process(frame)
+        detection = tracker.process(frame)
+        a = reference.dilation_image > 0
+        b = tracker.dilation_image > 0
+        union = np.count_nonzero(a | b)
+        ious.append(np.count_nonzero(a & b) / union if union else 1.0)
+        if expected.found != detection.found:
+            mismatches += 1
+        elif expected.found:
+            errors.append(np.hypot(expected.mx - detection.mx, expected.my - detection.my))
+    return {
+        'mask_iou_mean': float(np.mean(ious)),
+        'mask_iou_min': float(np.min(ious)),
+        'centroid_error_mean_px': float(np.mean(errors)) if errors else 0.0,
+        'centroid_error_max_px': float(np.max(errors)) if errors else 0.0,
+        'found_mismatches': mismatches,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns a list of stages whose p50 latency regressed by more than tolerance."""
+    regressions = []
+    for pipeline, current in result['pipelines'].items():
+        previous = baseline.get('pipelines', {}).get(pipeline)
+        if previous is None:
+            continue
+        for stage, stats in current['stages'].items():
+            old = previous['stages'].get(stage)
+            if old is None or old['p50_ms'] <= 0:
+                continue
+            ratio = stats['p50_ms'] / old['p50_ms']
+            if ratio > 1.0 + tolerance:
+                regressions.append(f"{pipeline}/{stage}: p50 {old['p50_ms']:.3f} -> {stats['p50_ms']:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision pipelines")
+    parser.add_argument('--frames', help="directory of images or a video file")
+    parser.add_argument('--synthetic', type=int, default=200, help="number of synthetic frames if --frames is not given")
+    parser.add_argument('--limit', type=int, default=None, help="maximum number of frames to load")
+    parser.add_argument('--pipeline', action='append', choices=sorted(PIPELINES), help="pipelines to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=1, help="passes over the frame set")
+    parser.add_argument('--warmup', type=int, default=10, help="frames run before measuring")
+    parser.add_argument('--output', help="write the JSON result to this file")
+    parser.add_argument('--compare', help="earlier JSON result to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed p50 slowdown for --compare")
+    args = parser.parse_args()
+
+    if args.frames:
+        frames = load_frames(args.frames, args.limit)
+        source = args.frames
+    else:
+        frames = synthetic_frames(args.synthetic)
+        source = f"synthetic:{args.synthetic}"
+    if not frames:
+        print(f"No frames could be loaded from {args.frames}")
+        sys.exit(2)
+
+    result = {
+        'meta': {
+            'source': source,
+            'frames': len(frames),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'cv_threads': cv2.getNumThreads(),
+            'machine': platform.machine(),
+        },
+        'pipelines': {},
+    }
+    for name in args.pipeline or sorted(PIPELINES):
+        stages = PIPELINES[name]()
+        result['pipelines'][name] = run_pipeline(stages, frames, args.warmup, args.repeat)
+        if name in MORPHOLOGY_PIPELINES:
+            result['pipelines'][name]['quality'] = morphology_quality(frames, MORPHOLOGY_PIPELINES[name])
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
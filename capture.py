@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+
+from instrumentation import counter, histogram
+
+# Video stream sent by the Tello on port 11111
+TELLO_CAMERA_ADDRESS = 'udp://@0.0.0.0:11111?overrun_nonfatal=1&fifo_size=50000000'
+
+# How the stream is received and decoded: 'opencv' (cv2.VideoCapture on the
+# FFmpeg URL) or 'native' (h264_ingest.H264Capture, needs PyAV)
+CAPTURE_BACKENDS = ('opencv', 'native')
+
+# A frame older than this (in seconds) is considered stale
+STALE_FRAME_TIMEOUT = 1.0
+
+# seq: increasing frame number, timestamp: time.monotonic() when the frame was decoded,
+# received: time.monotonic() when its first datagram arrived (None unless a ReceiptClock is used)
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image', 'received'], defaults=(None,))
+
+# Metrics (see instrumentation.py). video.read is the time spent in each cap.read().
+frames_decoded = counter('video.frames')
+read_failures = counter('video.read_failures')
+read_time = histogram('video.read')
+
+
+class FrameGrabber:
+    """
+    Decodes the video stream on its own thread and keeps only the newest frames.
+    The control/display loop reads them with latest(), which never blocks.
+    With a latency.ReceiptClock (fed by a VideoRelay) the frames carry their arrival time;
+    the native backend knows it without one. With the native backend and a
+    stream_health.StreamHealth, frames are only decoded from an intact
+    reference chain and status() tells a degraded stream from a lost one.
+    """
+
+    def __init__(self, address=TELLO_CAMERA_ADDRESS, ring_size=1, receipt_clock=None, backend='opencv',
+                 health=None):
+        if backend not in CAPTURE_BACKENDS:
+            raise ValueError(f"Unknown capture backend: {backend}")
+        self.address = address
+        self.receipt_clock = receipt_clock
+        self.backend = backend
+        self.health = health
+        self.cap = None
+
+        # Only the last ring_size frames are kept, older ones are dropped
+        self._ring = deque(maxlen=ring_size)
+        self._latest = None
+        self._cond = threading.Condition()
+
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.frames_decoded = 0
+        self.read_failures = 0
+
+    def start(self):
+        """Opens the stream and starts the capture thread."""
+        if self.backend == 'native':
+            from h264_ingest import H264Capture, video_port
+            self.cap = H264Capture(video_port(self.address), health=self.health)
+        else:
+            self.cap = cv2.VideoCapture(self.address)
+        if not self.cap.isOpened():
+            self.cap.open(self.address)
+        # Do not let OpenCV queue frames on our behalf
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the capture thread and releases the stream."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            if self._thread.is_alive():
+                # Still blocked in cap.read(): releasing the capture now would crash
+                return
+            self._thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _run(self):
+        seq = 0
+        while self._running:
+            start = time.perf_counter()
+            ret, image = self.cap.read()
+            read_time.record(time.perf_counter() - start)
+            if not ret or image is None or image.size == 0:
+                self.read_failures += 1
+                read_failures.inc()
+                time.sleep(0.005)
+                continue
+
+            seq += 1
+            now = time.monotonic()
+            if self.receipt_clock is not None:
+                received = self.receipt_clock.match(now)
+            else:
+                unit = getattr(self.cap, 'last_unit', None)
+                received = unit.received if unit is not None else None
+            frame = Frame(seq, now, image, received)
+            with self._cond:
+                self._ring.append(frame)
+                # Swapping the reference is atomic, so latest() needs no lock
+                self._latest = frame
+                self._cond.notify_all()
+            self.frames_decoded += 1
+            frames_decoded.inc()
+
+    def latest(self):
+        """Returns the newest Frame, or None if nothing has been decoded yet."""
+        return self._latest
+
+    def recent(self):
+        """Returns the frames currently held in the ring, oldest first."""
+        with self._cond:
+            return list(self._ring)
+
+    def wait_next(self, after_seq, timeout=None):
+        """
+        Waits until a frame newer than after_seq is available.
+        Returns the newest Frame, or None on timeout.
+        """
+        with self._cond:
+            ok = self._cond.wait_for(
+                lambda: self._latest is not None and self._latest.seq > after_seq,
+                timeout)
+            return self._latest if ok else None
+
+    def is_stale(self, frame, timeout=STALE_FRAME_TIMEOUT):
+        """Returns True if frame is missing or older than timeout seconds."""
+        return frame is None or time.monotonic() - frame.timestamp > timeout
+
+    def status(self, frame=None):
+        """
+        Returns 'ok', 'degraded' (resynchronising after packet loss) or
+        'disconnected' (no video). Without a StreamHealth only staleness is known.
+        """
+        if self.health is not None:
+            return self.health.status()
+        return 'disconnected' if self.is_stale(frame) else 'ok'
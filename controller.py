@@ -0,0 +1,203 @@
+import threading
+import time
+
+# Default rate (Hz) of the control loop, independent of the camera frame rate
+CONTROL_RATE_HZ = 30
+
+# A measurement older than this (s) means the line is lost
+MEASUREMENT_TIMEOUT = 0.5
+
+
+class PID:
+    """
+    PID controller working with the measured time step.
+    - The derivative is taken on the error and low-pass filtered (time constant
+      derivative_tau, s) so that pixel noise does not reach the output.
+    - Anti-windup: the integral stops growing while the output is saturated in
+      the direction of the error, and is clamped to integral_limit.
+    - Inside the deadband the error counts as 0, outside it is used as is
+      (the behaviour of the original proportional yaw control).
+    """
+
+    def __init__(self, kp, ki=0.0, kd=0.0, limit=None, integral_limit=None,
+                 derivative_tau=0.05, deadband=0.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.integral_limit = integral_limit
+        self.derivative_tau = derivative_tau
+        self.deadband = deadband
+        self.reset()
+
+    def reset(self):
+        """Clears the integral and derivative state."""
+        self.integral = 0.0
+        self.derivative = 0.0
+        self._last_error = None
+
+    def update(self, error, dt, feedforward=0.0):
+        """Returns the output for error after dt seconds, plus the feed-forward term."""
+        if abs(error) < self.deadband:
+            error = 0.0
+
+        if self._last_error is not None and dt > 0:
+            raw = (error - self._last_error) / dt
+            alpha = dt / (self.derivative_tau + dt)
+            self.derivative += alpha * (raw - self.derivative)
+        self._last_error = error
+
+        unclamped = self.kp * error + self.ki * self.integral + self.kd * self.derivative + feedforward
+        output = self._clamp(unclamped, self.limit)
+
+        # Only integrate when that does not push a saturated output further
+        saturated = output != unclamped
+        if dt > 0 and not (saturated and (error > 0) == (unclamped > 0)):
+            self.integral = self._clamp(self.integral + error * dt, self.integral_limit)
+        return output
+
+    @staticmethod
+    def _clamp(value, limit):
+        if limit is None:
+            return value
+        return max(-limit, min(limit, value))
+
+
+class LineFollowController:
+    """
+    Line following at a fixed control rate, decoupled from the vision loop.
+    The vision code only hands over measurements (line centroid x and angle);
+    a timer thread computes the rc setpoint with the real time step and calls
+    send((a, b, c, d)) every tick while enabled:
+        yaw (d):     PID on the centroid offset, plus feed-forward from the angle
+        lateral (a): optional PID on the line angle
+        forward (b): constant, set with `forward`
+    When no measurement arrived for MEASUREMENT_TIMEOUT the drone is told to hover.
+    """
+
+    def __init__(self, send, rate_hz=CONTROL_RATE_HZ, center=240, yaw_pid=None, lateral_pid=None,
+                 yaw_feedforward=0.0, timeout=MEASUREMENT_TIMEOUT, tracer=None):
+        self._send = send
+        self.period = 1.0 / rate_hz
+        self.center = center
+        # Defaults reproduce yaw_command(): P = 1, deadband ±50, limit ±70
+        self.yaw_pid = yaw_pid or PID(1.0, deadband=50.0, limit=70.0)
+        self.lateral_pid = lateral_pid
+        self.yaw_feedforward = yaw_feedforward
+        self.timeout = timeout
+        # Optional latency.LatencyTracer: a measurement's trace ends when its first rc is sent
+        self.tracer = tracer
+
+        self.forward = 0
+        self.enabled = False
+
+        self._lock = threading.Lock()
+        self._measurement = None    # (mx, angle, timestamp, trace)
+        self._fresh = False
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.ticks = 0
+        self.ticks_lost = 0
+        self.measurements = 0
+        self.last_setpoint = (0, 0, 0, 0)
+
+    def start(self):
+        """Starts the control thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the control thread."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def set_measurement(self, mx, angle=0.0, timestamp=None, trace=None):
+        """
+        Hands over the newest line position (x in the ROI) and angle (deg).
+        trace: the frame's latency.LatencyTrace, stamped 'handoff' here, 'tick'
+        when the control thread picks the measurement up and 'send' after its rc.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if trace is not None:
+            trace.mark('handoff')
+        with self._lock:
+            old = self._measurement
+            if self._fresh and old[3] is not None and self.tracer is not None:
+                # Replaced before any rc was derived from it
+                self.tracer.discard(old[3])
+            self._measurement = (mx, angle, timestamp, trace)
+            self._fresh = True
+            self.measurements += 1
+
+    def reset(self):
+        """Clears the controller state, e.g. when line following is switched on."""
+        self.yaw_pid.reset()
+        if self.lateral_pid is not None:
+            self.lateral_pid.reset()
+
+    def compute(self, mx, angle, dt):
+        """Returns the (a, b, c, d) setpoint for one measurement and time step."""
+        feedforward = self.yaw_feedforward * angle
+        d = self.yaw_pid.update(mx - self.center, dt, feedforward)
+        a = self.lateral_pid.update(angle, dt) if self.lateral_pid is not None else 0.0
+        return int(a), int(self.forward), 0, int(d)
+
+    def _run(self):
+        next_time = time.monotonic()
+        last_time = next_time
+        while self._running:
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind: do not catch up with a burst of ticks
+                next_time = time.monotonic()
+            now = time.monotonic()
+            dt = now - last_time
+            last_time = now
+            self._tick(now, dt)
+
+    def _tick(self, now, dt):
+        with self._lock:
+            measurement = self._measurement
+            fresh = self._fresh
+            self._fresh = False
+        if not self.enabled:
+            if fresh and measurement[3] is not None and self.tracer is not None:
+                self.tracer.discard(measurement[3])
+            return
+        self.ticks += 1
+        if fresh and measurement[3] is not None:
+            measurement[3].mark('tick', now)
+
+        if measurement is None or now - measurement[2] > self.timeout:
+            # Line lost: hover and start again from a clean state
+            self.ticks_lost += 1
+            self.reset()
+            setpoint = (0, 0, 0, 0)
+        else:
+            mx, angle, _, _ = measurement
+            setpoint = self.compute(mx, angle, dt)
+        self._send(setpoint)
+        self.last_setpoint = setpoint
+
+        if fresh and measurement[3] is not None and self.tracer is not None:
+            self.tracer.finish(measurement[3])
+
+    def stats(self):
+        """Returns the tick counters and the last setpoint."""
+        return {
+            'rate_hz': 1.0 / self.period,
+            'ticks': self.ticks,
+            'ticks_lost': self.ticks_lost,
+            'measurements': self.measurements,
+            'last_setpoint': self.last_setpoint,
+        }
@@ -2,7 +2,15 @@ import socket
 import threading
 import cv2
 import time
-import numpy as np
+from line_tracker import LineTracker
+from controller import LineFollowController, PID
+from tuning import HsvTuner
+from scheduler import FrameScheduler, FULL, SKIP
+from instrumentation import StatsServer, counter, draw_overlay, histogram
+from latency import LatencyTracer, ReceiptClock
+from recorder import VideoRelay
+from h264_ingest import H264Capture, video_port
+from stream_health import StreamHealth
 # データ受け取り用の関数
 def udp_receiver():
         global battery_text
@@ -112,6 +120,21 @@ TELLO_PORT = 8889
 TELLO_ADDRESS = (TELLO_IP, TELLO_PORT)
 # Telloからの映像受信用のローカルIPアドレス、宛先ポート番号
 TELLO_CAMERA_ADDRESS = 'udp://@0.0.0.0:11111?overrun_nonfatal=1&fifo_size=50000000'
+# 映像の受信方法 "opencv": cv2.VideoCaptureでURLを開く, "native": パケットを自前で組み立ててPyAVでデコード
+# nativeではパケットロスで壊れたフレームを捨ててキーフレームを待つ（来なければstreamonを送り直す）
+VIDEO_BACKEND = "opencv"
+# 遅延計測モード：ファイル名を入れると、映像の受信からrc送信までの時間をフレームごとに記録する
+LATENCY_TRACE = ""
+receipt_clock = tracer = trace = None
+if LATENCY_TRACE:
+    tracer = LatencyTracer(LATENCY_TRACE)
+    # nativeはデコードしたフレームの受信時刻を知っているので中継は不要
+    if VIDEO_BACKEND != "native":
+        # 映像をいったん中継して、各フレームの最初のパケットの受信時刻を記録する
+        receipt_clock = ReceiptClock()
+        relay = VideoRelay(None, clock=receipt_clock)
+        relay.start()
+        TELLO_CAMERA_ADDRESS = relay.capture_address
 command_text = "None"
 battery_text = "Battery:"
 time_text = "Time:"
@@ -140,7 +163,11 @@ time.sleep(2)
 sock.sendto('streamon'.encode('utf-8'), TELLO_ADDRESS)
 time.sleep(2)
 if cap is None:
-    cap = cv2.VideoCapture(TELLO_CAMERA_ADDRESS)
+    if VIDEO_BACKEND == "native":
+        video_health = StreamHealth(request_keyframe=lambda: sock.sendto('streamon'.encode('utf-8'), TELLO_ADDRESS))
+        cap = H264Capture(video_port(TELLO_CAMERA_ADDRESS), health=video_health)
+    else:
+        cap = cv2.VideoCapture(TELLO_CAMERA_ADDRESS)
 if not cap.isOpened():
     cap.open(TELLO_CAMERA_ADDRESS)
 # cap = cv2.VideoCapture(0)
@@ -153,39 +180,68 @@ pre_time = current_time     # 5秒ごとの'command'送信のための時刻変
 time.sleep(0.5)     # 通信が安定するまでちょっと待つ
 # ウィンドウのタイトル
 window_title = "OpenCV Window"
-out_image = 0
-# トラックバーを作るため，まず最初にウィンドウを生成
-cv2.namedWindow(window_title, cv2.WINDOW_NORMAL)
-# トラックバーのコールバック関数は何もしない空の関数
-# コールバック関数（トラックバーが変更されたときに呼ばれる関数）
-def on_trackbar(val):
-    global out_image
-    if out_image is not None:
-        # 二値化
-        ret, dst = cv2.threshold(out_image, val, 255, cv2.THRESH_BINARY)
-        # 画像の表示
-        cv2.imshow(window_title, dst)
-
 #############################################
 
 # パラメータ変更部分（You may change following parameters.）
 H_MIN, H_MAX = 0, 0
 S_MIN, S_MAX = 0, 0
 V_MIN, V_MAX = 0, 0
+# 色の判定方法 "hsv": cvtColor+inRange, "lut": 事前計算した参照テーブル（低性能PC向け）
+CLASSIFIER = "hsv"
+# 前回見つけた線の周辺だけを処理する追跡モード（見失ったら全体を再探索）
+# 追跡中は最大の塊ではなく、窓内のすべての画素の重心を使うので結果が少し変わる
+TRACKING = False
+# 膨張処理の方法 "square": 15x15, "separable": 1x15→15x1, "pyramid": 半分の解像度で近似
+MORPHOLOGY = "square"
+# プレビューの表示回数の上限(回/秒)．画像処理は毎フレーム行う
+DISPLAY_RATE = 15
+# 1フレームあたりの処理時間の上限（秒）。間に合わないときはプレビューを省く
+FRAME_BUDGET = 1.0 / 30
+# rcコマンドを送る周期(回/秒)。カメラのフレームレートとは別に一定周期で制御する
+CONTROL_RATE = 30
+# 旋回(d)のPIDゲイン。KP=1, KI=KD=0 で従来の比例制御と同じ
+YAW_KP, YAW_KI, YAW_KD = 1.0, 0.0, 0.0
+# 線の傾き(度)で左右(a)を補正するゲイン。0なら使わない
+LATERAL_KP = 0.0
 
 #############################################
 
 
-# トラックバーの生成
-cv2.createTrackbar("H_min", window_title, H_MIN, 179, on_trackbar)
-cv2.createTrackbar("H_max", window_title, H_MAX, 179, on_trackbar)     # Hueの最大値は179
-cv2.createTrackbar("S_min", window_title, S_MIN, 255, on_trackbar)
-cv2.createTrackbar("S_max", window_title, S_MAX, 255, on_trackbar)
-cv2.createTrackbar("V_min", window_title, V_MIN, 255, on_trackbar)
-cv2.createTrackbar("V_max", window_title, V_MAX, 255, on_trackbar)
+# ウィンドウとトラックバーの生成
+# トラックバーの値はコールバックで更新されるので，毎フレーム読み出す必要はない
+tuner = HsvTuner(window_title, (H_MIN, S_MIN, V_MIN), (H_MAX, S_MAX, V_MAX), DISPLAY_RATE)
+# ライン検出器（作業用の画像はここで一度だけ確保される）
+tracker = LineTracker(classifier=CLASSIFIER, tracking=TRACKING, morphology=MORPHOLOGY, angle=LATERAL_KP != 0)
+# 処理時間を測って、時間内に収まる処理だけを実行する
+scheduler = FrameScheduler(FRAME_BUDGET)
+scheduler.add_stage('detect', required=True)     # 制御に必要なので毎フレーム実行
+scheduler.add_stage('preview', low_res=True)     # LOW: マスク画像だけ表示
+# 計測値をブラウザで確認するポート。8765にすると http://127.0.0.1:8765/stats で見られる（Noneなら使わない）
+STATS_PORT = None
+if STATS_PORT:
+    stats_server = StatsServer(STATS_PORT)
+    stats_server.start()
+video_frames = counter('video.frames')
+rc_sent = counter('net.rc_sent')
+loop_time = histogram('loop.time')
 a = b = c = d = 0   # rcコマンドの初期値を入力
 b = 0              # 前進の値を0に設定
 flag = 0
+# rcコマンドの送信（制御スレッドから呼ばれる）
+def send_rc(setpoint):
+    try:
+        sock.sendto(('rc %d %d %d %d' % setpoint).encode(encoding="utf-8"), TELLO_ADDRESS)
+        rc_sent.inc()
+    except:
+        pass
+# ライン追従の制御器：画像処理は測定値を渡すだけで、rcは一定周期で送られる
+# 旋回方向の不感帯(±50)とソフトウェアリミッタ(±70)は従来どおり
+controller = LineFollowController(
+    send_rc, CONTROL_RATE,
+    yaw_pid=PID(YAW_KP, YAW_KI, YAW_KD, limit=70, deadband=50),
+    lateral_pid=PID(LATERAL_KP, limit=30) if LATERAL_KP else None,
+    tracer=tracer)
+controller.start()
 
 # 繰り返し実行
 try:
@@ -195,78 +251,73 @@ try:
         if frame is None or frame.size == 0:    # 中身がおかしかったら無視
             continue
         image = frame
+        video_frames.inc()
+        frame_time = time.monotonic()
+        if tracer is not None:
+            # デコード完了時刻と受信時刻を記録
+            decoded = time.monotonic()
+            if receipt_clock is not None:
+                received = receipt_clock.match(decoded)
+            else:
+                received = cap.last_unit.received if cap.last_unit is not None else None
+            trace = tracer.begin(video_frames.value, decoded, received)
+        scheduler.begin_frame()
         # (B)ここから画像処理
-        # image = cv2.imread("IMG_7614.jpg")
-        # image = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)      # OpenCV用のカラー並びに変換する（既にBGRなので現状必要なし）
-        small_image = cv2.resize(image, dsize=(480,360) )   # 画像サイズを半分に変更
-        bgr_image = small_image[250:359,0:479]              # 注目する領域(ROI)を(0,250)-(479,359)で切り取る
-        # cv2.imshow('test Window', bgr_image)
-        hsv_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV)  # BGR画像 -> HSV画像
-        # hsv_image = bgr_image
-        # cv2.imshow('test Window', hsv_image)
-        # トラックバーの値を取る
-        h_min = cv2.getTrackbarPos("H_min", window_title)
-        h_max = cv2.getTrackbarPos("H_max", window_title)
-        s_min = cv2.getTrackbarPos("S_min", window_title)
-        s_max = cv2.getTrackbarPos("S_max", window_title)
-        v_min = cv2.getTrackbarPos("V_min", window_title)
-        v_max = cv2.getTrackbarPos("V_max", window_title)
-        on_trackbar(h_min)
-        on_trackbar(h_max)
-        on_trackbar(s_min)
-        on_trackbar(s_max)
-        on_trackbar(v_min)
-        on_trackbar(v_max)
-        # inRange関数で範囲指定２値化
-        bin_image = cv2.inRange(hsv_image, (h_min, s_min, v_min), (h_max, s_max, v_max)) # HSV画像なのでタプルもHSV並び
-        kernel = np.ones((15,15),np.uint8)  # 15x15で膨張させる
-        dilation_image = cv2.dilate(bin_image,kernel,iterations = 1)    # 膨張して虎ロープをつなげる
-        #erosion_image = cv2.erode(dilation_image,kernel,iterations = 1)    # 収縮
-        # bitwise_andで元画像にマスクをかける -> マスクされた部分の色だけ残る
-        masked_image = cv2.bitwise_and(hsv_image, hsv_image, mask=dilation_image)
-        # ラベリング結果書き出し用に画像を準備
-        out_image = masked_image
-        # 面積・重心計算付きのラベリング処理を行う
-        num_labels, label_image, stats, center = cv2.connectedComponentsWithStats(dilation_image)
-        # 最大のラベルは画面全体を覆う黒なので不要．データを削除
-        num_labels = num_labels - 1
-        stats = np.delete(stats, 0, 0)
-        center = np.delete(center, 0, 0)
-        if num_labels >= 1:
-            # 面積最大のインデックスを取得
-            max_index = np.argmax(stats[:,4])
-            #print max_index
+        # トラックバーが動いたときだけHSVの範囲を更新
+        bounds = tuner.poll()
+        if bounds is not None:
+            tracker.set_bounds(*bounds)     # HSV画像なのでタプルもHSV並び
+        # 縮小 -> ROI切り出し -> HSV変換 -> inRangeで２値化 -> 15x15で膨張 -> ラベリング
+        # 遅延計測中は縮小・2値化・膨張・ラベリングの各段階の時刻も記録する
+        with scheduler.measure('detect'):
+            detection = tracker.process(image, trace)
+        # プレビューは表示するフレームで、時間に余裕があるときだけ作る
+        preview_mode = scheduler.decide('preview') if tuner.preview_due() else SKIP
+        show_preview = preview_mode != SKIP
+        if show_preview:
+            preview_start = time.perf_counter()
+            if preview_mode == FULL:
+                # bitwise_andで元画像にマスクをかける -> マスクされた部分の色だけ残る
+                out_image = tracker.render()
+            else:
+                # 検出器の作業用画像なので、描き込む前にコピーする
+                out_image = tracker.dilation_image.copy()
+            preview_time = time.perf_counter() - preview_start
+        if detection.found:
             # 面積最大のラベルのx,y,w,h,面積s,重心位置mx,myを得る
-            x = stats[max_index][0]
-            y = stats[max_index][1]
-            w = stats[max_index][2]
-            h = stats[max_index][3]
-            s = stats[max_index][4]
-            mx = int(center[max_index][0])
-            my = int(center[max_index][1])
+            x, y, w, h = detection.x, detection.y, detection.w, detection.h
+            s = detection.area
+            mx, my = detection.mx, detection.my
             print("(x,y)=%d,%d (w,h)=%d,%d s=%d (mx,my)=%d,%d"%(x, y, w, h, s, mx, my) )
-            # ラベルを囲うバウンディングボックスを描画
-            cv2.rectangle(out_image, (x, y), (x+w, y+h), (255, 0, 255))
-            # 重心位置の座標を表示
-            # cv2.putText(out_image, "%d,%d"%(mx,my), (x-15, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
-            cv2.putText(out_image, "%d"%(s), (x, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+            if show_preview:
+                # ラベルを囲うバウンディングボックスを描画
+                cv2.rectangle(out_image, (x, y), (x+w, y+h), (255, 0, 255))
+                # 重心位置の座標を表示
+                # cv2.putText(out_image, "%d,%d"%(mx,my), (x-15, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
+                cv2.putText(out_image, "%d"%(s), (x, y+h+15), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 0))
             # a：左右，b：前後，c：上下，d：ヨー角
             if flag == 1:
                 # a=c=d=0，　b=40が基本．
                 # 左右旋回のdだけが変化する．
                 # 前進速度のbはキー入力で変える．
                 dx = 1.0 * (240 - mx)       # 画面中心との差分
-                # 旋回方向の不感帯を設定
-                d = 0.0 if abs(dx) < 50.0 else dx   # ±50未満ならゼロにする
-                d = -d
-                # 旋回方向のソフトウェアリミッタ(±70を超えないように)
-                d =  70 if d >  70.0 else d
-                d = -70 if d < -70.0 else d
                 print('dx=%f'%(dx) )
-                sock.sendto(('rc %s %s %s %s'%(int(a), int(b), int(c), int(d))).encode(encoding="utf-8"), TELLO_ADDRESS )
-        # (X)ウィンドウに表示
-        out_image = masked_image
-        cv2.imshow('OpenCV Window', out_image)  # ウィンドウに表示するイメージを変えれば色々表示できる
+                # 測定値を制御器に渡す（rc送信時刻は制御スレッドが記録する）
+                controller.set_measurement(mx, detection.angle, frame_time, trace)
+                trace = None
+        # (X)ウィンドウに表示（DISPLAY_RATE回/秒まで）
+        if show_preview:
+            preview_start = time.perf_counter()
+            # FPS、ループ時間、rc送信レートを右上に表示
+            draw_overlay(out_image, (300, 20))
+            tuner.show(out_image)  # ウィンドウに表示するイメージを変えれば色々表示できる
+            scheduler.record('preview', preview_mode, preview_time + time.perf_counter() - preview_start)
+        scheduler.end_frame()
+        if trace is not None:
+            # rcを送らなかったフレーム
+            tracer.discard(trace)
+            trace = None
+        loop_time.record(time.perf_counter() - scheduler.frame_start)
         # (Y)OpenCVウィンドウでキー入力を1ms待つ
         key = cv2.waitKey(1)
 
@@ -316,9 +367,12 @@ try:
         # 追跡モードをON
         elif key == ord('1'):
             flag = 1
+            controller.reset()
+            controller.enabled = True
         # 追跡モードをOFF
         elif key == ord('2'):
             flag = 0
+            controller.enabled = False
             sock.sendto('rc 0 0 0 0'.encode(encoding="utf-8"), TELLO_ADDRESS )
         elif key == ord('y'):           # 前進速度をキー入力で可変
             b = b + 10
@@ -328,6 +382,7 @@ try:
             b = b - 10
             if b < 0:
                 b = 0
+        controller.forward = b
         # (Z)5秒おきに'command'を送って、死活チェックを通す
         current_time = time.time()  # 現在時刻を取得
         if current_time - pre_time > 5.0 :  # 前回時刻から5秒以上経過しているか？
@@ -335,6 +390,12 @@ try:
             pre_time = current_time         # 前回時刻を更新
 except( KeyboardInterrupt, SystemExit):    # Ctrl+cが押されたら離脱
     print( "SIGINTを検知" )
+controller.stop()
+print(controller.stats())
+print(scheduler.stats())
+if tracer is not None:
+    print(tracer.summary())
+    tracer.close()
 # cap.release()
 cv2.destroyAllWindows()
 # ビデオストリーミング停止
@@ -2,7 +2,11 @@ import socket
 import threading
 import cv2
 import time
-import numpy as np
+
+from qr_worker import QrWorkerPool
+from h264_ingest import H264Capture, video_port
+from stream_health import StreamHealth
+from instrumentation import DEFAULT_OVERLAY, StatsServer, counter, draw_overlay, histogram
 
 # データ受け取り用の関数
 def udp_receiver():
@@ -116,6 +120,9 @@ TELLO_ADDRESS = (TELLO_IP, TELLO_PORT)
 
 # Telloからの映像受信用のローカルIPアドレス、宛先ポート番号
 TELLO_CAMERA_ADDRESS = 'udp://@0.0.0.0:11111?overrun_nonfatal=1&fifo_size=50000000'
+# 映像の受信方法 "opencv": cv2.VideoCaptureでURLを開く, "native": パケットを自前で組み立ててPyAVでデコード
+# nativeではパケットロスで壊れたフレームを捨ててキーフレームを待つ（来なければstreamonを送り直す）
+VIDEO_BACKEND = "opencv"
 
 command_text = "None"
 battery_text = "Battery:"
@@ -156,7 +163,11 @@ sock.sendto('streamon'.encode('utf-8'), TELLO_ADDRESS)
 time.sleep(1)
 
 if cap is None:
-    cap = cv2.VideoCapture(TELLO_CAMERA_ADDRESS)
+    if VIDEO_BACKEND == "native":
+        video_health = StreamHealth(request_keyframe=lambda: sock.sendto('streamon'.encode('utf-8'), TELLO_ADDRESS))
+        cap = H264Capture(video_port(TELLO_CAMERA_ADDRESS), health=video_health)
+    else:
+        cap = cv2.VideoCapture(TELLO_CAMERA_ADDRESS)
 
 if not cap.isOpened():
     cap.open(TELLO_CAMERA_ADDRESS)
@@ -168,9 +179,27 @@ time.sleep(1)
 
 cnt_frame = 0
 
-# qrコード読み取り用のインスタンス
-qcd = cv2.QRCodeDetector()
-
+# qrコード読み取りのワーカー数と方式("thread" または "process")
+QR_WORKERS = 2
+QR_EXECUTOR = "thread"
+# 読み取り方式 "full": 1/3の画像全体, "two-stage": 小さい画像で候補を探して元の解像度で読み取る
+QR_DECODER = "two-stage"
+# 同じ内容を何回読み取ったら確定とするか
+QR_CONFIRM_HITS = 3
+
+# qrコード読み取り用のワーカー（表示・操作のループを止めないように別スレッドで読み取る）
+qr_pool = QrWorkerPool(workers=QR_WORKERS, executor=QR_EXECUTOR, hits=QR_CONFIRM_HITS, decoder=QR_DECODER)
+qr_pool.start()
+
+# 計測値をブラウザで確認するポート。8765にすると http://127.0.0.1:8765/stats で見られる（Noneなら使わない）
+STATS_PORT = None
+if STATS_PORT:
+    stats_server = StatsServer(STATS_PORT)
+    stats_server.start()
+# 画面に表示する計測値（FPS、ループ時間、QR読み取り時間など）
+OVERLAY_ITEMS = DEFAULT_OVERLAY + (('QR p50', 'p50', 'qr.decode'),)
+video_frames = counter('video.frames')
+loop_time = histogram('loop.time')
 
 while True:
     ret, frame = cap.read()
@@ -179,21 +208,26 @@ while True:
     # 動画フレームが空ならスキップ
     if frame is None or frame.size == 0:
         continue
+    video_frames.inc()
+    loop_start = time.perf_counter()
 
     # カメラ映像のサイズを半分にする
     frame_height, frame_width = frame.shape[:2]
     frame_resized = cv2.resize(frame, (frame_width//3, frame_height//3))
     frame_output = frame_resized
 
-    # qrコードの読み取り
-    if cnt_frame % 5 == 0:
-        retval, decoded_info, points, straight_qrcode = qcd.detectAndDecodeMulti(frame_resized) 
-        if retval:
-            frame_qrdet = cv2.polylines(frame_resized, points.astype(int), True, (0, 255, 0), 3)
-            frame_ouput = frame_qrdet
-    
-        if len(decoded_info) != 0:
-            print(f"読み取り結果(result)：{decoded_info}")
+    # qrコードの読み取り（ワーカーが忙しければ古いフレームは捨てられる）
+    qr_pool.submit(cnt_frame, frame)
+
+    # 最新の読み取り結果の枠を表示（座標は元の画像サイズなので1/3にする）
+    qr_result = qr_pool.latest()
+    if qr_result is not None and qr_result.points and cnt_frame - qr_result.seq < 15:
+        quads = [(quad / 3).astype(int) for quad in qr_result.points]
+        cv2.polylines(frame_output, quads, True, (0, 255, 0), 3)
+
+    # 複数フレームで一致した読み取り結果だけを出力
+    for payload in qr_pool.confirmed():
+        print(f"読み取り結果(result)：{payload}")
 
     
     
@@ -234,8 +268,11 @@ while True:
             color=(0, 255, 0),
             thickness=1,
             lineType=cv2.LINE_4)
+    # 計測値を表示
+    draw_overlay(frame_output, (10, 100), OVERLAY_ITEMS)
     # カメラ映像を画面に表示
     cv2.imshow('Tello Camera View', frame_output)
+    loop_time.record(time.perf_counter() - loop_start)
 
     # キー入力を取得
     key = cv2.waitKey(1)
@@ -288,6 +325,7 @@ while True:
         set_speed()
         command_text = "Changed speed"
 
+qr_pool.stop()
 cap.release()
 cv2.destroyAllWindows()
 
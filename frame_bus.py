@@ -0,0 +1,332 @@
+"""
+Frames shared between processes without copying or pickling.
+
+    bus = FrameBus(slots=8)                 # before starting the processes
+    # producer process
+    frame = bus.acquire()
+    ret, _ = cap.read(frame.image)          # decode straight into shared memory
+    bus.publish(frame, seq)
+    # consumer processes
+    with bus.wait_next(0, last_seq, timeout=1.0) as frame:
+        ...                                 # frame.image is a view into the slot
+
+The bus is a fixed pool of preallocated slots in one shared memory block.
+Each slot carries its sequence number, time stamp, channel and a reference
+count kept under one cross-process lock. The newest frame of every channel
+holds a reference, and so does every consumer until it releases the frame;
+a producer only ever writes into a slot nobody references, so a frame
+never changes while it is read. Pass the bus to multiprocessing.Process as
+an argument; it attaches to the same memory in the child.
+
+    python frame_bus.py [--address udp://...]
+
+runs the line trace split over three processes: capture, detection and the
+preview window.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from capture import TELLO_CAMERA_ADDRESS
+from line_tracker import DEFAULT_BOUNDS, ROI, SMALL_SIZE, LineTracker
+
+# Size of the Tello frames
+FRAME_SHAPE = (720, 960, 3)
+
+# Slot header columns
+_REFS, _SEQ, _CHANNEL = range(3)
+# Channel header columns
+_LATEST, _LATEST_SEQ, _PUBLISHED, _DROPPED = range(4)
+
+
+class BusFrame:
+    """
+    A frame slot held by this process. Same fields as capture.Frame; the image
+    is a view into shared memory that stays valid until release().
+    """
+    __slots__ = ('bus', 'slot', 'seq', 'timestamp', 'image', 'channel', 'received')
+
+    def __init__(self, bus, slot, seq, timestamp, channel):
+        self.bus = bus
+        self.slot = slot
+        self.seq = seq
+        self.timestamp = timestamp
+        self.image = bus.images[slot]
+        self.channel = channel
+        self.received = None
+
+    def release(self):
+        """Drops this process's reference to the slot."""
+        if self.image is not None:
+            self.image = None
+            self.bus._decref(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def __repr__(self):
+        return f"BusFrame(slot={self.slot}, seq={self.seq}, channel={self.channel})"
+
+
+class FrameBus:
+    """
+    Fixed pool of reference-counted frame slots in shared memory.
+    channels: independent streams (e.g. one per drone), each with its own newest frame.
+    """
+
+    def __init__(self, slots=8, shape=FRAME_SHAPE, channels=1):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.channels = channels
+        size = self._layout()
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        # Forked children inherit this object as is: only the creating process unlinks
+        self._owner = os.getpid()
+        self._cond = multiprocessing.Condition()
+        self._attach()
+        self._slot_info[:] = 0
+        self._slot_info[:, _SEQ] = -1
+        self._channel_info[:] = 0
+        self._channel_info[:, _LATEST] = -1
+        self._channel_info[:, _LATEST_SEQ] = -1
+
+    def _layout(self):
+        # Headers first, frames 64-byte aligned after them
+        self._slot_bytes = self.slots * 3 * 8
+        self._time_bytes = self.slots * 8
+        self._channel_bytes = self.channels * 4 * 8
+        header = self._slot_bytes + self._time_bytes + self._channel_bytes
+        self._frames_offset = (header + 63) // 64 * 64
+        return self._frames_offset + self.slots * int(np.prod(self.shape))
+
+    def _attach(self):
+        buf = self._shm.buf
+        offset = 0
+        self._slot_info = np.ndarray((self.slots, 3), np.int64, buf, offset)
+        offset += self._slot_bytes
+        self._slot_time = np.ndarray((self.slots,), np.float64, buf, offset)
+        offset += self._time_bytes
+        self._channel_info = np.ndarray((self.channels, 4), np.int64, buf, offset)
+        self.images = np.ndarray((self.slots,) + self.shape, np.uint8, buf, self._frames_offset)
+        self._next = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'slots': self.slots, 'shape': self.shape,
+                'channels': self.channels, 'cond': self._cond}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.shape = state['shape']
+        self.channels = state['channels']
+        self._cond = state['cond']
+        self._layout()
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self._attach()
+
+    def close(self):
+        """Detaches this process; the creating process also frees the memory."""
+        if self._shm is None:
+            return
+        self._slot_info = self._slot_time = self._channel_info = self.images = None
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+    # Producer side
+
+    def acquire(self, channel=0):
+        """
+        Returns a free slot to write the next frame of channel into, or None
+        when every slot is referenced (the frame is counted as dropped).
+        """
+        with self._cond:
+            for i in range(self.slots):
+                slot = (self._next + i) % self.slots
+                if self._slot_info[slot, _REFS] == 0:
+                    self._next = slot + 1
+                    self._slot_info[slot] = (1, -1, channel)
+                    return BusFrame(self, slot, -1, 0.0, channel)
+            self._channel_info[channel, _DROPPED] += 1
+        return None
+
+    def publish(self, frame, seq, timestamp=None):
+        """Makes a written slot the newest frame of its channel and wakes up the readers."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        slot = frame.slot
+        channel = frame.channel
+        frame.seq = seq
+        frame.timestamp = timestamp
+        frame.image = None
+        with self._cond:
+            info = self._channel_info[channel]
+            self._slot_info[slot, _SEQ] = seq
+            self._slot_time[slot] = timestamp
+            # The producer's reference becomes the channel's
+            previous = info[_LATEST]
+            info[_LATEST] = slot
+            info[_LATEST_SEQ] = seq
+            info[_PUBLISHED] += 1
+            if previous >= 0:
+                self._slot_info[previous, _REFS] -= 1
+            self._cond.notify_all()
+
+    def abandon(self, frame):
+        """Gives back an acquired slot without publishing it (e.g. the decode failed)."""
+        frame.release()
+
+    # Consumer side
+
+    def _frame(self, channel):
+        # Called with the lock held
+        slot = int(self._channel_info[channel, _LATEST])
+        if slot < 0:
+            return None
+        self._slot_info[slot, _REFS] += 1
+        return BusFrame(self, slot, int(self._slot_info[slot, _SEQ]), float(self._slot_time[slot]), channel)
+
+    def latest(self, channel=0):
+        """Returns the newest frame of channel (release it after use), or None."""
+        with self._cond:
+            return self._frame(channel)
+
+    def wait_next(self, channel=0, after_seq=-1, timeout=None):
+        """Waits for a frame of channel newer than after_seq. Returns it (release it after use), or None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._channel_info[channel, _LATEST_SEQ] > after_seq, timeout):
+                return None
+            return self._frame(channel)
+
+    def _decref(self, slot):
+        with self._cond:
+            self._slot_info[slot, _REFS] -= 1
+
+    def stats(self):
+        """Returns the slots in use and the published/dropped frames of every channel."""
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'slots_in_use': int(np.count_nonzero(self._slot_info[:, _REFS])),
+                'channels': [
+                    {'seq': int(info[_LATEST_SEQ]), 'published': int(info[_PUBLISHED]), 'dropped': int(info[_DROPPED])}
+                    for info in self._channel_info
+                ],
+            }
+
+
+def capture_into(bus, address, channel=0, stop=None, on_failure=None):
+    """
+    Decodes a video stream into the bus until stop (a multiprocessing.Event) is set.
+    cap.read() decodes straight into the acquired slot. on_failure() is called
+    for every failed open or read.
+    """
+    cap = cv2.VideoCapture()
+    # Opening fails when the probe sees no SPS, e.g. when joining between two keyframes
+    while not cap.open(address):
+        if stop is None or stop.is_set():
+            return
+        if on_failure is not None:
+            on_failure()
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    height, width = bus.shape[:2]
+    seq = 0
+    while stop is None or not stop.is_set():
+        frame = bus.acquire(channel)
+        if frame is None:
+            # Every slot is held by a reader: skip this frame
+            if not cap.grab():
+                if on_failure is not None:
+                    on_failure()
+                time.sleep(0.005)
+            continue
+        ret, image = cap.read(frame.image)
+        if not ret or image is None or image.size == 0:
+            bus.abandon(frame)
+            if on_failure is not None:
+                on_failure()
+            time.sleep(0.005)
+            continue
+        if image.shape != bus.shape:
+            # Not the bus size: OpenCV allocated a new array
+            cv2.resize(image, (width, height), dst=frame.image)
+        seq += 1
+        bus.publish(frame, seq)
+    cap.release()
+
+
+def _detect_process(bus, results, stop):
+    tracker = LineTracker(*DEFAULT_BOUNDS, tracking=True)
+    seq = -1
+    while not stop.is_set():
+        frame = bus.wait_next(0, seq, timeout=0.5)
+        if frame is None:
+            continue
+        with frame:
+            seq = frame.seq
+            detection = tracker.process(frame.image)
+        results.put((seq, detection))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Line trace with capture, detection and display in separate processes")
+    parser.add_argument('--address', default=TELLO_CAMERA_ADDRESS, help="video stream to open")
+    args = parser.parse_args()
+
+    bus = FrameBus()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=capture_into, args=(bus, args.address, 0, stop), daemon=True),
+        multiprocessing.Process(target=_detect_process, args=(bus, results, stop), daemon=True),
+    ]
+    for process in processes:
+        process.start()
+
+    detection = None
+    seq = -1
+    try:
+        while True:
+            try:
+                while True:
+                    _, detection = results.get_nowait()
+            except queue.Empty:
+                pass
+            frame = bus.wait_next(0, seq, timeout=1.0)
+            if frame is None:
+                print("No video.")
+                continue
+            with frame:
+                seq = frame.seq
+                # Draw on a copy: the slot may be read by the other processes
+                image = cv2.resize(frame.image, SMALL_SIZE)
+            if detection is not None and detection.found:
+                cv2.circle(image, (detection.mx, ROI[0].start + detection.my), 5, (0, 0, 255), -1)
+            cv2.imshow("frame_bus", image)
+            if cv2.waitKey(1) == 27:
+                break
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for process in processes:
+        process.join(timeout=3.0)
+        if process.is_alive():
+            process.terminate()
+    print(bus.stats())
+    bus.close()
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
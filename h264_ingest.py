@@ -0,0 +1,514 @@
+"""
+Native H.264 ingest: the video datagrams are read, reassembled and decoded
+here instead of inside OpenCV's FFmpeg backend.
+
+    cap = H264Capture(11111)            # same interface as cv2.VideoCapture
+    ret, image = cap.read()
+    cap.last_unit.received              # arrival of the frame's first datagram
+
+or FrameGrabber(backend='native'). The receiver thread reassembles the
+datagrams into access units: the Tello sends each frame as datagrams of
+VIDEO_PACKET_SIZE bytes and a shorter last one, so a frame is complete as
+soon as its last datagram arrives. A frame whose last datagram was lost is
+closed when the next frame starts. The slice headers are parsed just enough
+to follow frame_num, which tells how many frames were lost on the way.
+Decoders are pluggable (DECODERS); the default one uses PyAV (pip install av)
+with the low-delay flags and slice threads, so no frame is held back.
+"""
+import socket
+import threading
+import time
+from collections import deque, namedtuple
+from urllib.parse import urlsplit
+
+from instrumentation import counter, gauge, histogram
+from recorder import VIDEO_PACKET_SIZE
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Local port the Tello streams to
+VIDEO_PORT = 11111
+
+# NAL unit types
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+# NAL units that can only appear at the start of an access unit
+_AU_START_TYPES = (NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD)
+
+# Profiles whose SPS carries the chroma format and scaling lists
+_HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+# Access units waiting to be decoded before the oldest are dropped
+MAX_QUEUED_UNITS = 60
+
+# One reassembled frame.
+# data: the access unit in Annex B format, received / completed: time.monotonic()
+# of its first and last datagram, keyframe: contains an IDR slice, frame_num:
+# from the first slice header (None until an SPS was seen), lost_before: frames
+# missing between the previous unit and this one (lost on the network, or reference
+# frames dropped from a full H264Receiver queue), truncated: closed without its
+# short last datagram (some of its data may be missing).
+AccessUnit = namedtuple('AccessUnit', ['seq', 'data', 'received', 'completed', 'nal_types',
+                                       'keyframe', 'reference', 'frame_num', 'lost_before', 'truncated'])
+
+# Metrics (see instrumentation.py)
+video_packets = counter('video.packets')
+video_units = counter('video.access_units')
+video_keyframes = counter('video.keyframes')
+video_frames_lost = counter('video.frames_lost')
+video_units_truncated = counter('video.units_truncated')
+video_units_dropped = counter('video.units_dropped')
+video_decode_errors = counter('video.decode_errors')
+video_reassembly = histogram('video.reassembly')
+video_decode = histogram('video.decode')
+video_keyframe_interval = histogram('video.keyframe_interval')
+video_queue = gauge('video.queue')
+
+
+def video_port(address):
+    """Local port of an OpenCV stream address such as 'udp://@0.0.0.0:11111?...'."""
+    return urlsplit(address).port or VIDEO_PORT
+
+
+def split_nal_units(data):
+    """Returns (start, end) of every NAL unit in Annex B data, without the start codes."""
+    units = []
+    find = data.find
+    pos = find(b'\x00\x00\x01')
+    while pos >= 0:
+        start = pos + 3
+        pos = find(b'\x00\x00\x01', start)
+        end = len(data) if pos < 0 else pos
+        # A 4-byte start code leaves its leading zero at the end of the previous unit
+        if pos >= 0 and data[end - 1] == 0:
+            end -= 1
+        if end > start:
+            units.append((start, end))
+    return units
+
+
+def contains_slice(data):
+    """True if Annex B data contains a slice NAL unit, i.e. picture data rather than only headers."""
+    pos = data.find(b'\x00\x00\x01')
+    while 0 <= pos < len(data) - 3:
+        if data[pos + 3] & 0x1f in (NAL_SLICE, NAL_IDR):
+            return True
+        pos = data.find(b'\x00\x00\x01', pos + 3)
+    return False
+
+
+class _BitReader:
+    """Exp-Golomb reader over the RBSP of a NAL unit (emulation prevention bytes removed)."""
+
+    def __init__(self, data):
+        self.data = data.replace(b'\x00\x00\x03', b'\x00\x00')
+        self.pos = 0
+
+    def u(self, n):
+        value = 0
+        for _ in range(n):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("Invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+# What the slice headers need from a sequence parameter set
+SpsInfo = namedtuple('SpsInfo', ['sps_id', 'profile', 'log2_max_frame_num', 'separate_colour_plane'])
+
+
+def parse_sps(nal):
+    """Parses an SPS NAL unit (with its header byte). Returns SpsInfo, or None if malformed."""
+    try:
+        bits = _BitReader(bytes(nal[1:64]))
+        profile = bits.u(8)
+        bits.u(16)                          # constraint flags, level
+        sps_id = bits.ue()
+        separate_colour_plane = 0
+        if profile in _HIGH_PROFILES:
+            chroma_format = bits.ue()
+            if chroma_format == 3:
+                separate_colour_plane = bits.u(1)
+            bits.ue()                       # bit depth luma
+            bits.ue()                       # bit depth chroma
+            bits.u(1)                       # qpprime_y_zero_transform_bypass
+            if bits.u(1):                   # seq_scaling_matrix_present
+                for i in range(12 if chroma_format == 3 else 8):
+                    if bits.u(1):
+                        last = next_scale = 8
+                        for _ in range(16 if i < 6 else 64):
+                            if next_scale:
+                                next_scale = (last + bits.se()) % 256
+                            last = next_scale or last
+        return SpsInfo(sps_id, profile, bits.ue() + 4, separate_colour_plane)
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_slice_header(nal, sps):
+    """Returns (first_mb_in_slice, frame_num) of a slice NAL unit; frame_num is None without sps."""
+    try:
+        bits = _BitReader(bytes(nal[1:16]))
+        first_mb = bits.ue()
+        if sps is None:
+            return first_mb, None
+        bits.ue()                           # slice_type
+        bits.ue()                           # pic_parameter_set_id
+        if sps.separate_colour_plane:
+            bits.u(2)
+        return first_mb, bits.u(sps.log2_max_frame_num)
+    except (IndexError, ValueError):
+        return None, None
+
+
+class AccessUnitAssembler:
+    """
+    Turns video datagrams into AccessUnits (see the module docstring).
+    feed() returns the units completed by a datagram, usually zero or one.
+    """
+
+    def __init__(self, packet_size=VIDEO_PACKET_SIZE):
+        self.packet_size = packet_size
+        self.sps = None
+        self._parts = []
+        self._received = None
+        self._has_slice = False
+        self._prev_ref_frame_num = None
+        self._seq = 0
+        self._last_keyframe = None
+
+        # Statistics
+        self.packets = 0
+        self.units = 0
+        self.keyframes = 0
+        self.frames_lost = 0
+        self.units_truncated = 0
+
+    def feed(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.packets += 1
+        video_packets.inc()
+        units = []
+        if self._parts and self._has_slice and self._starts_unit(data):
+            # The short datagram that ends the previous frame was lost
+            units.append(self._complete(timestamp, truncated=True))
+        if not self._parts:
+            self._received = timestamp
+        self._parts.append(data)
+        self._has_slice = self._has_slice or contains_slice(data)
+        if len(data) < self.packet_size:
+            units.append(self._complete(timestamp, truncated=False))
+        return units
+
+    def _starts_unit(self, data):
+        # Frames start at a datagram boundary: AUD/SPS/PPS/SEI, or the first slice of a picture
+        if data[:3] == b'\x00\x00\x01':
+            header = 3
+        elif data[:4] == b'\x00\x00\x00\x01':
+            header = 4
+        else:
+            return False
+        if len(data) <= header + 1:
+            return False
+        nal_type = data[header] & 0x1f
+        if nal_type in _AU_START_TYPES:
+            return True
+        # first_mb_in_slice == 0 is coded as a single 1 bit
+        return nal_type in (NAL_SLICE, NAL_IDR) and data[header + 1] & 0x80 != 0
+
+    def _complete(self, timestamp, truncated):
+        data = b''.join(self._parts)
+        received = self._received
+        self._parts = []
+        self._has_slice = False
+
+        nal_types = []
+        keyframe = False
+        reference = False
+        frame_num = None
+        for start, end in split_nal_units(data):
+            header = data[start]
+            nal_type = header & 0x1f
+            nal_types.append(nal_type)
+            if nal_type == NAL_SPS:
+                sps = parse_sps(data[start:end])
+                if sps is not None:
+                    self.sps = sps
+            elif nal_type in (NAL_SLICE, NAL_IDR) and frame_num is None:
+                keyframe = nal_type == NAL_IDR
+                reference = header & 0x60 != 0
+                _, frame_num = parse_slice_header(data[start:end], self.sps)
+
+        lost = 0
+        if frame_num is not None:
+            if keyframe:
+                self._prev_ref_frame_num = None
+            elif self._prev_ref_frame_num is not None:
+                # Every picture carries the frame_num of the previous reference picture + 1
+                max_frame_num = 1 << self.sps.log2_max_frame_num
+                lost = (frame_num - self._prev_ref_frame_num - 1) % max_frame_num
+            if reference:
+                self._prev_ref_frame_num = frame_num
+
+        self._seq += 1
+        unit = AccessUnit(self._seq, data, received, timestamp, tuple(nal_types),
+                          keyframe, reference, frame_num, lost, truncated)
+        self.units += 1
+        video_units.inc()
+        video_reassembly.record(timestamp - received)
+        if keyframe:
+            self.keyframes += 1
+            video_keyframes.inc()
+            if self._last_keyframe is not None:
+                video_keyframe_interval.record(received - self._last_keyframe)
+            self._last_keyframe = received
+        if lost:
+            self.frames_lost += lost
+            video_frames_lost.inc(lost)
+        if truncated:
+            self.units_truncated += 1
+            video_units_truncated.inc()
+        return unit
+
+    def stats(self):
+        """Returns the reassembly counters as a dictionary."""
+        return {
+            'packets': self.packets,
+            'units': self.units,
+            'keyframes': self.keyframes,
+            'frames_lost': self.frames_lost,
+            'units_truncated': self.units_truncated,
+        }
+
+
+class PyAVDecoder:
+    """
+    libavcodec through PyAV, tuned for latency: low_delay and fast flags,
+    slice threads only (frame threads hold frames back).
+    A decoder takes access units with decode(data) and returns the decoded
+    pictures; convert(picture) turns a picture into a BGR image.
+    """
+
+    def __init__(self, threads=0):
+        if av is None:
+            raise RuntimeError("The native video ingest needs PyAV (pip install av)")
+        from av.codec.context import Flags, Flags2
+        self.codec = av.CodecContext.create('h264', 'r')
+        self.codec.flags |= Flags.low_delay
+        self.codec.flags2 |= Flags2.fast
+        self.codec.thread_type = 'SLICE'
+        self.codec.thread_count = threads
+        self.errors = 0
+
+    def decode(self, data):
+        try:
+            return self.codec.decode(av.Packet(data))
+        except av.error.FFmpegError:
+            self.errors += 1
+            return []
+
+    def convert(self, picture):
+        return picture.to_ndarray(format='bgr24')
+
+    def flush(self):
+        """Drops the reference frames, e.g. before decoding from the next keyframe."""
+        self.codec.flush_buffers()
+
+
+# Decoders of H264Capture, by name
+DECODERS = {
+    'pyav': PyAVDecoder,
+}
+
+
+class H264Receiver:
+    """Receives the video datagrams on its own thread and queues the reassembled AccessUnits."""
+
+    def __init__(self, port=VIDEO_PORT, packet_size=VIDEO_PACKET_SIZE, max_queued=MAX_QUEUED_UNITS):
+        self.port = port
+        self.assembler = AccessUnitAssembler(packet_size)
+        self._units = deque()
+        self.max_queued = max_queued
+        self._cond = threading.Condition()
+        self.sock = None
+        self._thread = None
+
+        # Statistics
+        self.units_dropped = 0
+
+    def start(self):
+        """Binds the video port and starts the receiver thread. Returns False if the port is taken."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        try:
+            self.sock.bind(('', self.port))
+        except OSError as e:
+            print(f"Error binding to video port {self.port}: {e}")
+            self.sock.close()
+            self.sock = None
+            return False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def close(self):
+        """Closes the socket, which also ends the receiver thread."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        sock = self.sock
+        while True:
+            try:
+                data, server = sock.recvfrom(2048)
+            except OSError:
+                break
+            units = self.assembler.feed(data)
+            if units:
+                self.put(units)
+
+    def put(self, units):
+        """
+        Queues reassembled AccessUnits, dropping the oldest when more than
+        max_queued wait. The reference frames dropped that way are added to the
+        lost_before of the next queued unit, like frames lost on the network.
+        """
+        with self._cond:
+            self._units.extend(units)
+            while len(self._units) > self.max_queued:
+                # The decoder does not keep up; the next keyframe repairs the picture
+                dropped = self._units.popleft()
+                self.units_dropped += 1
+                video_units_dropped.inc()
+                lost = dropped.lost_before + (1 if dropped.reference else 0)
+                if lost:
+                    head = self._units[0]
+                    self._units[0] = head._replace(lost_before=head.lost_before + lost)
+            video_queue.set(len(self._units))
+            self._cond.notify_all()
+
+    def get_all(self, timeout=None):
+        """Waits for at least one AccessUnit and returns all queued ones ([] on timeout or close)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._units or self.sock is None, timeout)
+            units = list(self._units)
+            self._units.clear()
+            video_queue.set(0)
+        return units
+
+
+class H264Capture:
+    """
+    Drop-in replacement for cv2.VideoCapture on the Tello video port.
+    read() decodes every queued access unit and returns the newest picture,
+    so it never falls behind the stream. last_unit is the AccessUnit of the
+    returned image. With a stream_health.StreamHealth, units that cannot be
+    decoded cleanly are dropped before the decoder.
+    """
+
+    def __init__(self, port=VIDEO_PORT, decoder='pyav', read_timeout=1.0, health=None):
+        self.port = port
+        self.decoder_name = decoder
+        self.read_timeout = read_timeout
+        self.health = health
+        self.receiver = None
+        self.decoder = None
+        self.last_unit = None
+
+        # Statistics
+        self.pictures_skipped = 0
+        self.open()
+
+    def open(self, port=None):
+        """(Re)binds the video port; like cv2.VideoCapture.open() it also takes a stream address."""
+        if port is not None:
+            self.port = video_port(port) if isinstance(port, str) else port
+        self.release()
+        receiver = H264Receiver(self.port)
+        if not receiver.start():
+            return False
+        self.receiver = receiver
+        self.decoder = DECODERS[self.decoder_name]()
+        return True
+
+    def isOpened(self):
+        return self.receiver is not None
+
+    def set(self, prop, value):
+        # Nothing is buffered beyond the access unit queue
+        return False
+
+    def read(self):
+        """Returns (True, BGR image) of the newest picture, or (False, None) after read_timeout."""
+        if self.receiver is None:
+            return False, None
+        deadline = time.monotonic() + self.read_timeout
+        health = self.health
+        while True:
+            if health is not None:
+                health.poll()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False, None
+            units = self.receiver.get_all(min(remaining, 0.1) if health is not None else remaining)
+            picture = None
+            for unit in units:
+                if health is not None and not health.admit(unit):
+                    continue
+                start = time.perf_counter()
+                errors = self.decoder.errors
+                pictures = self.decoder.decode(unit.data)
+                video_decode.record(time.perf_counter() - start)
+                if self.decoder.errors != errors:
+                    video_decode_errors.inc()
+                    if health is not None:
+                        health.break_chain()
+                        continue
+                if pictures:
+                    if picture is not None:
+                        self.pictures_skipped += 1
+                    picture = pictures[-1]
+                    self.last_unit = unit
+            if picture is not None:
+                return True, self.decoder.convert(picture)
+
+    def release(self):
+        if self.receiver is not None:
+            self.receiver.close()
+            self.receiver = None
+
+    def stats(self):
+        """Returns the reassembly and decode counters as a dictionary."""
+        result = self.receiver.assembler.stats() if self.receiver is not None else {}
+        if self.receiver is not None:
+            result['units_dropped'] = self.receiver.units_dropped
+        if self.decoder is not None:
+            result['decode_errors'] = self.decoder.errors
+        result['pictures_skipped'] = self.pictures_skipped
+        if self.health is not None:
+            result['health'] = self.health.stats()
+        return result
@@ -0,0 +1,334 @@
+"""
+Low-overhead metrics shared by the networking, capture and vision code.
+
+    from instrumentation import counter, histogram, span
+
+    frames = counter('video.frames')
+    frames.inc()
+    with span('vision.detect'):
+        ...
+
+Counters also keep their rate over the last second, histograms record
+durations (s) in log-linear buckets (HDR style, about 6% resolution) so
+percentiles stay cheap at any volume. Everything registers in the module
+registry, which StatsServer serves as JSON (/stats) and Prometheus text
+(/metrics) and draw_overlay() puts on a camera image.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+# Default port of StatsServer (only bound on localhost)
+STATS_PORT = 8765
+
+# Histogram layout: values in microseconds, 2 ** SUB_BITS buckets per power of two
+SUB_BITS = 4
+_SUB_COUNT = 1 << SUB_BITS
+_MAX_SHIFT = 40
+_BUCKETS = (_MAX_SHIFT + 2) * _SUB_COUNT
+
+
+class Counter:
+    """Monotonic count with the rate (per second) of the last full second."""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._rate = 0.0
+
+    def inc(self, n=1):
+        now = time.monotonic()
+        with self._lock:
+            self.value += n
+            self._window_count += n
+            elapsed = now - self._window_start
+            if elapsed >= 1.0:
+                self._rate = self._window_count / elapsed
+                self._window_start = now
+                self._window_count = 0
+
+    def rate(self):
+        """Events per second over the last second (0 when nothing happened for 2 s)."""
+        if time.monotonic() - self._window_start > 2.0:
+            return 0.0
+        return self._rate
+
+
+class Gauge:
+    """Last value of a measurement."""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Distribution of durations (s) in log-linear microsecond buckets."""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(us):
+        shift = us.bit_length() - SUB_BITS - 1
+        if shift <= 0:
+            return us
+        if shift > _MAX_SHIFT:
+            return _BUCKETS - 1
+        return ((shift + 1) << SUB_BITS) + (us >> shift) - _SUB_COUNT
+
+    @staticmethod
+    def _value(index):
+        # Middle of the bucket, in seconds
+        if index < 2 * _SUB_COUNT:
+            return index * 1e-6
+        shift = (index >> SUB_BITS) - 1
+        low = ((index & (_SUB_COUNT - 1)) + _SUB_COUNT) << shift
+        return (low + (1 << shift) / 2) * 1e-6
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        if us < 0:
+            us = 0
+        index = self._index(us)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        """Returns the q-th percentile (0-100) in seconds, or None when empty."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = max(1, int(round(q / 100.0 * self.count)))
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= target:
+                    return min(self._value(index), self.max)
+        return self.max
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * _BUCKETS
+            self.count = 0
+            self.total = 0.0
+            self.min = self.max = None
+
+    def summary(self):
+        """count, mean and percentiles in milliseconds."""
+        if self.count == 0:
+            return {'count': 0}
+        result = {'count': self.count, 'mean_ms': self.total / self.count * 1000.0,
+                  'min_ms': self.min * 1000.0, 'max_ms': self.max * 1000.0}
+        for q in (50, 90, 99):
+            result[f'p{q}_ms'] = self.percentile(q) * 1000.0
+        return result
+
+
+class Span:
+    """Context manager recording the monotonic time spent in a block into a Histogram."""
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """Named counters, gauges and histograms. Getting a metric creates it once."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def _get(self, table, cls, name):
+        metric = table.get(name)
+        if metric is None:
+            with self._lock:
+                metric = table.setdefault(name, cls(name))
+        return metric
+
+    def counter(self, name):
+        return self._get(self.counters, Counter, name)
+
+    def gauge(self, name):
+        return self._get(self.gauges, Gauge, name)
+
+    def histogram(self, name):
+        return self._get(self.histograms, Histogram, name)
+
+    def span(self, name):
+        return Span(self.histogram(name))
+
+    def snapshot(self):
+        """Returns every metric as a JSON-serialisable dictionary."""
+        return {
+            'time': time.time(),
+            'counters': {name: {'value': c.value, 'rate': c.rate()} for name, c in sorted(self.counters.items())},
+            'gauges': {name: g.value for name, g in sorted(self.gauges.items())},
+            'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+        }
+
+    def prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for name, c in sorted(self.counters.items()):
+            metric = _prometheus_name(name)
+            lines.append(f'# TYPE {metric}_total counter')
+            lines.append(f'{metric}_total {c.value}')
+        for name, g in sorted(self.gauges.items()):
+            metric = _prometheus_name(name)
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {g.value}')
+        for name, h in sorted(self.histograms.items()):
+            metric = _prometheus_name(name) + '_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for q in (50, 90, 99):
+                value = h.percentile(q)
+                if value is not None:
+                    lines.append(f'{metric}{{quantile="{q / 100.0}"}} {value:.6f}')
+            lines.append(f'{metric}_sum {h.total:.6f}')
+            lines.append(f'{metric}_count {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_name(name):
+    return 'tello_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+# Registry used by all modules
+registry = Registry()
+
+
+def counter(name):
+    return registry.counter(name)
+
+
+def gauge(name):
+    return registry.gauge(name)
+
+
+def histogram(name):
+    return registry.histogram(name)
+
+
+def span(name):
+    return registry.span(name)
+
+
+# Overlay lines: (label, kind, metric name). 'rate' shows a counter's rate,
+# 'p50'/'p99' a histogram percentile in ms.
+DEFAULT_OVERLAY = (
+    ('FPS', 'rate', 'video.frames'),
+    ('Loop p99', 'p99', 'loop.time'),
+    ('RC/s', 'rate', 'net.rc_sent'),
+    ('RTT p50', 'p50', 'net.command_rtt'),
+)
+
+
+def overlay_lines(items=DEFAULT_OVERLAY, source=None):
+    """Formats the overlay items of metrics that exist, one string per item."""
+    source = source or registry
+    lines = []
+    for label, kind, name in items:
+        if kind == 'rate':
+            metric = source.counters.get(name)
+            if metric is not None:
+                lines.append(f"{label}:{metric.rate():.1f}")
+        else:
+            metric = source.histograms.get(name)
+            value = metric.percentile(int(kind[1:])) if metric is not None else None
+            if value is not None:
+                lines.append(f"{label}:{value * 1000.0:.1f}ms")
+    return lines
+
+
+def draw_overlay(image, org=(10, 100), items=DEFAULT_OVERLAY, source=None):
+    """Draws the overlay lines on image, below org, in the style of the status texts."""
+    x, y = org
+    for line in overlay_lines(items, source):
+        cv2.putText(image, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        y += 20
+    return image
+
+
+class _StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/metrics'):
+            body = self.server.registry.prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path.startswith('/stats') or self.path == '/':
+            body = json.dumps(self.server.registry.snapshot()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the console for the flight output
+        pass
+
+
+class StatsServer:
+    """Serves a Registry on http://127.0.0.1:<port>/stats (JSON) and /metrics (Prometheus)."""
+
+    def __init__(self, port=STATS_PORT, source=None, host='127.0.0.1'):
+        self.address = (host, port)
+        self.registry = source or registry
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        try:
+            self._server = ThreadingHTTPServer(self.address, _StatsHandler)
+        except OSError as e:
+            print(f"Error starting the stats server: {e}")
+            return False
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
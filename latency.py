@@ -0,0 +1,174 @@
+"""
+Glass-to-actuation latency tracing.
+
+Each traced frame carries time stamps (time.monotonic()) from the arrival of
+its first UDP datagram, through decoding and every processing stage, to the
+moment the rc command derived from it leaves the socket:
+
+    trace = tracer.begin(frame.seq, frame.timestamp, frame.received)
+    tracker.process(image, trace)           # stamps resize, classify, ...
+    controller.set_measurement(mx, trace=trace)
+    ...                                     # the control thread stamps its tick
+    sock.sendto(rc, address)
+    tracer.finish(trace)
+
+The tracer keeps one distribution per segment (receive->decode,
+decode->resize, ...) and for the whole chain, writes every trace as a JSON
+line when given a path, and summarises the flight with summary().
+The arrival time of a decoded frame comes from the native ingest
+(h264_ingest.H264Capture.last_unit), or from a ReceiptClock when OpenCV decodes.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from h264_ingest import contains_slice
+from instrumentation import Histogram, histogram
+from recorder import VIDEO_PACKET_SIZE
+
+
+class ReceiptClock:
+    """
+    Arrival time of the first datagram of each video frame, fed by VideoRelay,
+    for decoders that do not tell which frame they returned (cv2.VideoCapture).
+    match() gives a decoded frame the newest frame that was completely received
+    by the time it was decoded, and drops the older receipts. Frames the
+    decoder never produced (before the first keyframe, corrupt, dropped on
+    overrun) are skipped instead of shifting every later match by one frame;
+    while the decoder lags behind the stream the latency is underestimated by
+    that lag. Receipts older than max_delay are never matched.
+    """
+
+    def __init__(self, max_delay=2.0):
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = deque()         # (first datagram, last datagram) times
+        self._frame_start = None
+        self._has_slice = False
+
+        # Statistics
+        self.frames_received = 0
+        self.frames_unmatched = 0
+
+    def on_packet(self, data, timestamp=None):
+        """Called for every video datagram, in arrival order."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._frame_start is None:
+            self._frame_start = timestamp
+        self._has_slice = self._has_slice or contains_slice(data)
+        # The last datagram of a frame is shorter than the others; SPS/PPS
+        # datagrams are short too and belong to the frame that follows them
+        if len(data) < VIDEO_PACKET_SIZE and self._has_slice:
+            with self._lock:
+                self._pending.append((self._frame_start, timestamp))
+            self._frame_start = None
+            self._has_slice = False
+            self.frames_received += 1
+
+    def match(self, decoded_time):
+        """Returns the arrival time of the frame decoded at decoded_time, or None."""
+        with self._lock:
+            pending = self._pending
+            matched = None
+            while pending and pending[0][1] <= decoded_time:
+                if matched is not None:
+                    self.frames_unmatched += 1
+                matched = pending.popleft()
+            if matched is None:
+                return None
+            if matched[0] < decoded_time - self.max_delay:
+                self.frames_unmatched += 1
+                return None
+            return matched[0]
+
+
+class LatencyTrace:
+    """Time stamps of one frame, in the order they were taken."""
+    __slots__ = ('seq', 'stamps')
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.stamps = []
+
+    def mark(self, name, timestamp=None):
+        self.stamps.append((name, time.monotonic() if timestamp is None else timestamp))
+
+    def segments(self):
+        """Returns [(segment name, seconds)] between consecutive stamps."""
+        return [(f'{a}->{b}', tb - ta) for (a, ta), (b, tb) in zip(self.stamps, self.stamps[1:])]
+
+    def total(self):
+        return self.stamps[-1][1] - self.stamps[0][1] if len(self.stamps) > 1 else 0.0
+
+
+class LatencyTracer:
+    """Collects the LatencyTraces of a flight into per-segment distributions."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = open(path, 'w') if path else None
+        self._lock = threading.Lock()
+        self.segments = {}              # segment name -> Histogram
+        self.total = Histogram('latency.total')
+        # Same distribution in the live metrics (see instrumentation.py)
+        self._total_metric = histogram('latency.glass_to_command')
+
+        # Statistics
+        self.traces_finished = 0
+        self.traces_discarded = 0
+        self.traces_without_receipt = 0
+
+    def begin(self, seq, decoded, received=None):
+        """Starts the trace of a frame decoded at `decoded`, received at `received` if known."""
+        trace = LatencyTrace(seq)
+        if received is not None:
+            trace.mark('receive', received)
+        else:
+            self.traces_without_receipt += 1
+        trace.mark('decode', decoded)
+        return trace
+
+    def finish(self, trace, name='send'):
+        """Stamps the command send and records the trace."""
+        trace.mark(name)
+        total = trace.total()
+        with self._lock:
+            for segment, seconds in trace.segments():
+                hist = self.segments.get(segment)
+                if hist is None:
+                    hist = self.segments[segment] = Histogram('latency.' + segment)
+                hist.record(seconds)
+            self.total.record(total)
+            self.traces_finished += 1
+            if self._file is not None:
+                t0 = trace.stamps[0][1]
+                self._file.write(json.dumps({
+                    'seq': trace.seq,
+                    'total_ms': round(total * 1000.0, 3),
+                    'stamps_ms': {n: round((t - t0) * 1000.0, 3) for n, t in trace.stamps},
+                }) + '\n')
+        self._total_metric.record(total)
+
+    def discard(self, trace):
+        """Drops a trace whose frame did not lead to a command."""
+        self.traces_discarded += 1
+
+    def summary(self):
+        """Per-segment and total latency distributions of the flight (ms)."""
+        with self._lock:
+            return {
+                'traces': self.traces_finished,
+                'discarded': self.traces_discarded,
+                'without_receipt': self.traces_without_receipt,
+                'total': self.total.summary(),
+                'segments': {name: h.summary() for name, h in self.segments.items()},
+            }
+
+    def close(self):
+        """Writes the summary as the last line and closes the output."""
+        if self._file is not None:
+            self._file.write(json.dumps({'summary': self.summary()}) + '\n')
+            self._file.close()
+            self._file = None
@@ -0,0 +1,292 @@
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# Result of LineTracker.process(). x, y, w, h: bounding box of the largest blob,
+# area: its size in pixels, (mx, my): its centroid. Coordinates are in the ROI.
+# angle: direction of the line (deg from vertical, see line_angle()), if measured.
+Detection = namedtuple('Detection', ['found', 'x', 'y', 'w', 'h', 'area', 'mx', 'my', 'angle'],
+                       defaults=(0.0,))
+NO_DETECTION = Detection(False, 0, 0, 0, 0, 0, 0, 0)
+
+# HSV range of the yellow tiger rope used on the course
+DEFAULT_BOUNDS = ((20, 100, 100), (35, 255, 255))
+
+# Working size of the image and region of interest (rows, cols) in it
+SMALL_SIZE = (480, 360)
+ROI = (slice(250, 359), slice(0, 479))
+
+# Dilation strategies of LineTracker
+MORPHOLOGY_MODES = ('square', 'separable', 'pyramid')
+
+
+class HsvLookupTable:
+    """
+    BGR -> line mask classifier using a precomputed table.
+    cvtColor(BGR2BGR565) packs every pixel into a dense 16-bit index (5 bits
+    blue, 6 green, 5 red) in one pass; the mask of each of the 65536 colours is
+    computed once with cvtColor + inRange, so a frame then needs only a lookup
+    in a 64 KB table that stays in cache. The table is rebuilt only when the
+    HSV range changes.
+    """
+
+    def __init__(self):
+        self.table = np.zeros(1 << 16, np.uint8)
+        self.bounds = None
+
+        # BGR colour of every 16-bit code
+        codes = np.arange(1 << 16, dtype=np.uint16).view(np.uint8).reshape(256, 256, 2)
+        self._grid = cv2.cvtColor(codes, cv2.COLOR_BGR5652BGR)
+
+    def update(self, lower, upper):
+        """Rebuilds the table if the HSV range changed."""
+        bounds = (tuple(lower), tuple(upper))
+        if bounds == self.bounds:
+            return False
+        hsv = cv2.cvtColor(self._grid, cv2.COLOR_BGR2HSV)
+        self.table[:] = cv2.inRange(hsv, bounds[0], bounds[1]).reshape(-1)
+        self.bounds = bounds
+        return True
+
+    def apply(self, bgr_image, dst, packed_image, index):
+        """
+        Writes the mask of bgr_image into dst.
+        packed_image (uint8, 2 channels) and index (intp) are work buffers.
+        """
+        cv2.cvtColor(bgr_image, cv2.COLOR_BGR2BGR565, dst=packed_image)
+        # np.take() would copy other index types to intp on every call
+        np.copyto(index, packed_image.view(np.uint16)[..., 0])
+        np.take(self.table, index, out=dst)
+        return dst
+
+
+def line_angle(moments):
+    """
+    Angle (deg) of the principal axis of a blob from the image vertical,
+    positive when the top of the line leans to the right. moments: cv2.moments().
+    """
+    return -math.degrees(0.5 * math.atan2(2.0 * moments['mu11'], moments['mu02'] - moments['mu20']))
+
+
+def yaw_command(mx, center=240, deadband=50.0, limit=70.0):
+    """Proportional yaw command of the line trace: 0 inside the deadband, clamped to ±limit."""
+    dx = 1.0 * (center - mx)
+    d = 0.0 if abs(dx) < deadband else dx
+    d = -d
+    return int(max(-limit, min(limit, d)))
+
+
+class LineTracker:
+    """
+    Finds the line (largest blob inside an HSV range) in the bottom of the image.
+    All intermediate images are allocated once, process() only computes.
+    classifier: 'hsv' converts the ROI with cvtColor and thresholds it with inRange,
+                'lut' classifies the BGR pixels directly with an HsvLookupTable.
+    tracking:   once the line is found, only a track_width wide window around the
+                previous centroid is classified, dilated and measured with moments.
+                The whole ROI is labelled again when the track is lost, and at least
+                every relock_interval frames.
+    morphology: how the mask is dilated with the kernel_size square:
+                'square' in one pass, 'separable' as a 1 x k row pass followed by
+                a k x 1 column pass (same result), 'pyramid' at half resolution
+                with the mask upsampled afterwards (approximate, cheapest).
+    angle:      also measure the direction of the line from the blob moments.
+    """
+
+    def __init__(self, lower=(0, 0, 0), upper=(0, 0, 0), kernel_size=15, classifier='hsv',
+                 tracking=False, track_width=160, relock_interval=30, morphology='square', angle=False):
+        if classifier not in ('hsv', 'lut'):
+            raise ValueError(f"Unknown classifier: {classifier}")
+        if morphology not in MORPHOLOGY_MODES:
+            raise ValueError(f"Unknown morphology: {morphology}")
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+        self.kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        self.morphology = morphology
+        self.angle = angle
+        self.classifier = classifier
+        self.lut = HsvLookupTable() if classifier == 'lut' else None
+
+        width, height = SMALL_SIZE
+        rows = ROI[0].stop - ROI[0].start
+        cols = ROI[1].stop - ROI[1].start
+        self.small_image = np.empty((height, width, 3), np.uint8)
+        self.bgr_image = self.small_image[ROI]
+        self.hsv_image = np.empty((rows, cols, 3), np.uint8)
+        self.bin_image = np.empty((rows, cols), np.uint8)
+        self.dilation_image = np.empty((rows, cols), np.uint8)
+        self.masked_image = np.zeros((rows, cols, 3), np.uint8)
+        self.label_image = np.empty((rows, cols), np.int32)
+        if self.lut is not None:
+            self._packed_image = np.empty((rows, cols, 2), np.uint8)
+            self._lut_index = np.empty((rows, cols), np.intp)
+            self.lut.update(self.lower, self.upper)
+        if morphology == 'separable':
+            self._row_kernel = np.ones((1, kernel_size), np.uint8)
+            self._col_kernel = np.ones((kernel_size, 1), np.uint8)
+            self._row_image = np.empty((rows, cols), np.uint8)
+        elif morphology == 'pyramid':
+            # Half the radius at half the resolution; the kernel stays odd so it is centred
+            half = kernel_size // 2 | 1
+            self._half_kernel = np.ones((half, half), np.uint8)
+            self._half_bin_image = np.empty(((rows + 1) // 2, (cols + 1) // 2), np.uint8)
+            self._half_dilation_image = np.empty_like(self._half_bin_image)
+
+        self.tracking = tracking
+        self.track_width = track_width
+        self.relock_interval = relock_interval
+        self._locked_area = 0
+        self._frames_since_full = 0
+        self.frames_tracked = 0
+        self.frames_full = 0
+
+        self.detection = NO_DETECTION
+
+    def set_bounds(self, lower, upper):
+        """Changes the HSV range of the line."""
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+        if self.lut is not None:
+            self.lut.update(self.lower, self.upper)
+        # The old track may not match the new colour range
+        self._frames_since_full = self.relock_interval
+
+    def process(self, frame, trace=None):
+        """
+        Processes one BGR camera frame and returns the Detection.
+        trace: a latency.LatencyTrace to stamp after every stage, or None.
+        """
+        self.resize(frame)
+        if trace is not None:
+            trace.mark('resize')
+        self.detection = self.detect(trace)
+        return self.detection
+
+    def detect(self, trace=None):
+        """Finds the line in the resized image, tracking it when possible."""
+        if self.tracking and self.detection.found and self._frames_since_full < self.relock_interval:
+            detection = self.track()
+            if detection is not None:
+                if trace is not None:
+                    trace.mark('track')
+                self.frames_tracked += 1
+                self._frames_since_full += 1
+                return detection
+        # A lost track counts towards the classify stage
+        self.classify()
+        if trace is not None:
+            trace.mark('classify')
+        self.morph()
+        if trace is not None:
+            trace.mark('morph')
+        detection = self.label()
+        if trace is not None:
+            trace.mark('label')
+        self.frames_full += 1
+        self._frames_since_full = 0
+        self._locked_area = detection.area
+        return detection
+
+    # Stages of process(), usable on their own for benchmarking
+
+    def resize(self, frame):
+        cv2.resize(frame, SMALL_SIZE, dst=self.small_image)
+        return self.bgr_image
+
+    def classify(self, cols=slice(None)):
+        if self.lut is not None:
+            return self.lut.apply(self.bgr_image[:, cols], self.bin_image[:, cols],
+                                  self._packed_image[:, cols], self._lut_index[:, cols])
+        cv2.cvtColor(self.bgr_image[:, cols], cv2.COLOR_BGR2HSV, dst=self.hsv_image[:, cols])
+        cv2.inRange(self.hsv_image[:, cols], self.lower, self.upper, dst=self.bin_image[:, cols])
+        return self.bin_image
+
+    def morph(self, cols=slice(None)):
+        # Dilate to join the pieces of the tiger rope
+        src = self.bin_image[:, cols]
+        dst = self.dilation_image[:, cols]
+        if self.morphology == 'square':
+            cv2.dilate(src, self.kernel, dst=dst, iterations=1)
+        elif self.morphology == 'separable':
+            row_image = self._row_image[:, cols]
+            cv2.dilate(src, self._row_kernel, dst=row_image)
+            cv2.dilate(row_image, self._col_kernel, dst=dst)
+        else:
+            rows, width = src.shape
+            size = ((width + 1) // 2, (rows + 1) // 2)
+            half_bin = self._half_bin_image[:size[1], :size[0]]
+            half_dilation = self._half_dilation_image[:size[1], :size[0]]
+            # Nearest subsampling keeps the mask binary (INTER_AREA is several times slower)
+            cv2.resize(src, size, dst=half_bin, interpolation=cv2.INTER_NEAREST)
+            cv2.dilate(half_bin, self._half_kernel, dst=half_dilation)
+            cv2.resize(half_dilation, (width, rows), dst=dst, interpolation=cv2.INTER_NEAREST)
+        return self.dilation_image
+
+    def track(self):
+        """
+        Measures the line in a window around the previous centroid.
+        Returns None when the track is lost (too little of the line left in the window).
+        """
+        total_cols = self.bin_image.shape[1]
+        half = self.track_width // 2
+        c0 = max(0, self.detection.mx - half)
+        c1 = min(total_cols, self.detection.mx + half)
+        window = slice(c0, c1)
+        self.classify(window)
+        self.morph(window)
+
+        mask = self.dilation_image[:, window]
+        m = cv2.moments(mask, binaryImage=True)
+        area = int(m['m00'])
+        if area == 0 or area < self._locked_area // 4:
+            return None
+        x, y, w, h = cv2.boundingRect(mask)
+        # Nothing outside the window was computed this frame
+        self.dilation_image[:, :c0] = 0
+        self.dilation_image[:, c1:] = 0
+        angle = line_angle(m) if self.angle else 0.0
+        return Detection(True, c0 + x, y, w, h, area, c0 + int(m['m10'] / area), int(m['m01'] / area), angle)
+
+    def label(self):
+        num_labels, _, stats, center = cv2.connectedComponentsWithStats(
+            self.dilation_image, labels=self.label_image)
+        # Label 0 is the background
+        if num_labels < 2:
+            return NO_DETECTION
+        i = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        x, y, w, h, s = (int(v) for v in stats[i])
+        angle = 0.0
+        if self.angle:
+            blob = np.equal(self.label_image[y:y + h, x:x + w], i).view(np.uint8)
+            angle = line_angle(cv2.moments(blob, binaryImage=True))
+        return Detection(True, x, y, w, h, s, int(center[i][0]), int(center[i][1]), angle)
+
+    def stages(self):
+        """(name, function) of every stage, in order, for bench_vision.py."""
+        if self.tracking:
+            return [
+                ('resize', self.resize),
+                ('detect', lambda _: self._keep(self.detect())),
+            ]
+        return [
+            ('resize', self.resize),
+            ('classify', lambda _: self.classify()),
+            ('morph', lambda _: self.morph()),
+            ('label', lambda _: self.label()),
+        ]
+
+    def _keep(self, detection):
+        self.detection = detection
+        return detection
+
+    def render(self):
+        """
+        Masks the ROI with the detected area for display. Returns masked_image.
+        The HSV image is shown with the 'hsv' classifier, the BGR image with 'lut'.
+        """
+        source = self.hsv_image if self.lut is None else self.bgr_image
+        self.masked_image.fill(0)
+        cv2.bitwise_and(source, source, dst=self.masked_image, mask=self.dilation_image)
+        return self.masked_image
@@ -1,10 +1,25 @@
 import cv2
-import threading
+import os
 import time
 import sys
-from networking import TelloNetworking
+from async_client import AsyncTelloNetworking
 from movement import TelloMovement
+from capture import FrameGrabber, TELLO_CAMERA_ADDRESS
+from stream_health import StreamHealth
+from recorder import FlightRecorder, VideoRelay
+from instrumentation import StatsServer, draw_overlay, histogram
 from pynput import keyboard
+# Address of the drone (set TELLO_IP=127.0.0.1 to fly the simulator)
+TELLO_IP = os.environ.get('TELLO_IP', '192.168.10.1')
+# Set TELLO_RECORD=flight.log to record video, state and commands
+RECORD_PATH = os.environ.get('TELLO_RECORD')
+# Rate (Hz) at which rc commands are sent to the drone
+RC_RATE = 20
+# Set TELLO_STATS_PORT=8765 to serve the metrics on http://127.0.0.1:8765/stats and /metrics
+STATS_PORT = os.environ.get('TELLO_STATS_PORT')
+# Set TELLO_VIDEO_BACKEND=native to receive and decode the H.264 stream without OpenCV's FFmpeg URL
+VIDEO_BACKEND = os.environ.get('TELLO_VIDEO_BACKEND', 'opencv')
+
 key_states = {
         'w': False, 's': False, 'a': False, 'd': False, # Forward/Back, Left/Right
         'q': False, 'e': False,                         # Yaw (Rotation)
@@ -13,29 +28,46 @@ key_states = {
 
 def main():
     # Initialize networking and movement controllers
-    networking = TelloNetworking()
+    # Command replies, state and the connection watchdog all run on one event loop
+    networking = AsyncTelloNetworking(TELLO_IP)
     movement = TelloMovement(networking)
-
-    # Start the status receiving and asking threads
-    recv_thread = threading.Thread(target=networking.udp_receiver)
-    recv_thread.daemon = True
-    recv_thread.start()
+    networking.start()
+
+    recorder = relay = None
+    camera_address = TELLO_CAMERA_ADDRESS
+    if RECORD_PATH:
+        recorder = FlightRecorder(RECORD_PATH)
+        recorder.start()
+        networking.attach_recorder(recorder)
+        # The relay records the raw H.264 packets and forwards them to OpenCV
+        relay = VideoRelay(recorder)
+        relay.start()
+        camera_address = relay.capture_address
 
     if not networking.connect():
         sys.exit()
 
-    ask_thread = threading.Thread(target=networking.ask_status)
-    ask_thread.daemon = True
-    ask_thread.start()
+    stats_server = None
+    if STATS_PORT:
+        stats_server = StatsServer(int(STATS_PORT))
+        stats_server.start()
 
-    networking.send_command('streamon')
-    time.sleep(1)
+    # rc commands go out at a fixed rate, and immediately when the keys change
+    movement.start_rc_scheduler(RC_RATE)
 
-    TELLO_CAMERA_ADDRESS = 'udp://@0.0.0.0:11111?overrun_nonfatal=1&fifo_size=50000000'
-    cap = cv2.VideoCapture(TELLO_CAMERA_ADDRESS)
+    # Returns as soon as the drone answers 'ok'
+    if networking.execute('streamon') != 'ok':
+        print("Failed to start the video stream.")
 
-    if not cap.isOpened():
-        cap.open(TELLO_CAMERA_ADDRESS)
+    # Video is decoded on its own thread so a decode stall never delays rc output
+    # The native backend drops frames with a broken reference chain and asks for a keyframe
+    health = None
+    if VIDEO_BACKEND == 'native':
+        # Queued like any command so its reply cannot be taken for another one's;
+        # not resent, StreamHealth asks again after request_interval
+        health = StreamHealth(request_keyframe=lambda: networking.send_command('streamon', retries=0))
+    grabber = FrameGrabber(camera_address, backend=VIDEO_BACKEND, health=health)
+    grabber.start()
 
 
     listner = keyboard.Listener(on_press=on_press, on_release=on_release)
@@ -44,22 +76,37 @@ def main():
     command_text = "None"
     # Sensity of the movement
     SPEED = 50
+    # Control and display rate (Hz), independent of the video decode rate
+    LOOP_RATE = 30
+    loop_period = 1.0 / LOOP_RATE
+    next_tick = time.monotonic()
+    # Time spent in the loop body, without the waitKey wait
+    loop_time = histogram('loop.time')
     # Dictionary to keep track of which keys are currently pressed
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
-            networking.is_connected = False
-            frame = cv2.UMat(480, 640, cv2.CV_8UC3)
-            frame.setTo([0, 0, 0])
-
-        frame_resized = cv2.resize(frame, (frame.shape[1] // 2, frame.shape[0] // 2))
+        loop_start = time.perf_counter()
+        frame = grabber.latest()
+        # A video problem is not a lost drone: the command link has its own watchdog
+        video_status = grabber.status(frame)
+        if video_status == 'disconnected' or frame is None:
+            frame_resized = cv2.UMat(240, 320, cv2.CV_8UC3)
+            frame_resized.setTo([0, 0, 0])
+        else:
+            image = frame.image
+            frame_resized = cv2.resize(image, (image.shape[1] // 2, image.shape[0] // 2))
 
         # --- Handle Keyboard Input ---
-        # We use a longer waitKey time to allow for smoother control.
-        # This is also where we detect key releases (when key == -1)
-        # key = cv2.waitKey(20) & 0xFF
-        key_cv2 = cv2.waitKey(1) & 0xFF  # Use a shorter wait time for smoother control
+        # waitKey also paces the loop: wait for whatever is left of this tick
+        next_tick += loop_period
+        remaining = next_tick - time.monotonic()
+        if remaining < 0:
+            # We fell behind, do not try to catch up with a burst of ticks
+            next_tick = time.monotonic()
+            remaining = 0
+        work_time = time.perf_counter() - loop_start
+        key_cv2 = cv2.waitKey(max(1, int(remaining * 1000))) & 0xFF
+        loop_start = time.perf_counter()
 
         # --- Handle discrete commands first (takeoff, land, etc.) ---
         if key_cv2 == 27:  # ESC
@@ -116,7 +163,7 @@ def main():
         elif key_states['e']: # Rotate right
             yaw = SPEED
 
-        # Send the command to the drone
+        # Update the rc setpoint, the scheduler sends it to the drone
         movement.send_rc_control(lr, fb, ud, yaw)
 
         # Update command text for display
@@ -129,16 +176,35 @@ def main():
             cv2.putText(frame_resized, networking.battery_text, (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             cv2.putText(frame_resized, networking.time_text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             cv2.putText(frame_resized, networking.status_text, (10, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+            # FPS, loop time, rc rate and command round trip
+            draw_overlay(frame_resized, (10, 100))
         else:
             cv2.putText(frame_resized, "DRONE NOT CONNECTED!", (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        if video_status != 'ok':
+            cv2.putText(frame_resized, f"Video: {video_status}", (20, 220), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
 
         cv2.imshow('Tello Camera View', frame_resized)
+        loop_time.record(work_time + time.perf_counter() - loop_start)
 
     # --- Cleanup ---
     print("Landing and shutting down.")
-    movement.land()
-    networking.send_command('streamoff')
-    cap.release()
+    print(f"rc stats: {movement.rc_scheduler.stats()}")
+    movement.stop_rc_scheduler()
+    land_future = movement.land()
+    if land_future is not None:
+        try:
+            land_future.result()
+        except Exception as e:
+            print(e)
+    networking.execute('streamoff')
+    grabber.stop()
+    networking.stop()
+    if stats_server is not None:
+        stats_server.stop()
+    if recorder is not None:
+        relay.close()
+        recorder.stop()
+        print(f"Recorded {recorder.records_written} records ({recorder.records_dropped} dropped) to {RECORD_PATH}")
     cv2.destroyAllWindows()
     
     listner.stop()
@@ -1,6 +1,125 @@
+import threading
+import time
+
+# Default rate (Hz) at which the current rc setpoint is repeated to the drone
+RC_RATE_HZ = 20
+
+
+class RcScheduler:
+    """
+    Sends rc commands from a dedicated timer thread.
+    A new setpoint is sent immediately; an unchanged one is only repeated at the
+    fixed rate, so calling set() on every loop pass does not flood the radio.
+    """
+
+    def __init__(self, send, rate_hz=RC_RATE_HZ):
+        self._send = send
+        self.period = 1.0 / rate_hz
+
+        self._cond = threading.Condition()
+        self._setpoint = (0, 0, 0, 0)
+        self._changed = False
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.sent_immediate = 0
+        self.sent_periodic = 0
+        self.coalesced = 0
+        self._jitter_sum = 0.0
+        self._jitter_max = 0.0
+
+    def start(self):
+        """Starts the timer thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the timer thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def set(self, setpoint):
+        """Updates the setpoint. It is sent right away only if it changed."""
+        with self._cond:
+            if setpoint == self._setpoint:
+                self.coalesced += 1
+                return
+            if self._changed:
+                # The previous change was never sent, only the newest one matters
+                self.coalesced += 1
+            self._setpoint = setpoint
+            self._changed = True
+            self._cond.notify_all()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while True:
+            with self._cond:
+                timeout = next_time - time.monotonic()
+                if timeout > 0 and not self._changed and self._running:
+                    self._cond.wait(timeout)
+                if not self._running:
+                    break
+                changed = self._changed
+                self._changed = False
+                setpoint = self._setpoint
+
+            now = time.monotonic()
+            if changed:
+                self.sent_immediate += 1
+            elif now >= next_time:
+                # How late the periodic send is compared to its schedule
+                jitter = now - next_time
+                self._jitter_sum += jitter
+                self._jitter_max = max(self._jitter_max, jitter)
+                self.sent_periodic += 1
+            else:
+                continue
+            self._send(setpoint)
+            next_time = now + self.period
+
+    def stats(self):
+        """Returns send counters and the jitter of periodic sends (ms)."""
+        mean = self._jitter_sum / self.sent_periodic if self.sent_periodic else 0.0
+        return {
+            'rate_hz': 1.0 / self.period,
+            'sent_immediate': self.sent_immediate,
+            'sent_periodic': self.sent_periodic,
+            'coalesced': self.coalesced,
+            'jitter_mean_ms': mean * 1000.0,
+            'jitter_max_ms': self._jitter_max * 1000.0,
+        }
+
+
 class TelloMovement:
     def __init__(self, networking):
         self.networking = networking
+        self.rc_scheduler = None
+
+    def start_rc_scheduler(self, rate_hz=RC_RATE_HZ):
+        """
+        Sends rc commands at a fixed rate from a timer thread instead of on every
+        send_rc_control() call. Changed setpoints are still sent immediately.
+        """
+        self.rc_scheduler = RcScheduler(self._send_rc, rate_hz)
+        self.rc_scheduler.start()
+
+    def stop_rc_scheduler(self):
+        """Stops the rc timer thread; send_rc_control() sends directly again."""
+        if self.rc_scheduler is not None:
+            self.rc_scheduler.stop()
+            self.rc_scheduler = None
 
     def send_rc_control(self, left_right, forward_backward, up_down, yaw):
         """
@@ -11,25 +130,28 @@ class TelloMovement:
             up_down: -100 to 100
             yaw: -100 to 100
         """
-        command = f"rc {left_right} {forward_backward} {up_down} {yaw}"
-        # We don't want to print every rc command, so we call the base sender
-        try:
-            self.networking.sock.sendto(command.encode('utf-8'), self.networking.TELLO_ADDRESS)
-        except Exception as e:
-            print(f"Error sending rc command: {e}")
+        setpoint = (left_right, forward_backward, up_down, yaw)
+        if self.rc_scheduler is not None and self.rc_scheduler.running:
+            self.rc_scheduler.set(setpoint)
+        else:
+            self._send_rc(setpoint)
 
+    def _send_rc(self, setpoint):
+        command = "rc %d %d %d %d" % setpoint
+        # We don't want to print every rc command, so we call the base sender
+        self.networking.send_rc(command)
 
     def takeoff(self):
-        """Sends the takeoff command."""
-        self.networking.send_command('takeoff')
+        """Sends the takeoff command. Returns a Future resolved with the drone's reply."""
+        return self.networking.send_command('takeoff')
 
     def land(self):
-        """Sends the land command."""
-        self.networking.send_command('land')
+        """Sends the land command. Returns a Future resolved with the drone's reply."""
+        return self.networking.send_command('land')
 
     def stop(self):
-        """Sends the emergency stop command."""
-        self.networking.send_command('stop')
+        """Sends the emergency stop command, ahead of any queued command."""
+        return self.networking.send_command('stop', urgent=True)
 
     # Note: The old movement functions (up, down, forward, etc.) are no longer
     # used by main.py but can be kept for other potential uses.
@@ -1,12 +1,220 @@
 import socket
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
+
+from instrumentation import counter, histogram
+from telemetry import TelloTelemetry
 
 # A timeout (in seconds) to determine if the connection is lost
 CONNECTION_TIMEOUT = 5.0
 
-class TelloNetworking:
+# How long to wait for the reply to a command before resending it (seconds)
+COMMAND_TIMEOUT = 3.0
+# Commands whose reply only comes back once the maneuver is finished
+COMMAND_TIMEOUTS = {
+    'takeoff': 20.0,
+    'land': 20.0,
+}
+# How many times a command is resent when its reply is lost (idempotent commands only)
+COMMAND_RETRIES = 2
+# Commands that can safely be sent twice: queries ('battery?', ...) and these.
+# A resent move, flip, takeoff or land would be executed twice when only its reply was slow.
+IDEMPOTENT_COMMANDS = ('command', 'streamon', 'streamoff', 'stop', 'emergency', 'speed', 'port',
+                       'setfps', 'setbitrate', 'setresolution', 'downvision', 'mon', 'moff', 'mdirection')
+# After an attempt went unanswered its reply may still arrive late: wait this long (s)
+# before sending the next command, dropping whatever arrives meanwhile
+LATE_REPLY_WAIT = 0.5
+
+# Metrics (see instrumentation.py), shared with async_client.py
+commands_sent = counter('net.commands_sent')
+commands_retried = counter('net.commands_retried')
+commands_timed_out = counter('net.commands_timed_out')
+rc_sent = counter('net.rc_sent')
+command_rtt = histogram('net.command_rtt')
+
+
+class CommandTimeout(Exception):
+    """Raised when a command got no reply after all its retries."""
+
+
+def command_retries(command, retries=None):
+    """Resends allowed for command: retries (default COMMAND_RETRIES) if it is idempotent, else 0."""
+    name = command.split(' ', 1)[0]
+    if not (name.endswith('?') or name in IDEMPOTENT_COMMANDS):
+        return 0
+    return COMMAND_RETRIES if retries is None else retries
+
+
+def command_timeout(command, timeout=None):
+    """Reply timeout of command: timeout, or its COMMAND_TIMEOUTS entry, or COMMAND_TIMEOUT."""
+    if timeout is not None:
+        return timeout
+    return COMMAND_TIMEOUTS.get(command.split(' ', 1)[0], COMMAND_TIMEOUT)
+
+
+def _reply_fits(command, reply):
+    # A query is never answered 'ok', and nothing else is answered with a number:
+    # such a reply belongs to another command
+    if command.endswith('?'):
+        return reply != 'ok'
+    return not reply[:1].isdigit()
+
+
+class PendingCommand:
+    """A command waiting in the queue or for its reply."""
+    __slots__ = ('command', 'timeout', 'retries', 'future', 'attempts', 'sent_time', 'deadline')
+
+    def __init__(self, command, timeout=None, retries=None):
+        self.command = command
+        self.timeout = command_timeout(command, timeout)
+        self.retries = command_retries(command, retries)
+        self.future = Future()
+        self.attempts = 0
+        self.sent_time = None
+        self.deadline = None
+
+    def _timed_out(self):
+        return CommandTimeout(f"No reply to '{self.command}' after {self.attempts} attempts.")
+
+
+class CommandChannel:
+    """
+    Matches the replies of one drone to its commands. Used by TelloNetworking,
+    async_client.py and swarm.py, which do the I/O and serialize the calls.
+
+    The Tello answers one command at a time and its replies do not say which
+    command they answer, so queued commands go out one by one and each reply
+    goes to the single command in flight. An urgent command (e.g. 'stop') is
+    sent right away and gets its own reply slot: the next reply is its own.
+    A reply that fits no waiting command, typically the late reply of an
+    attempt that timed out, is dropped; after such an attempt the next
+    command waits LATE_REPLY_WAIT so its late reply is drained first.
+
+    submit(), submit_urgent(), on_reply() and poll() return the finished
+    commands; pass them to resolve() once the lock is released.
+    """
+
     def __init__(self):
-        self.TELLO_IP = '192.168.10.1'
+        self.queue = deque()
+        self.in_flight = None
+        self.urgent = deque()
+        self.quiet_until = None
+
+        # Statistics
+        self.commands_retried = 0
+        self.commands_timed_out = 0
+        self.unexpected_replies = 0
+        self.last_rtt = None
+
+    def submit(self, pending):
+        """Queues a command; poll() sends it."""
+        self.queue.append(pending)
+
+    def submit_urgent(self, pending, now):
+        """Registers an urgent command the caller sends right away."""
+        pending.attempts = 1
+        pending.sent_time = now
+        pending.deadline = now + pending.timeout
+        self.urgent.append(pending)
+        commands_sent.inc()
+
+    def on_reply(self, reply, now):
+        """Hands a reply to the command it belongs to. Returns the finished commands."""
+        finished = self._expire_urgent(now)
+        for pending in self.urgent:
+            if _reply_fits(pending.command, reply):
+                self.urgent.remove(pending)
+                break
+        else:
+            pending = self.in_flight
+            if pending is None or not _reply_fits(pending.command, reply):
+                self.unexpected_replies += 1
+                return finished
+            self.in_flight = None
+            if pending.attempts > 1:
+                # The reply of the other attempt may follow
+                self.quiet_until = now + LATE_REPLY_WAIT
+        self.last_rtt = now - pending.sent_time
+        command_rtt.record(self.last_rtt)
+        finished.append((pending, reply, None))
+        return finished
+
+    def poll(self, now):
+        """
+        Retries or fails the commands past their deadline and picks the next
+        queued one. Returns (commands to send now, finished commands).
+        """
+        to_send = []
+        finished = self._expire_urgent(now)
+        pending = self.in_flight
+        if pending is not None and now >= pending.deadline:
+            if pending.attempts > pending.retries:
+                self.in_flight = None
+                self.commands_timed_out += 1
+                commands_timed_out.inc()
+                finished.append((pending, None, pending._timed_out()))
+                self.quiet_until = now + LATE_REPLY_WAIT
+            else:
+                self.commands_retried += 1
+                commands_retried.inc()
+                to_send.append(self._send(pending, now))
+        if self.in_flight is None and self.queue and (self.quiet_until is None or now >= self.quiet_until):
+            self.quiet_until = None
+            to_send.append(self._send(self.queue.popleft(), now))
+        return to_send, finished
+
+    def next_deadline(self):
+        """Time at which poll() has something to do, or None."""
+        times = [pending.deadline for pending in self.urgent]
+        if self.in_flight is not None:
+            times.append(self.in_flight.deadline)
+        elif self.queue and self.quiet_until is not None:
+            times.append(self.quiet_until)
+        return min(times) if times else None
+
+    def cancel(self, reason):
+        """Fails every waiting command with CommandTimeout(reason). Returns the finished commands."""
+        pending = list(self.urgent) + list(self.queue)
+        if self.in_flight is not None:
+            pending.append(self.in_flight)
+        self.urgent.clear()
+        self.queue.clear()
+        self.in_flight = None
+        return [(command, None, CommandTimeout(f"'{command.command}' {reason}")) for command in pending]
+
+    def _send(self, pending, now):
+        pending.attempts += 1
+        pending.sent_time = now
+        pending.deadline = now + pending.timeout
+        self.in_flight = pending
+        commands_sent.inc()
+        return pending.command
+
+    def _expire_urgent(self, now):
+        finished = []
+        for pending in [pending for pending in self.urgent if now >= pending.deadline]:
+            self.urgent.remove(pending)
+            self.commands_timed_out += 1
+            commands_timed_out.inc()
+            finished.append((pending, None, pending._timed_out()))
+        return finished
+
+
+def resolve(finished):
+    """Completes the futures of the commands a CommandChannel returned as finished."""
+    for pending, reply, error in finished:
+        if pending.future.done():
+            continue
+        if error is None:
+            pending.future.set_result(reply)
+        else:
+            pending.future.set_exception(error)
+
+class TelloNetworking:
+    def __init__(self, tello_ip='192.168.10.1'):
+        self.TELLO_IP = tello_ip
         self.TELLO_PORT = 8889
         self.TELLO_ADDRESS = (self.TELLO_IP, self.TELLO_PORT)
 
@@ -26,6 +234,21 @@ class TelloNetworking:
         self.is_connected = False
         self.last_response_time = None
 
+        # Command pipeline: replies are matched to the commands by the channel
+        # (see CommandChannel), the dispatcher thread sends and resends them
+        self._cmd_cond = threading.Condition()
+        self.commands = CommandChannel()
+
+        dispatch_thread = threading.Thread(target=self.command_dispatcher)
+        dispatch_thread.daemon = True
+        dispatch_thread.start()
+
+        # Battery, height, attitude... are pushed by the drone on the state port
+        self.telemetry = TelloTelemetry()
+
+        # Optional FlightRecorder that logs every command and reply
+        self.recorder = None
+
         # Status text fields
         self.battery_text = "Battery:"
         self.time_text = "Time:"
@@ -36,68 +259,140 @@ class TelloNetworking:
         Attempts to establish a connection by sending 'command' and waiting for 'ok'.
         Returns True on success, False on failure.
         """
-        self.send_command('command', check_connection=False)
-        
-        # Wait for a response for up to 5 seconds
-        start_time = time.time()
-        while time.time() - start_time < 5:
-            # The receiver thread updates the status text
-            if self.status_text == "Status:ok":
-                self.is_connected = True
-                self.last_response_time = time.time()
-                print("Drone connected successfully!")
-                return True
-            time.sleep(0.1)
-            
+        # Up to 5 attempts of 1 second each
+        reply = self.execute('command', check_connection=False, timeout=1.0, retries=4)
+        if reply == 'ok':
+            self.is_connected = True
+            self.last_response_time = time.time()
+            print("Drone connected successfully!")
+            return True
+
         print("Failed to connect to the drone. Please ensure it is on and connected to the same Wi-Fi network.")
         return False
 
-    def send_command(self, command, check_connection=True):
-        """Sends a command to the Tello drone, optionally checking the connection status first."""
+    def send_command(self, command, check_connection=True, timeout=None, retries=None, urgent=False):
+        """
+        Queues a command for the Tello drone, optionally checking the connection status first.
+        Returns a concurrent.futures.Future that resolves to the reply ('ok', 'error', ...)
+        or fails with CommandTimeout. Use asyncio.wrap_future() to await it.
+        Only idempotent commands are resent (see command_retries()).
+        Urgent commands (e.g. 'stop') skip the queue and are never resent.
+        Returns None if the drone is not connected.
+        """
         if check_connection and not self.is_connected:
             print(f"Cannot send '{command}': Drone not connected.")
-            return
+            return None
 
+        pending = PendingCommand(command, timeout, 0 if urgent else retries)
+        with self._cmd_cond:
+            if urgent:
+                self.commands.submit_urgent(pending, time.monotonic())
+            else:
+                self.commands.submit(pending)
+            self._cmd_cond.notify_all()
+        if urgent:
+            self._send_raw(command)
+        return pending.future
+
+    def execute(self, command, check_connection=True, timeout=None, retries=None):
+        """
+        Sends a command and blocks until its reply arrives.
+        Returns the reply, or None if the drone did not answer.
+        """
+        future = self.send_command(command, check_connection, timeout, retries)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except CommandTimeout as e:
+            print(e)
+            return None
+
+    def attach_recorder(self, recorder):
+        """Logs commands, replies and state packets to a FlightRecorder."""
+        self.recorder = recorder
+        self.telemetry.recorder = recorder
+
+    def send_rc(self, command):
+        """Sends an rc command. The drone does not reply to these, so they bypass the queue."""
+        if self.recorder is not None:
+            self.recorder.record_command(command)
+        try:
+            self.sock.sendto(command.encode('utf-8'), self.TELLO_ADDRESS)
+            rc_sent.inc()
+        except Exception as e:
+            print(f"Error sending rc command: {e}")
+
+    def _send_raw(self, command):
+        """Sends a datagram to the drone without any tracking."""
+        if self.recorder is not None:
+            self.recorder.record_command(command)
         try:
             self.sock.sendto(command.encode('utf-8'), self.TELLO_ADDRESS)
+            return True
         except Exception as e:
             print(f"Error sending command: {e}")
             self.is_connected = False
+            return False
+
+    def command_dispatcher(self):
+        """Sends queued commands one at a time, resending them when the reply is lost."""
+        while True:
+            with self._cmd_cond:
+                now = time.monotonic()
+                to_send, finished = self.commands.poll(now)
+                if not to_send and not finished:
+                    deadline = self.commands.next_deadline()
+                    self._cmd_cond.wait(None if deadline is None else max(0.0, deadline - now))
+                    continue
+            resolve(finished)
+            for command in to_send:
+                self._send_raw(command)
 
     def udp_receiver(self):
-        """Receives status updates from the Tello drone."""
+        """Receives command replies ('ok', 'error', ...) from the Tello drone."""
         while True:
             try:
                 data, server = self.sock.recvfrom(1518)
                 resp = data.decode(encoding="utf-8").strip()
                 self.last_response_time = time.time() # Update timestamp on any response
                 self.is_connected = True # If we receive anything, we are connected
+                self.status_text = "Status:" + resp
+                if self.recorder is not None:
+                    self.recorder.record_reply(resp)
 
-                if resp.isdecimal():
-                    self.battery_text = "Battery:" + resp + "%"
-                elif resp.endswith('s'):
-                    self.time_text = "Time:" + resp
-                else:
-                    self.status_text = "Status:" + resp
+                # Hand the reply to the command waiting for it, the dispatcher sends the next one
+                with self._cmd_cond:
+                    finished = self.commands.on_reply(resp, time.monotonic())
+                    self._cmd_cond.notify_all()
+                resolve(finished)
             except Exception:
                 # This will trigger if the socket is closed or another error occurs
                 self.is_connected = False
                 break
 
     def ask_status(self):
-        """Periodically asks for status and checks for connection timeouts."""
+        """
+        Refreshes the status texts from the telemetry stream and checks for connection timeouts.
+        Nothing is sent to the drone: it pushes its state on its own at about 10 Hz.
+        """
         while True:
+            snapshot = self.telemetry.snapshot()
+            if snapshot is not None:
+                self.battery_text = f"Battery:{snapshot.bat}%"
+                self.time_text = f"Time:{snapshot.time}s"
+                # State packets also prove the drone is alive
+                if self.last_response_time is None or snapshot.timestamp > self.last_response_time:
+                    self.last_response_time = snapshot.timestamp
+
             if not self.is_connected:
                 time.sleep(1)
                 continue
-            
+
             # Check for timeout
             if self.last_response_time and (time.time() - self.last_response_time > CONNECTION_TIMEOUT):
                 print("Connection to drone lost (timeout).")
                 self.is_connected = False
                 self.status_text = "Status: Disconnected"
 
-            self.send_command('battery?')
-            time.sleep(0.5)
-            self.send_command('time?')
-            time.sleep(0.5)
+            time.sleep(0.1)
@@ -0,0 +1,350 @@
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from instrumentation import counter, histogram
+
+# Result of one decoded frame. points: one (4, 2) array per payload, in the
+# coordinates of the submitted frame.
+QrResult = namedtuple('QrResult', ['seq', 'timestamp', 'payloads', 'points', 'decode_time'])
+
+# Hits needed to confirm a payload, and the frame window they must fall in
+CONFIRM_HITS = 3
+CONFIRM_WINDOW = 30
+
+# Decoders of QrWorkerPool
+DECODERS = ('full', 'two-stage')
+
+# Metrics (see instrumentation.py). qr.decode includes the time waiting for a worker process.
+qr_decoded = counter('qr.decoded')
+qr_dropped = counter('qr.dropped')
+qr_decode_time = histogram('qr.decode')
+
+# One detector per thread / process, created on first use
+_local = threading.local()
+
+
+def _detector():
+    qcd = getattr(_local, 'qcd', None)
+    if qcd is None:
+        qcd = _local.qcd = cv2.QRCodeDetector()
+    return qcd
+
+
+def _candidate_detector():
+    # The ArUco based detector (OpenCV 4.7+) finds quads several times faster
+    detector = getattr(_local, 'candidates', None)
+    if detector is None:
+        factory = getattr(cv2, 'QRCodeDetectorAruco', cv2.QRCodeDetector)
+        detector = _local.candidates = factory()
+    return detector
+
+
+def decode_qr(image, scale=3):
+    """
+    Detects and decodes the QR codes of one frame, as drone_qr.py did inline.
+    The frame is downsized by scale first; the points are returned in frame coordinates.
+    Returns (payloads, points).
+    """
+    qcd = _detector()
+    if scale != 1:
+        height, width = image.shape[:2]
+        image = cv2.resize(image, (width // scale, height // scale))
+    retval, decoded_info, points, _ = qcd.detectAndDecodeMulti(image)
+    if not retval:
+        return [], []
+    payloads = []
+    quads = []
+    for text, quad in zip(decoded_info, points):
+        if text:
+            payloads.append(text)
+            quads.append(np.asarray(quad, np.float32) * scale)
+    return payloads, quads
+
+
+class TwoStageQrDecoder:
+    """
+    Finds candidate codes with detectMulti on a grey frame downsized by scale,
+    then decodes each candidate on a full-resolution crop around its quad.
+    Frames without a candidate cost only the small detection. A decoded code
+    is remembered by position for cache_ttl seconds: a candidate at the same
+    place and of the same size reuses the payload instead of being decoded again.
+    Only payloads in `confirmed` are remembered when it is given, so that a
+    misread is never repeated from the cache (QrWorkerPool passes the payloads
+    QrFusion confirmed). Can be shared by several threads.
+    """
+
+    def __init__(self, scale=3, margin=0.2, cache_ttl=0.5, move_tolerance=0.15):
+        self.scale = scale
+        self.margin = margin
+        self.cache_ttl = cache_ttl
+        self.move_tolerance = move_tolerance
+        self._lock = threading.Lock()
+        self._cache = []            # [(expiry, center, size, payload)]
+
+        # Statistics
+        self.frames = 0
+        self.frames_without_candidates = 0
+        self.crops_decoded = 0
+        self.crops_failed = 0
+        self.cache_hits = 0
+
+    def __call__(self, image, confirmed=None):
+        """
+        Returns (payloads, points) like decode_qr().
+        confirmed: payloads that may be cached, None caches every decoded payload.
+        """
+        self.frames += 1
+        height, width = image.shape[:2]
+        small = cv2.resize(image, (width // self.scale, height // self.scale), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        found, candidates = _candidate_detector().detectMulti(small)
+        if not found:
+            self.frames_without_candidates += 1
+            return [], []
+
+        now = time.monotonic()
+        payloads = []
+        quads = []
+        for candidate in candidates:
+            quad = np.asarray(candidate, np.float32) * self.scale
+            center = quad.mean(axis=0)
+            size = float(np.linalg.norm(quad[2] - quad[0]))
+            payload = self._lookup(center, size, now)
+            if payload is not None:
+                self.cache_hits += 1
+            else:
+                payload, decoded_quad = self._decode_crop(image, quad, size)
+                if payload is None:
+                    continue
+                quad = decoded_quad
+                if confirmed is None or payload in confirmed:
+                    self._store(now, quad.mean(axis=0), size, payload)
+            payloads.append(payload)
+            quads.append(quad)
+        return payloads, quads
+
+    def _decode_crop(self, image, quad, size):
+        qcd = _detector()
+        height, width = image.shape[:2]
+        pad = self.margin * size
+        x0, y0 = np.maximum(quad.min(axis=0) - pad, 0).astype(int)
+        x1, y1 = np.minimum(quad.max(axis=0) + pad, (width, height)).astype(int)
+        if x1 - x0 < 21 or y1 - y0 < 21:
+            # Smaller than a version 1 code
+            self.crops_failed += 1
+            return None, None
+        crop = image[y0:y1, x0:x1]
+        offset = np.array((x0, y0), np.float32)
+        # Decoding with the known corners skips the detection; it only fails
+        # when the upscaled corners are too far off, then detect in the crop
+        text, _ = qcd.decode(crop, (quad - offset).reshape(1, 4, 2))
+        points = quad - offset
+        if not text:
+            text, points, _ = qcd.detectAndDecode(crop)
+        if not text:
+            self.crops_failed += 1
+            return None, None
+        self.crops_decoded += 1
+        return text, np.asarray(points, np.float32).reshape(4, 2) + offset
+
+    def _lookup(self, center, size, now):
+        with self._lock:
+            self._cache = [entry for entry in self._cache if entry[0] > now]
+            for _, cached_center, cached_size, payload in self._cache:
+                if (np.linalg.norm(center - cached_center) <= self.move_tolerance * cached_size
+                        and abs(size - cached_size) <= self.move_tolerance * cached_size):
+                    return payload
+        return None
+
+    def _store(self, now, center, size, payload):
+        with self._lock:
+            self._cache.append((now + self.cache_ttl, center, size, payload))
+
+    def stats(self):
+        """Returns the decoder counters as a dictionary."""
+        return {
+            'frames': self.frames,
+            'without_candidates': self.frames_without_candidates,
+            'crops_decoded': self.crops_decoded,
+            'crops_failed': self.crops_failed,
+            'cache_hits': self.cache_hits,
+        }
+
+
+# Two-stage decoder of this process, shared by its threads
+_two_stage = {}
+
+
+def decode_qr_two_stage(image, scale=3, confirmed=None):
+    """decode_qr() through the TwoStageQrDecoder of this process."""
+    decoder = _two_stage.get(scale)
+    if decoder is None:
+        decoder = _two_stage.setdefault(scale, TwoStageQrDecoder(scale))
+    return decoder(image, confirmed)
+
+
+class QrFusion:
+    """
+    Confirms a payload once it was decoded in `hits` frames whose sequence
+    numbers lie within `window` of each other. Single decodes (misreads,
+    codes glimpsed for one frame) are never reported.
+    """
+
+    def __init__(self, hits=CONFIRM_HITS, window=CONFIRM_WINDOW):
+        self.hits = hits
+        self.window = window
+        self._seen = {}             # payload -> deque of seqs
+        self.confirmed = {}         # payload -> seq at which it was confirmed
+
+    def update(self, result):
+        """Adds one QrResult. Returns the payloads confirmed by it."""
+        newly_confirmed = []
+        for payload in set(result.payloads):
+            seqs = self._seen.setdefault(payload, deque())
+            seqs.append(result.seq)
+            # Results may come back out of order from several workers
+            newest = max(seqs)
+            while seqs and seqs[0] <= newest - self.window:
+                seqs.popleft()
+            if payload not in self.confirmed and len(seqs) >= self.hits:
+                self.confirmed[payload] = result.seq
+                newly_confirmed.append(payload)
+        return newly_confirmed
+
+
+class QrWorkerPool:
+    """
+    Decodes QR codes off the flight loop.
+    submit() never blocks: while all workers are busy only the newest frame is
+    kept waiting and older ones are dropped. Results are stored by frame
+    sequence number and fused with QrFusion.
+    executor: 'thread' (OpenCV releases the GIL while decoding) or 'process'.
+    decoder:  'full' (decode_qr) or 'two-stage' (TwoStageQrDecoder; with the
+              process executor each process has its own position cache). Only
+              confirmed payloads are cached, so every hit QrFusion counts
+              comes from a real decode.
+    """
+
+    def __init__(self, workers=2, executor='thread', scale=3,
+                 hits=CONFIRM_HITS, window=CONFIRM_WINDOW, history=64, decoder='full'):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor: {executor}")
+        if decoder not in DECODERS:
+            raise ValueError(f"Unknown decoder: {decoder}")
+        self.decoder = decoder
+        self.workers = workers
+        self.executor_type = executor
+        self.scale = scale
+        self.history = history
+        self.fusion = QrFusion(hits, window)
+
+        self._executor = None
+        # Reentrant: a future that is already done runs its callback inside submit()
+        self._lock = threading.RLock()
+        self._in_flight = 0
+        self._pending = None
+        self._results = OrderedDict()
+        self._latest = None
+        self._confirmed_queue = deque()
+
+        # Statistics
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_decoded = 0
+        self.decode_errors = 0
+
+    def start(self):
+        """Starts the worker pool."""
+        if self.executor_type == 'process':
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='qr')
+
+    def stop(self):
+        """Drops the waiting frame and shuts the pool down."""
+        with self._lock:
+            self._pending = None
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, seq, frame, timestamp=None):
+        """Queues a frame for decoding; replaces the waiting frame if the workers are busy."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            if self._executor is None:
+                return
+            self.frames_submitted += 1
+            if self._in_flight < self.workers:
+                self._launch(seq, frame, timestamp)
+            else:
+                if self._pending is not None:
+                    self.frames_dropped += 1
+                    qr_dropped.inc()
+                self._pending = (seq, frame, timestamp)
+
+    def _launch(self, seq, frame, timestamp):
+        # Called with the lock held
+        self._in_flight += 1
+        started = time.monotonic()
+        if self.decoder == 'two-stage':
+            future = self._executor.submit(decode_qr_two_stage, frame, self.scale, frozenset(self.fusion.confirmed))
+        else:
+            future = self._executor.submit(decode_qr, frame, self.scale)
+        future.add_done_callback(lambda f: self._on_done(f, seq, timestamp, started))
+
+    def _on_done(self, future, seq, timestamp, started):
+        error = future.cancelled() or future.exception() is not None
+        with self._lock:
+            self._in_flight -= 1
+            if error:
+                self.decode_errors += 1
+            else:
+                payloads, points = future.result()
+                result = QrResult(seq, timestamp, payloads, points, time.monotonic() - started)
+                self.frames_decoded += 1
+                qr_decoded.inc()
+                qr_decode_time.record(result.decode_time)
+                self._results[seq] = result
+                while len(self._results) > self.history:
+                    self._results.popitem(last=False)
+                if self._latest is None or seq > self._latest.seq:
+                    self._latest = result
+                self._confirmed_queue.extend(self.fusion.update(result))
+            if self._pending is not None and self._executor is not None:
+                pending = self._pending
+                self._pending = None
+                self._launch(*pending)
+
+    def latest(self):
+        """Returns the QrResult of the newest decoded frame, or None."""
+        return self._latest
+
+    def result(self, seq):
+        """Returns the QrResult of frame seq if it was decoded recently, otherwise None."""
+        with self._lock:
+            return self._results.get(seq)
+
+    def confirmed(self):
+        """Returns the payloads confirmed since the last call."""
+        with self._lock:
+            payloads = list(self._confirmed_queue)
+            self._confirmed_queue.clear()
+        return payloads
+
+    def stats(self):
+        """Returns the pool counters as a dictionary."""
+        return {
+            'submitted': self.frames_submitted,
+            'dropped': self.frames_dropped,
+            'decoded': self.frames_decoded,
+            'errors': self.decode_errors,
+            'confirmed': len(self.fusion.confirmed),
+        }
@@ -0,0 +1,219 @@
+"""
+Flight recorder: raw H.264 packets, state packets and commands in one log.
+
+Log file layout (little endian):
+    header:  MAGIC, version (u16), start time (f64, time.time())
+    records: kind (u8), time since start (f64, monotonic), payload size (u32), payload
+The log is append-only. A seek index is written next to it (<log>.idx) as
+fixed-size entries: offset (u64), time (f64), kind (u8), flags (u8).
+An entry is written for every video keyframe and at least once per
+INDEX_INTERVAL seconds; rebuild_index() recreates it from the log.
+"""
+import queue
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b'TELLOLOG'
+VERSION = 1
+HEADER = struct.Struct('<8sHd')
+RECORD = struct.Struct('<BdI')
+INDEX_ENTRY = struct.Struct('<QdBB')
+
+# Record kinds
+VIDEO = 1       # one UDP datagram of the H.264 stream, as received
+STATE = 2       # one state packet from port 8890
+COMMAND = 3     # a command sent to the drone (including rc)
+REPLY = 4       # a reply received from the drone
+
+# Index flags
+FLAG_KEYFRAME = 1
+
+# Seconds between two index entries when there are no keyframes
+INDEX_INTERVAL = 1.0
+
+# The Tello splits each frame into datagrams of this size, the last one is shorter
+VIDEO_PACKET_SIZE = 1460
+
+
+def is_keyframe_packet(data):
+    """True if a video datagram starts with an SPS or IDR NAL unit."""
+    if data[:4] == b'\x00\x00\x00\x01':
+        nal_type = data[4] & 0x1f if len(data) > 4 else 0
+    elif data[:3] == b'\x00\x00\x01':
+        nal_type = data[3] & 0x1f if len(data) > 3 else 0
+    else:
+        return False
+    return nal_type in (5, 7)
+
+
+class FlightRecorder:
+    """
+    Writes records to the log from a background thread.
+    record_*() never blocks: when the writer falls behind and the queue is full,
+    the record is dropped and counted in records_dropped.
+    """
+
+    def __init__(self, path, max_queue=4096):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_mono = None
+
+        # Statistics
+        self.records_written = 0
+        self.records_dropped = 0
+        self.bytes_written = 0
+
+    def start(self):
+        """Creates the log and starts the writer thread."""
+        self._start_mono = time.monotonic()
+        self._file = open(self.path, 'wb')
+        self._index = open(self.index_path, 'wb')
+        header = HEADER.pack(MAGIC, VERSION, time.time())
+        self._file.write(header)
+        self._offset = len(header)
+        self._last_index_time = None
+
+        self._thread = threading.Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Writes the remaining records and closes the log."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        self._index.close()
+
+    def now(self):
+        """Time since the start of the recording, as stored in the records."""
+        return time.monotonic() - self._start_mono
+
+    def record(self, kind, payload, timestamp=None):
+        """Queues a record. timestamp is a time.monotonic() value (default: now)."""
+        if self._thread is None:
+            return
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        t = (timestamp if timestamp is not None else time.monotonic()) - self._start_mono
+        try:
+            self._queue.put_nowait((kind, t, payload))
+        except queue.Full:
+            self.records_dropped += 1
+
+    def record_video(self, data, timestamp=None):
+        self.record(VIDEO, data, timestamp)
+
+    def record_state(self, data, timestamp=None):
+        self.record(STATE, data, timestamp)
+
+    def record_command(self, command, timestamp=None):
+        self.record(COMMAND, command, timestamp)
+
+    def record_reply(self, reply, timestamp=None):
+        self.record(REPLY, reply, timestamp)
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, t, payload = item
+            self._write_index(kind, t, payload)
+            self._file.write(RECORD.pack(kind, t, len(payload)))
+            self._file.write(payload)
+            size = RECORD.size + len(payload)
+            self._offset += size
+            self.bytes_written += size
+            self.records_written += 1
+            if self._queue.empty():
+                self._file.flush()
+                self._index.flush()
+
+    def _write_index(self, kind, t, payload):
+        flags = FLAG_KEYFRAME if kind == VIDEO and is_keyframe_packet(payload) else 0
+        if flags or self._last_index_time is None or t - self._last_index_time >= INDEX_INTERVAL:
+            self._index.write(INDEX_ENTRY.pack(self._offset, t, kind, flags))
+            self._last_index_time = t
+
+
+def iter_records(path):
+    """Yields (offset, kind, time, payload) for every complete record of a log."""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        magic, version, _ = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a flight log")
+        offset = HEADER.size
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            kind, t, size = RECORD.unpack(head)
+            payload = f.read(size)
+            if len(payload) < size:
+                # Truncated by a crash
+                break
+            yield offset, kind, t, payload
+            offset += RECORD.size + size
+
+
+def rebuild_index(path):
+    """Recreates <path>.idx from the log, e.g. after a crash."""
+    last = None
+    with open(path + '.idx', 'wb') as index:
+        for offset, kind, t, payload in iter_records(path):
+            flags = FLAG_KEYFRAME if kind == VIDEO and is_keyframe_packet(payload) else 0
+            if flags or last is None or t - last >= INDEX_INTERVAL:
+                index.write(INDEX_ENTRY.pack(offset, t, kind, flags))
+                last = t
+
+
+class VideoRelay:
+    """
+    Receives the video stream on port 11111, records every datagram and
+    forwards it unchanged to a local port that cv2.VideoCapture reads from.
+    recorder may be None when only the clock (a latency.ReceiptClock) is wanted.
+    """
+
+    def __init__(self, recorder, listen_port=11111, forward_port=11112, clock=None):
+        self.recorder = recorder
+        self.clock = clock
+        self.forward_address = ('127.0.0.1', forward_port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(('', listen_port))
+        self.out_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.packets = 0
+
+    @property
+    def capture_address(self):
+        """Address to give to cv2.VideoCapture instead of port 11111."""
+        return f'udp://@127.0.0.1:{self.forward_address[1]}?overrun_nonfatal=1&fifo_size=50000000'
+
+    def start(self):
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                data, server = self.sock.recvfrom(2048)
+            except OSError:
+                break
+            if self.clock is not None:
+                self.clock.on_packet(data)
+            if self.recorder is not None:
+                self.recorder.record_video(data)
+            self.out_sock.sendto(data, self.forward_address)
+            self.packets += 1
+
+    def close(self):
+        self.sock.close()
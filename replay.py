@@ -0,0 +1,257 @@
+"""
+Replays recorded flights (see recorder.py) through the vision pipelines.
+
+    python replay.py flight.log --pipeline linetrace --output linetrace.jsonl
+    python replay.py flight.log --pipeline qr --output qr.jsonl
+    python replay.py --diff old.jsonl new.jsonl
+
+The H.264 packets are decoded on demand with PyAV (pip install av) straight
+from the memory-mapped log, so replays run as fast as the pipeline and the
+decoder allow without loading the flight into RAM or writing decoded frames
+to disk. --start seeks to the keyframe at or before the start time through
+the seek index (<log>.idx). The output is one JSON object per frame, in
+frame order, numbered by the frame's position in the log, so two runs can be
+compared with --diff.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+import cv2
+
+from line_tracker import DEFAULT_BOUNDS, LineTracker, yaw_command
+from recorder import HEADER, INDEX_ENTRY, MAGIC, RECORD, VIDEO, FLAG_KEYFRAME, VIDEO_PACKET_SIZE
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+class FlightLog:
+    """Read-only, memory-mapped view of a flight log. Use it with `with` or close() it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.version, self.start_time = HEADER.unpack_from(self.mm, 0)
+        except (ValueError, struct.error):
+            # Empty or shorter than the header
+            magic = None
+            self.mm = None
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a flight log")
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def records(self, kinds=None, offset=HEADER.size):
+        """Yields (offset, kind, time, payload) starting at a record offset."""
+        mm = self.mm
+        size_total = len(mm)
+        while offset + RECORD.size <= size_total:
+            kind, t, size = RECORD.unpack_from(mm, offset)
+            start = offset + RECORD.size
+            end = start + size
+            if end > size_total:
+                # Truncated by a crash
+                break
+            if kinds is None or kind in kinds:
+                yield offset, kind, t, mm[start:end]
+            offset = end
+
+    def index(self):
+        """Returns the seek index as a list of (offset, time, kind, flags)."""
+        path = self.path + '.idx'
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        count = len(data) // INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+    def seek(self, t, keyframe=True):
+        """
+        Returns the offset of the last (key)frame index entry at or before time t.
+        With keyframe=True only entries starting with an SPS count: decoding
+        cannot start at an IDR whose SPS came in an earlier datagram.
+        """
+        offset = HEADER.size
+        for entry_offset, entry_time, kind, flags in self.index():
+            if entry_time > t:
+                break
+            if not keyframe or (flags & FLAG_KEYFRAME and self._starts_with_sps(entry_offset)):
+                offset = entry_offset
+        return offset
+
+    def _starts_with_sps(self, offset):
+        start = offset + RECORD.size
+        head = self.mm[start:start + 5]
+        if head[:3] == b'\x00\x00\x01':
+            return len(head) > 3 and head[3] & 0x1f == 7
+        return head[:4] == b'\x00\x00\x00\x01' and len(head) > 4 and head[4] & 0x1f == 7
+
+    def count_access_units(self, end):
+        """Number of video frames completed before the record offset end (headers only, no copies)."""
+        mm = self.mm
+        offset = HEADER.size
+        count = 0
+        while offset + RECORD.size <= end:
+            kind, _, size = RECORD.unpack_from(mm, offset)
+            if kind == VIDEO and size < VIDEO_PACKET_SIZE:
+                count += 1
+            offset += RECORD.size + size
+        return count
+
+    def access_units(self, offset=HEADER.size):
+        """Yields (time, data) for each video frame, reassembled from its datagrams."""
+        parts = []
+        for _, kind, t, payload in self.records((VIDEO,), offset):
+            parts.append(payload)
+            if len(payload) < VIDEO_PACKET_SIZE:
+                yield t, b''.join(parts)
+                parts = []
+
+
+def decode_access_units(units, first=0):
+    """
+    Yields (frame number, time, BGR image) for each decoded frame; the n-th
+    unit is frame number first + n, units that fail to decode are skipped.
+    Needs PyAV: OpenCV cannot tell which unit a decoded frame came from.
+    """
+    if av is None:
+        raise RuntimeError("Replay needs PyAV (pip install av)")
+    codec = av.CodecContext.create('h264', 'r')
+    times = {}
+
+    def frames_of(packet):
+        try:
+            frames = codec.decode(packet)
+        except av.error.FFmpegError:
+            return
+        for frame in frames:
+            # The packet's pts is its frame number, even if the decoder holds frames back
+            yield frame.pts, times.pop(frame.pts), frame.to_ndarray(format='bgr24')
+
+    for number, (t, data) in enumerate(units, first):
+        packet = av.Packet(data)
+        packet.pts = number
+        times[number] = t
+        yield from frames_of(packet)
+    yield from frames_of(None)
+
+
+class LinetraceReplay:
+    """Runs the drone_linetrace.py processing (LineTracker + yaw command)."""
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.tracker = LineTracker(*bounds)
+
+    def __call__(self, frame):
+        detection = self.tracker.process(frame)
+        if not detection.found:
+            return {'found': False}
+        return {'found': True, 'centroid': [detection.mx, detection.my], 'area': detection.area,
+                'yaw': yaw_command(detection.mx)}
+
+
+class QrReplay:
+    """Runs the drone_qr.py processing, every `every` frames like the script."""
+
+    def __init__(self, every=1):
+        self.every = every
+        self.qcd = cv2.QRCodeDetector()
+        self.count = 0
+
+    def __call__(self, frame):
+        self.count += 1
+        if self.count % self.every != 0:
+            return {'skipped': True}
+        height, width = frame.shape[:2]
+        resized = cv2.resize(frame, (width // 3, height // 3))
+        retval, decoded_info, points, _ = self.qcd.detectAndDecodeMulti(resized)
+        return {'payloads': [text for text in decoded_info if text] if retval else []}
+
+
+def replay(log_path, pipeline, output, start=0.0):
+    """Runs pipeline over every frame of the log from time start and writes JSON lines."""
+    count = 0
+    with FlightLog(log_path) as log:
+        # Decoding starts at the keyframe before start, the frames up to start are skipped
+        offset = log.seek(start) if start > 0 else HEADER.size
+        for number, t, image in decode_access_units(log.access_units(offset), log.count_access_units(offset)):
+            if t < start:
+                continue
+            result = pipeline(image)
+            result['frame'] = number
+            result['t'] = round(t, 6)
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            count += 1
+    return count
+
+
+def diff(path_a, path_b):
+    """Prints the frames whose results differ between two replay outputs."""
+    with open(path_a) as a, open(path_b) as b:
+        rows_a = [json.loads(line) for line in a]
+        rows_b = [json.loads(line) for line in b]
+    differences = 0
+    for row_a, row_b in zip(rows_a, rows_b):
+        if row_a != row_b:
+            differences += 1
+            print(f"frame {row_a.get('frame')}: {row_a} != {row_b}")
+    if len(rows_a) != len(rows_b):
+        differences += 1
+        print(f"frame count differs: {len(rows_a)} != {len(rows_b)}")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded flight through the vision pipelines")
+    parser.add_argument('log', nargs='?', help="flight log written by recorder.py")
+    parser.add_argument('--pipeline', choices=('linetrace', 'qr'), default='linetrace')
+    parser.add_argument('--hsv', type=int, nargs=6, metavar=('H_MIN', 'S_MIN', 'V_MIN', 'H_MAX', 'S_MAX', 'V_MAX'),
+                        help="HSV range for linetrace")
+    parser.add_argument('--qr-every', type=int, default=1, help="run QR detection every N frames")
+    parser.add_argument('--start', type=float, default=0.0, help="start time in the log (s)")
+    parser.add_argument('--output', help="JSON lines output (default: stdout)")
+    parser.add_argument('--diff', nargs=2, metavar=('A', 'B'), help="compare two replay outputs")
+    args = parser.parse_args()
+
+    if args.diff:
+        sys.exit(1 if diff(*args.diff) else 0)
+    if not args.log:
+        parser.error("a flight log is required")
+    if av is None:
+        parser.error("replay needs PyAV (pip install av)")
+
+    if args.pipeline == 'linetrace':
+        bounds = (tuple(args.hsv[:3]), tuple(args.hsv[3:])) if args.hsv else DEFAULT_BOUNDS
+        pipeline = LinetraceReplay(bounds)
+    else:
+        pipeline = QrReplay(args.qr_every)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    count = replay(args.log, pipeline, output, args.start)
+    if args.output:
+        output.close()
+    print(f"Replayed {count} frames", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import time
+from collections import deque
+
+from instrumentation import counter, histogram
+
+# Default time per frame (s): the Tello streams 30 fps
+FRAME_BUDGET = 1.0 / 30
+
+# What decide() tells a stage to do
+FULL = 'full'
+LOW = 'low'
+SKIP = 'skip'
+
+
+class StageStats:
+    """Rolling latency of one stage, per mode. Also reported as vision.<name>[.low] metrics."""
+
+    def __init__(self, name, window=30):
+        self.samples = {FULL: deque(maxlen=window), LOW: deque(maxlen=window)}
+        self.counts = {FULL: 0, LOW: 0, SKIP: 0}
+        self.skipped_in_row = 0
+        self.histograms = {FULL: histogram(f'vision.{name}'), LOW: histogram(f'vision.{name}.low')}
+        self.skips = counter(f'vision.{name}.skipped')
+
+    def add(self, mode, elapsed):
+        self.samples[mode].append(elapsed)
+        self.histograms[mode].record(elapsed)
+
+    def estimate(self, mode, quantile=0.9):
+        """Returns the quantile of the recent latencies (s), or None without samples."""
+        samples = self.samples[mode]
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class _Measure:
+    def __init__(self, scheduler, name, mode):
+        self.scheduler = scheduler
+        self.name = name
+        self.mode = mode
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.scheduler.record(self.name, self.mode, time.perf_counter() - self.start)
+        return False
+
+
+class FrameScheduler:
+    """
+    Decides per frame which vision stages fit in the frame budget.
+    Required stages (the ones the control output depends on) always run and
+    their expected time is reserved. Optional stages run in full when their
+    rolling p90 latency fits in what is left of the budget, at low resolution
+    when only that fits, and are skipped otherwise. An optional stage skipped
+    max_skip frames in a row runs once anyway, which refreshes its estimate.
+
+        scheduler.begin_frame()
+        with scheduler.measure('detect'):
+            ...
+        mode = scheduler.decide('preview')
+        if mode != SKIP:
+            with scheduler.measure('preview', mode):
+                ...
+        scheduler.end_frame()
+    """
+
+    def __init__(self, budget=FRAME_BUDGET, window=30, max_skip=30):
+        self.budget = budget
+        self.window = window
+        self.max_skip = max_skip
+        self.stages = {}            # name -> (required, low_res, StageStats)
+
+        self.frame_start = 0.0
+        self._deadline = 0.0
+        self._done = set()
+
+        # Statistics
+        self.frames = 0
+        self.overruns = 0
+
+    def add_stage(self, name, required=False, low_res=False):
+        """Registers a stage. low_res: the stage has a cheaper LOW mode."""
+        self.stages[name] = (required, low_res, StageStats(name, self.window))
+
+    def begin_frame(self, start=None):
+        """Starts the budget of a frame at start (time.perf_counter(), default now)."""
+        if start is None:
+            start = time.perf_counter()
+        self.frame_start = start
+        self._deadline = start + self.budget
+        self._done = set()
+
+    def remaining(self):
+        """Time left in the current frame (s), less the time reserved for required stages."""
+        reserved = 0.0
+        for name, (required, _, stats) in self.stages.items():
+            if required and name not in self._done:
+                reserved += stats.estimate(FULL) or 0.0
+        return self._deadline - time.perf_counter() - reserved
+
+    def decide(self, name):
+        """Returns FULL, LOW or SKIP for a stage in the current frame."""
+        required, low_res, stats = self.stages[name]
+        if required:
+            return FULL
+        full = stats.estimate(FULL)
+        if full is None:
+            # Never measured yet
+            return FULL
+        if stats.skipped_in_row >= self.max_skip:
+            return LOW if low_res else FULL
+        remaining = self.remaining()
+        if full <= remaining:
+            return FULL
+        if low_res:
+            low = stats.estimate(LOW)
+            if low is None or low <= remaining:
+                return LOW
+        stats.skipped_in_row += 1
+        stats.counts[SKIP] += 1
+        stats.skips.inc()
+        return SKIP
+
+    def measure(self, name, mode=FULL):
+        """Context manager that times one run of a stage."""
+        return _Measure(self, name, mode)
+
+    def record(self, name, mode, elapsed):
+        """Records the latency of a stage that ran outside measure()."""
+        _, _, stats = self.stages[name]
+        stats.add(mode, elapsed)
+        stats.counts[mode] += 1
+        stats.skipped_in_row = 0
+        self._done.add(name)
+
+    def end_frame(self):
+        """Ends the frame; returns True if it stayed within the budget."""
+        self.frames += 1
+        on_time = time.perf_counter() <= self._deadline
+        if not on_time:
+            self.overruns += 1
+        return on_time
+
+    def stats(self):
+        """Returns the counters and the latency estimates (ms) of every stage."""
+        result = {'frames': self.frames, 'overruns': self.overruns, 'stages': {}}
+        for name, (_, _, stats) in self.stages.items():
+            entry = dict(stats.counts)
+            for mode in (FULL, LOW):
+                estimate = stats.estimate(mode)
+                if estimate is not None:
+                    entry[f'{mode}_p90_ms'] = estimate * 1000.0
+            result['stages'][name] = entry
+        return result
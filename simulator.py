@@ -0,0 +1,397 @@
+"""
+Local stand-in for a Tello drone, for testing and benchmarking without hardware.
+
+    python simulator.py [--latency 30] [--loss 0.02] [--video recording.mp4]
+    TELLO_IP=127.0.0.1 python main.py
+
+The simulator answers commands on port 8889, pushes its state to the client's
+port 8890 and streams H.264 to the client's port 11111 (test pattern or a
+recorded video, encoded with the ffmpeg command line tool).
+Scripts that bind local port 8889 themselves (drone_qr.py, drone_linetrace.py)
+must run on another host or network namespace than the simulator.
+"""
+import argparse
+import math
+import random
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+TELLO_PORT = 8889
+STATE_PORT = 8890
+VIDEO_PORT = 11111
+
+# The Tello splits each video frame into datagrams of this size
+VIDEO_PACKET_SIZE = 1460
+# Access unit delimiter NAL, inserted by x264 (aud=1) in front of every frame
+AUD_START = b'\x00\x00\x00\x01\x09'
+
+# rc value 100 corresponds to these speeds
+MAX_SPEED = 100.0       # cm/s
+MAX_YAW_RATE = 100.0    # deg/s
+TAKEOFF_HEIGHT = 80.0   # cm
+
+
+class SimulatedDrone:
+    """Very simple kinematic model of the drone."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flying = False
+        self.x = self.y = self.z = 0.0     # cm, world frame
+        self.yaw = 0.0                     # deg
+        self.rc = (0, 0, 0, 0)
+        self.speed = 50.0                  # cm/s for move commands
+        # Remaining distance of the current move command, in body frame
+        self.move = None                   # (forward, right, up, yaw)
+        # Command whose reply waits for the end of the move ('takeoff', 'land', 'forward'...)
+        self.maneuver = None
+        self.battery = 100.0
+        self.motor_time = 0.0
+        self.velocity = (0.0, 0.0, 0.0)
+
+    def step(self, dt):
+        """Advances the model by dt seconds. Returns the maneuver that finished, or None."""
+        finished = None
+        with self.lock:
+            if not self.flying:
+                self.velocity = (0.0, 0.0, 0.0)
+                return None
+            self.motor_time += dt
+            self.battery = max(0.0, self.battery - dt * 0.1)
+
+            if self.move is not None:
+                fwd, right, up, yaw = self.move
+                step = self.speed * dt
+                d_fwd = _toward_zero(fwd, step)
+                d_right = _toward_zero(right, step)
+                d_up = _toward_zero(up, step)
+                d_yaw = _toward_zero(yaw, MAX_YAW_RATE * dt)
+                self.move = (fwd - d_fwd, right - d_right, up - d_up, yaw - d_yaw)
+                if not any(self.move):
+                    self.move = None
+                    finished = self.maneuver
+                    self.maneuver = None
+                    if finished == 'land':
+                        self.flying = False
+            else:
+                lr, fb, ud, yr = self.rc
+                d_right = lr / 100.0 * MAX_SPEED * dt
+                d_fwd = fb / 100.0 * MAX_SPEED * dt
+                d_up = ud / 100.0 * MAX_SPEED * dt
+                d_yaw = yr / 100.0 * MAX_YAW_RATE * dt
+
+            heading = math.radians(self.yaw)
+            dx = d_fwd * math.cos(heading) - d_right * math.sin(heading)
+            dy = d_fwd * math.sin(heading) + d_right * math.cos(heading)
+            self.x += dx
+            self.y += dy
+            self.z = max(0.0, self.z + d_up)
+            self.yaw = (self.yaw + d_yaw + 180.0) % 360.0 - 180.0
+            self.velocity = (dx / dt, dy / dt, d_up / dt) if dt > 0 else (0.0, 0.0, 0.0)
+        return finished
+
+    def state_string(self):
+        """Returns the state in the format the Tello pushes on port 8890."""
+        with self.lock:
+            vgx, vgy, vgz = (int(v) for v in self.velocity)
+            return ("mid:-1;x:0;y:0;z:0;mpry:0,0,0;"
+                    f"pitch:0;roll:0;yaw:{int(self.yaw)};vgx:{vgx};vgy:{vgy};vgz:{vgz};"
+                    f"templ:60;temph:63;tof:{int(self.z) + 10};h:{int(self.z)};"
+                    f"bat:{int(self.battery)};baro:{self.z / 100.0:.2f};time:{int(self.motor_time)};"
+                    "agx:0.00;agy:0.00;agz:-1000.00;\r\n")
+
+
+def _toward_zero(remaining, step):
+    """Returns how much of remaining to cover this step, keeping its sign."""
+    if remaining > 0:
+        return min(remaining, step)
+    return max(remaining, -step)
+
+
+class TelloSimulator:
+    """Serves the command, state and video ports of a simulated Tello."""
+
+    def __init__(self, host='127.0.0.1', latency=0.02, jitter=0.005, loss=0.0,
+                 video_source=None, physics_rate=50, state_rate=10):
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.video_source = video_source
+        self.physics_rate = physics_rate
+        self.state_rate = state_rate
+
+        self.drone = SimulatedDrone()
+        # Where to send the reply of the running maneuver
+        self._maneuver_addr = None
+        self.client_ip = None
+        self.sdk_mode = False
+        self.streaming = False
+        self.video_port = VIDEO_PORT
+        self.state_port = STATE_PORT
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, TELLO_PORT))
+        self.out_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Replies and state come from the drone's address, so a swarm of
+        # simulators on 127.0.0.x can be told apart by their source address
+        self.out_sock.bind((host, 0))
+
+        self._running = False
+        self._threads = []
+        self._ffmpeg = None
+
+        # Statistics
+        self.commands_received = 0
+        self.packets_dropped = 0
+
+    def start(self):
+        """Starts all simulator threads."""
+        self._running = True
+        # The command server checks _running between receives
+        self.sock.settimeout(0.1)
+        for target in (self._command_server, self._physics_loop, self._state_loop, self._video_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stops the threads and frees the ports."""
+        self._running = False
+        if self._ffmpeg is not None:
+            self._ffmpeg.kill()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
+        self.sock.close()
+        self.out_sock.close()
+
+    def _lost(self):
+        return self.loss > 0 and random.random() < self.loss
+
+    def _reply(self, text, addr):
+        if self._lost():
+            self.packets_dropped += 1
+            return
+        delay = max(0.0, random.gauss(self.latency, self.jitter))
+        timer = threading.Timer(delay, self._send_reply, (text.encode('utf-8'), addr))
+        timer.daemon = True
+        timer.start()
+
+    def _send_reply(self, data, addr):
+        try:
+            self.out_sock.sendto(data, addr)
+        except OSError:
+            # Stopped before the reply was due
+            pass
+
+    def _command_server(self):
+        while self._running:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if self._lost():
+                self.packets_dropped += 1
+                continue
+            self.commands_received += 1
+            command = data.decode('utf-8', errors='ignore').strip()
+            reply = self.handle_command(command, addr)
+            if reply is not None:
+                self._reply(reply, addr)
+
+    def handle_command(self, command, addr):
+        """
+        Applies a command to the model. Returns the reply text, or None for rc
+        and for maneuvers (takeoff, land, moves): like a real Tello these answer
+        when they finish, and rc is ignored while one runs.
+        """
+        parts = command.split()
+        if not parts:
+            return 'error'
+        name, args = parts[0], parts[1:]
+        drone = self.drone
+
+        if name == 'command':
+            self.sdk_mode = True
+            self.client_ip = addr[0]
+            return 'ok'
+        if not self.sdk_mode:
+            return None
+
+        try:
+            with drone.lock:
+                if name == 'rc':
+                    if drone.maneuver is None:
+                        drone.rc = tuple(max(-100, min(100, int(float(v)))) for v in args[:4])
+                    return None
+                if name in ('stop', 'emergency'):
+                    if drone.maneuver is not None:
+                        # The interrupted maneuver fails
+                        self._reply('error', self._maneuver_addr)
+                    drone.rc = (0, 0, 0, 0)
+                    drone.move = None
+                    drone.maneuver = None
+                    if name == 'emergency':
+                        drone.flying = False
+                        drone.z = 0.0
+                    return 'ok'
+                if drone.maneuver is not None:
+                    # Busy with the previous maneuver
+                    return 'error'
+                if name == 'takeoff':
+                    if drone.flying:
+                        return 'error'
+                    drone.flying = True
+                    drone.rc = (0, 0, 0, 0)
+                    drone.move = (0.0, 0.0, TAKEOFF_HEIGHT - drone.z, 0.0)
+                    return self._start_maneuver(name, addr)
+                if name == 'land':
+                    drone.rc = (0, 0, 0, 0)
+                    if not drone.flying or drone.z <= 0:
+                        drone.flying = False
+                        return 'ok'
+                    drone.move = (0.0, 0.0, -drone.z, 0.0)
+                    return self._start_maneuver(name, addr)
+                if name in ('forward', 'back', 'left', 'right', 'up', 'down', 'cw', 'ccw'):
+                    if not drone.flying:
+                        return 'error'
+                    value = float(args[0])
+                    move = {
+                        'forward': (value, 0, 0, 0), 'back': (-value, 0, 0, 0),
+                        'right': (0, value, 0, 0), 'left': (0, -value, 0, 0),
+                        'up': (0, 0, value, 0), 'down': (0, 0, -value, 0),
+                        'cw': (0, 0, 0, value), 'ccw': (0, 0, 0, -value),
+                    }[name]
+                    drone.move = tuple(float(v) for v in move)
+                    drone.rc = (0, 0, 0, 0)
+                    return self._start_maneuver(name, addr)
+                if name == 'speed':
+                    drone.speed = float(args[0])
+                    return 'ok'
+                if name == 'battery?':
+                    return str(int(drone.battery))
+                if name == 'time?':
+                    return f"{int(drone.motor_time)}s"
+                if name == 'speed?':
+                    return str(int(drone.speed))
+        except (IndexError, ValueError):
+            return 'error'
+
+        if name == 'streamon':
+            self.streaming = True
+            return 'ok'
+        if name == 'streamoff':
+            self.streaming = False
+            return 'ok'
+        if name == 'port' and len(args) == 2:
+            self.state_port, self.video_port = int(args[0]), int(args[1])
+            return 'ok'
+        if name in ('setfps', 'setbitrate', 'setresolution'):
+            return 'ok'
+        return 'error'
+
+    def _start_maneuver(self, name, addr):
+        # Called with the drone lock held; the reply is sent by the physics loop
+        self.drone.maneuver = name
+        self._maneuver_addr = addr
+        return None
+
+    def _physics_loop(self):
+        period = 1.0 / self.physics_rate
+        last = time.monotonic()
+        while self._running:
+            time.sleep(period)
+            now = time.monotonic()
+            if self.drone.step(now - last) is not None:
+                self._reply('ok', self._maneuver_addr)
+            last = now
+            with self.drone.lock:
+                # Landing finished
+                if self.drone.flying and self.drone.z <= 0 and self.drone.move is None and self.drone.rc == (0, 0, 0, 0):
+                    self.drone.flying = False
+
+    def _state_loop(self):
+        period = 1.0 / self.state_rate
+        while self._running:
+            time.sleep(period)
+            if self.client_ip is None or self._lost():
+                continue
+            self.out_sock.sendto(self.drone.state_string().encode('utf-8'),
+                                 (self.client_ip, self.state_port))
+
+    def _video_command(self):
+        if self.video_source:
+            source = ['-stream_loop', '-1', '-re', '-i', self.video_source]
+        else:
+            source = ['-re', '-f', 'lavfi', '-i', 'testsrc=size=960x720:rate=30']
+        return (['ffmpeg', '-loglevel', 'error'] + source +
+                ['-an', '-vf', 'scale=960:720', '-c:v', 'libx264', '-preset', 'ultrafast',
+                 '-tune', 'zerolatency', '-g', '30', '-x264-params', 'aud=1',
+                 '-f', 'h264', '-'])
+
+    def _video_loop(self):
+        """Encodes the test video and sends it to the client like the Tello does."""
+        if shutil.which('ffmpeg') is None:
+            print("ffmpeg not found, the simulator will not stream video.")
+            return
+        while self._running and not self.streaming:
+            time.sleep(0.1)
+        self._ffmpeg = subprocess.Popen(self._video_command(), stdout=subprocess.PIPE)
+
+        buffer = b''
+        while self._running:
+            chunk = self._ffmpeg.stdout.read(4096)
+            if not chunk:
+                break
+            buffer += chunk
+            # Send every complete access unit, i.e. everything before the next AUD
+            while True:
+                end = buffer.find(AUD_START, 1)
+                if end < 0:
+                    break
+                frame, buffer = buffer[:end], buffer[end:]
+                if self.streaming and self.client_ip is not None:
+                    self._send_frame(frame)
+
+    def _send_frame(self, frame):
+        address = (self.client_ip, self.video_port)
+        for i in range(0, len(frame), VIDEO_PACKET_SIZE):
+            if self._lost():
+                self.packets_dropped += 1
+                continue
+            self.out_sock.sendto(frame[i:i + VIDEO_PACKET_SIZE], address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Tello drone")
+    parser.add_argument('--host', default='127.0.0.1', help="address to bind the command port to")
+    parser.add_argument('--latency', type=float, default=20.0, help="mean reply latency (ms)")
+    parser.add_argument('--jitter', type=float, default=5.0, help="reply latency standard deviation (ms)")
+    parser.add_argument('--loss', type=float, default=0.0, help="packet loss probability (0-1)")
+    parser.add_argument('--video', default=None, help="video file to stream instead of the test pattern")
+    args = parser.parse_args()
+
+    sim = TelloSimulator(args.host, args.latency / 1000.0, args.jitter / 1000.0,
+                         args.loss, args.video)
+    sim.start()
+    print(f"Simulated Tello listening on {args.host}:{TELLO_PORT} (Ctrl+C to quit)")
+    try:
+        while True:
+            time.sleep(1.0)
+            d = sim.drone
+            print(f"flying={d.flying} x={d.x:.0f} y={d.y:.0f} z={d.z:.0f} yaw={d.yaw:.0f} "
+                  f"bat={d.battery:.0f} cmds={sim.commands_received} dropped={sim.packets_dropped}")
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+
+
+if __name__ == "__main__":
+    main()
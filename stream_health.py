@@ -0,0 +1,176 @@
+"""
+Video stream health on top of the native ingest (h264_ingest.py).
+
+    health = StreamHealth(request_keyframe=lambda: networking.send_command('streamon', retries=0))
+    cap = H264Capture(11111, health=health)
+    ...
+    health.status()     # 'ok', 'degraded' or 'disconnected'
+
+A lost frame, a truncated reference frame or a decoder error breaks the
+chain of reference frames: everything decoded until the next IDR would be
+smeared garbage. StreamHealth drops those access units before they reach
+the decoder, and when no IDR arrived within request_delay it asks the
+drone for one by re-issuing 'streamon', at most once per request_interval.
+Nothing is requested before the stream produced its first access unit.
+While resynchronising the stream is 'degraded'; 'disconnected' means no
+video arrives at all, which says nothing about the command link.
+"""
+import time
+
+from instrumentation import counter, gauge, histogram
+
+OK = 'ok'
+DEGRADED = 'degraded'
+DISCONNECTED = 'disconnected'
+
+# Wait this long (s) for the next IDR before asking for one
+KEYFRAME_REQUEST_DELAY = 0.3
+# Minimum time (s) between two keyframe requests
+KEYFRAME_REQUEST_INTERVAL = 2.0
+# Without any access unit for this long (s) the stream is disconnected
+DISCONNECT_TIMEOUT = 1.0
+
+# Metrics (see instrumentation.py). video.health: 0 ok, 1 degraded, 2 disconnected.
+# video.resync: from the break of the reference chain to the next IDR.
+health_gauge = gauge('video.health')
+chain_breaks = counter('video.chain_breaks')
+units_skipped = counter('video.units_skipped')
+keyframe_requests = counter('video.keyframe_requests')
+resync_time = histogram('video.resync')
+
+_HEALTH_VALUES = {OK: 0, DEGRADED: 1, DISCONNECTED: 2}
+
+
+class StreamHealth:
+    """
+    Decides per AccessUnit whether it can be decoded (admit()), and keeps
+    track of the stream status. admit() and poll() run on the decoding
+    thread, status() can be read from any thread.
+    request_keyframe: called without arguments to ask the drone for an IDR.
+    """
+
+    def __init__(self, request_keyframe=None, request_delay=KEYFRAME_REQUEST_DELAY,
+                 request_interval=KEYFRAME_REQUEST_INTERVAL, disconnect_timeout=DISCONNECT_TIMEOUT):
+        self.request_keyframe = request_keyframe
+        self.request_delay = request_delay
+        self.request_interval = request_interval
+        self.disconnect_timeout = disconnect_timeout
+
+        # Nothing can be decoded before the first IDR
+        self._synced = False
+        self._broken_since = None
+        self._last_unit_time = None
+        self._last_request = None
+        self._status = DISCONNECTED
+
+        # Statistics
+        self.chain_breaks = 0
+        self.units_skipped = 0
+        self.keyframe_requests = 0
+        self.resyncs = 0
+
+    def admit(self, unit, now=None):
+        """Returns True if the access unit can be decoded, False to drop it."""
+        if now is None:
+            now = time.monotonic()
+        if self._synced and self._last_unit_time is not None and now - self._last_unit_time > self.disconnect_timeout:
+            # frame_num cannot tell how much was lost during a long gap
+            self.break_chain(now, "stream interrupted")
+        self._last_unit_time = now
+        if self._broken_since is None and not self._synced:
+            # Stream (re)started: wait for its first IDR
+            self._broken_since = now
+
+        if unit.keyframe and not unit.truncated:
+            if not self._synced:
+                self._synced = True
+                self.resyncs += 1
+                resync_time.record(now - self._broken_since)
+                if self.chain_breaks:
+                    print(f"Video stream recovered after {(now - self._broken_since) * 1000.0:.0f} ms.")
+                self._broken_since = None
+            self._update(now)
+            return True
+
+        if self._synced:
+            if unit.lost_before:
+                self.break_chain(now, f"{unit.lost_before} frame(s) lost")
+            elif unit.truncated and (unit.reference or unit.keyframe):
+                self.break_chain(now, "reference frame truncated")
+            elif unit.truncated:
+                # A broken non-reference frame: nothing depends on it
+                self._skip()
+                self._update(now)
+                return False
+            else:
+                self._update(now)
+                return True
+
+        self._skip()
+        self.poll(now)
+        return False
+
+    def break_chain(self, now=None, reason="decoder error"):
+        """Drops everything up to the next IDR, e.g. after a decoder error."""
+        if now is None:
+            now = time.monotonic()
+        if not self._synced:
+            return
+        self._synced = False
+        self._broken_since = now
+        self.chain_breaks += 1
+        chain_breaks.inc()
+        print(f"Video stream degraded ({reason}): waiting for a keyframe.")
+        self._update(now)
+
+    def _skip(self):
+        self.units_skipped += 1
+        units_skipped.inc()
+
+    def poll(self, now=None):
+        """Asks for a keyframe when the wait for one is too long. Call it regularly."""
+        if now is None:
+            now = time.monotonic()
+        status = self._update(now)
+        if status == OK or self.request_keyframe is None or self._last_unit_time is None:
+            # Before the first access unit the stream is still starting: nothing to resync
+            return
+        waiting_since = self._broken_since if status == DEGRADED else self._last_unit_time
+        if waiting_since is not None and now - waiting_since < self.request_delay:
+            return
+        if self._last_request is not None and now - self._last_request < self.request_interval:
+            return
+        # Re-issuing 'streamon' makes the Tello send an IDR (and restarts a stopped stream)
+        self._last_request = now
+        self.keyframe_requests += 1
+        keyframe_requests.inc()
+        try:
+            self.request_keyframe()
+        except Exception as e:
+            print(f"Error requesting a keyframe: {e}")
+
+    def _update(self, now):
+        if self._last_unit_time is None or now - self._last_unit_time > self.disconnect_timeout:
+            status = DISCONNECTED
+        elif not self._synced:
+            status = DEGRADED
+        else:
+            status = OK
+        if status != self._status:
+            self._status = status
+            health_gauge.set(_HEALTH_VALUES[status])
+        return status
+
+    def status(self, now=None):
+        """Returns OK, DEGRADED or DISCONNECTED."""
+        return self._update(time.monotonic() if now is None else now)
+
+    def stats(self):
+        """Returns the status and counters as a dictionary."""
+        return {
+            'status': self.status(),
+            'chain_breaks': self.chain_breaks,
+            'units_skipped': self.units_skipped,
+            'keyframe_requests': self.keyframe_requests,
+            'resyncs': self.resyncs,
+        }
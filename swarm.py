@@ -0,0 +1,371 @@
+"""
+Several Tellos in station mode from one ground station.
+
+    swarm = TelloSwarm(['192.168.0.11', '192.168.0.12'])
+    swarm.start()
+    swarm.connect()
+    swarm.execute_all('takeoff')
+    swarm.set_rc_all((0, 20, 0, 0))     # sent to every drone on each rc tick
+    ...
+    swarm.hover()
+    swarm.execute_all('land')
+    swarm.stop()
+
+All drones share one command socket and one state socket, served by a
+single selectors loop thread: replies and state packets are routed to the
+drone by their source address, each drone has its own CommandChannel (see
+networking.py: one command at a time, only idempotent ones resent), and the
+rc setpoints of all drones go out back to back in the same tick.
+
+Several simulators on the loopback network make a test swarm:
+    python simulator.py --host 127.0.0.2
+    python simulator.py --host 127.0.0.3
+    python swarm.py 127.0.0.2 127.0.0.3
+"""
+import argparse
+import selectors
+import socket
+import threading
+import time
+
+from instrumentation import counter, histogram
+from networking import CONNECTION_TIMEOUT, CommandChannel, CommandTimeout, PendingCommand, rc_sent, resolve
+from telemetry import TELLO_STATE_PORT, TelemetrySnapshot, parse_state, state_interval, state_invalid, state_packets
+
+# Default rate (Hz) at which the rc setpoints are sent
+RC_RATE_HZ = 20
+
+# Receive buffer of the shared sockets: dozens of drones push state at 10 Hz
+SOCKET_BUFFER = 1 << 20
+
+# Metrics (see instrumentation.py). swarm.rc_tick: time to send the rc of all drones.
+swarm_unknown = counter('swarm.unknown_source')
+swarm_rc_tick = histogram('swarm.rc_tick')
+
+
+class SwarmDrone:
+    """One drone of the swarm: its address, command queue, state and rc setpoint."""
+
+    def __init__(self, name, ip, port=8889):
+        self.name = name
+        self.ip = ip
+        self.address = (ip, port)
+
+        self.commands = CommandChannel()
+
+        # rc setpoint (a, b, c, d) sent on every tick, None: send nothing
+        self.rc = None
+
+        self.is_connected = False
+        self.last_response_time = None
+        self._snapshot = None
+        self._state_seq = 0
+
+    def snapshot(self):
+        """Returns the latest TelemetrySnapshot, or None if nothing arrived yet."""
+        return self._snapshot
+
+    def __repr__(self):
+        return f"SwarmDrone({self.name!r}, {self.ip!r}, connected={self.is_connected})"
+
+
+class TelloSwarm:
+    """
+    Commands, state and rc of N drones over one socket set and one I/O thread.
+    drones: IP addresses, or (name, ip) pairs. Methods taking a drone accept
+    its name; every method can be called from any thread.
+    """
+
+    def __init__(self, drones, local_port=9010, state_port=TELLO_STATE_PORT, rc_rate=RC_RATE_HZ):
+        self.drones = {}
+        self._by_ip = {}
+        for entry in drones:
+            name, ip = (entry, entry) if isinstance(entry, str) else entry
+            drone = SwarmDrone(name, ip)
+            self.drones[name] = drone
+            self._by_ip[ip] = drone
+
+        self.LOCAL_PORT = local_port
+        self.STATE_PORT = state_port
+        self.rc_period = 1.0 / rc_rate
+
+        self.cmd_sock = self._bind(local_port)
+        self.state_sock = self._bind(state_port)
+        # Other threads wake the loop up by writing to this pair
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.cmd_sock, selectors.EVENT_READ, self._on_reply)
+        self._selector.register(self.state_sock, selectors.EVENT_READ, self._on_state)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, self._on_wake)
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+        # Statistics
+        self.rc_ticks = 0
+        self.unknown_packets = 0
+
+    @staticmethod
+    def _bind(port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        try:
+            sock.bind(('', port))
+        except OSError as e:
+            print(f"Error binding to socket: {e}")
+            print("Please ensure no other Tello scripts are running and try again.")
+            exit()
+        sock.setblocking(False)
+        return sock
+
+    def start(self):
+        """Starts the I/O thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='swarm')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the I/O thread and closes the sockets. Waiting commands fail with CommandTimeout."""
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        finished = []
+        with self._lock:
+            for drone in self.drones.values():
+                finished += drone.commands.cancel("cancelled: swarm stopped.")
+        resolve(finished)
+        self._selector.close()
+        for sock in (self.cmd_sock, self.state_sock, self._wake_r, self._wake_w):
+            sock.close()
+
+    def drone(self, name):
+        """Returns the SwarmDrone called name."""
+        return self.drones[name]
+
+    # Commands
+
+    def send_command(self, name, command, timeout=None, retries=None):
+        """
+        Queues a command for one drone. Returns a concurrent.futures.Future that
+        resolves to the reply or fails with CommandTimeout.
+        Only idempotent commands are resent (see networking.command_retries()).
+        """
+        drone = self.drones[name]
+        pending = PendingCommand(command, timeout, retries)
+        with self._lock:
+            drone.commands.submit(pending)
+        self._wake()
+        return pending.future
+
+    def broadcast(self, command, timeout=None, retries=None):
+        """Queues a command for every drone. Returns {name: Future}."""
+        return {name: self.send_command(name, command, timeout, retries) for name in self.drones}
+
+    def execute_all(self, command, timeout=None, retries=None):
+        """Sends a command to every drone and waits for all replies. Returns {name: reply or None}."""
+        futures = self.broadcast(command, timeout, retries)
+        replies = {}
+        for name, future in futures.items():
+            try:
+                replies[name] = future.result()
+            except CommandTimeout as e:
+                print(f"{name}: {e}")
+                replies[name] = None
+        return replies
+
+    def connect(self):
+        """
+        Puts every drone in SDK mode ('command' -> 'ok').
+        Returns {name: True/False}.
+        """
+        replies = self.execute_all('command', timeout=1.0, retries=4)
+        result = {}
+        for name, reply in replies.items():
+            ok = reply == 'ok'
+            result[name] = ok
+            if ok:
+                print(f"{name}: connected.")
+            else:
+                print(f"{name}: failed to connect.")
+        return result
+
+    # rc
+
+    def set_rc(self, name, setpoint):
+        """Sets the rc setpoint (a, b, c, d) of one drone; None stops sending rc to it."""
+        self.drones[name].rc = None if setpoint is None else tuple(int(v) for v in setpoint)
+
+    def set_rc_all(self, setpoint):
+        """Gives every drone the same rc setpoint; they all receive it in the next tick."""
+        setpoint = None if setpoint is None else tuple(int(v) for v in setpoint)
+        for drone in self.drones.values():
+            drone.rc = setpoint
+
+    def hover(self):
+        """Sets every rc setpoint to 0."""
+        self.set_rc_all((0, 0, 0, 0))
+
+    # I/O loop
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Already woken up, or closed
+            pass
+
+    def _run(self):
+        next_rc = time.monotonic() + self.rc_period
+        while self._running:
+            timeout = next_rc - time.monotonic()
+            with self._lock:
+                for drone in self.drones.values():
+                    deadline = drone.commands.next_deadline()
+                    if deadline is not None:
+                        timeout = min(timeout, deadline - time.monotonic())
+            for key, _ in self._selector.select(max(0.0, timeout)):
+                key.data()
+
+            now = time.monotonic()
+            self._dispatch(now)
+            if now >= next_rc:
+                self._send_rc()
+                next_rc += self.rc_period
+                if next_rc < now:
+                    # Fell behind: do not send a burst of ticks
+                    next_rc = now + self.rc_period
+            self._watch_connections(time.time())
+
+    def _receive(self, sock):
+        """Yields (data, drone) for every datagram waiting on sock."""
+        while True:
+            try:
+                data, addr = sock.recvfrom(1518)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            drone = self._by_ip.get(addr[0])
+            if drone is None:
+                self.unknown_packets += 1
+                swarm_unknown.inc()
+                continue
+            yield data, drone
+
+    def _on_wake(self):
+        try:
+            while self._wake_r.recv(512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _on_reply(self):
+        for data, drone in self._receive(self.cmd_sock):
+            resp = data.decode(encoding="utf-8", errors="ignore").strip()
+            drone.last_response_time = time.time()
+            drone.is_connected = True
+            with self._lock:
+                finished = drone.commands.on_reply(resp, time.monotonic())
+            resolve(finished)
+
+    def _on_state(self):
+        for data, drone in self._receive(self.state_sock):
+            fields = parse_state(data)
+            if not fields:
+                state_invalid.inc()
+                continue
+            drone._state_seq += 1
+            snapshot = TelemetrySnapshot(drone._state_seq, time.time(), **fields)
+            state_packets.inc()
+            if drone._snapshot is not None:
+                state_interval.record(snapshot.timestamp - drone._snapshot.timestamp)
+            drone._snapshot = snapshot
+            drone.last_response_time = snapshot.timestamp
+
+    def _dispatch(self, now):
+        """Resends or fails commands past their deadline and sends the next queued ones."""
+        finished = []
+        with self._lock:
+            for drone in self.drones.values():
+                to_send, done = drone.commands.poll(now)
+                finished += done
+                for command in to_send:
+                    self._sendto(command, drone)
+        resolve(finished)
+
+    def _send_rc(self):
+        start = time.perf_counter()
+        sent = 0
+        for drone in self.drones.values():
+            setpoint = drone.rc
+            if setpoint is not None and self._sendto('rc %d %d %d %d' % setpoint, drone):
+                sent += 1
+        if sent:
+            rc_sent.inc(sent)
+            swarm_rc_tick.record(time.perf_counter() - start)
+        self.rc_ticks += 1
+
+    def _sendto(self, command, drone):
+        try:
+            self.cmd_sock.sendto(command.encode('utf-8'), drone.address)
+            return True
+        except OSError as e:
+            print(f"Error sending '{command}' to {drone.name}: {e}")
+            return False
+
+    def _watch_connections(self, now):
+        for drone in self.drones.values():
+            if (drone.is_connected and drone.last_response_time
+                    and now - drone.last_response_time > CONNECTION_TIMEOUT):
+                print(f"Connection to {drone.name} lost (timeout).")
+                drone.is_connected = False
+
+    def stats(self):
+        """Returns the counters of the swarm and of every drone."""
+        return {
+            'rc_ticks': self.rc_ticks,
+            'unknown_packets': self.unknown_packets,
+            'drones': {
+                name: {
+                    'connected': drone.is_connected,
+                    'queued': len(drone.commands.queue),
+                    'retried': drone.commands.commands_retried,
+                    'timed_out': drone.commands.commands_timed_out,
+                    'unexpected_replies': drone.commands.unexpected_replies,
+                    'last_rtt_ms': None if drone.commands.last_rtt is None else drone.commands.last_rtt * 1000.0,
+                    'battery': None if drone.snapshot() is None else drone.snapshot().bat,
+                }
+                for name, drone in self.drones.items()
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connects to several Tellos and reports their state")
+    parser.add_argument('ips', nargs='+', help="IP addresses of the drones (station mode)")
+    parser.add_argument('--local-port', type=int, default=9010, help="local command port")
+    args = parser.parse_args()
+
+    swarm = TelloSwarm(args.ips, args.local_port)
+    swarm.start()
+    swarm.connect()
+    try:
+        while True:
+            time.sleep(1.0)
+            for name, reply in swarm.execute_all('battery?').items():
+                snapshot = swarm.drone(name).snapshot()
+                print(f"{name}: battery={reply} state={snapshot}")
+    except KeyboardInterrupt:
+        pass
+    swarm.stop()
+
+
+if __name__ == "__main__":
+    main()
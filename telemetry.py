@@ -0,0 +1,138 @@
+import socket
+import threading
+import time
+
+from instrumentation import counter, histogram
+
+# Local port the Tello pushes its state string to
+TELLO_STATE_PORT = 8890
+
+# Fields of the state string, in the order the Tello sends them, and their types.
+# e.g. "pitch:0;roll:0;yaw:0;vgx:0;vgy:0;vgz:0;templ:0;temph:0;tof:0;h:0;bat:0;
+#       baro:0.00;time:0;agx:0.00;agy:0.00;agz:0.00;"
+STATE_FIELDS = (
+    ('pitch', int), ('roll', int), ('yaw', int),    # attitude (deg)
+    ('vgx', int), ('vgy', int), ('vgz', int),       # speed (cm/s)
+    ('templ', int), ('temph', int),                 # temperature (C)
+    ('tof', int), ('h', int),                       # distance to ground / height (cm)
+    ('bat', int),                                   # battery (%)
+    ('baro', float),                                # barometer height (m)
+    ('time', int),                                  # motor time (s)
+    ('agx', float), ('agy', float), ('agz', float), # acceleration (0.001g)
+)
+_FIELD_TYPES = dict(STATE_FIELDS)
+
+# Metrics (see instrumentation.py). Gaps in state.interval well above 0.1 s are lost packets.
+state_packets = counter('state.packets')
+state_invalid = counter('state.invalid')
+state_interval = histogram('state.interval')
+
+
+class TelemetrySnapshot:
+    """One parsed state packet. Snapshots are never modified after creation."""
+    __slots__ = ('seq', 'timestamp') + tuple(name for name, _ in STATE_FIELDS)
+
+    def __init__(self, seq=0, timestamp=0.0, **fields):
+        self.seq = seq
+        self.timestamp = timestamp
+        for name, cast in STATE_FIELDS:
+            setattr(self, name, fields.get(name, cast()))
+
+    def as_dict(self):
+        """Returns the snapshot as a plain dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"TelemetrySnapshot(seq={self.seq}, bat={self.bat}, h={self.h}, time={self.time})"
+
+
+def parse_state(data):
+    """
+    Parses a raw state packet ("key:value;key:value;...") into a dictionary.
+    Unknown keys (mid, x, y, z, mpry, ...) and malformed values are ignored.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', errors='ignore')
+    fields = {}
+    for item in data.strip().split(';'):
+        key, sep, value = item.partition(':')
+        cast = _FIELD_TYPES.get(key)
+        if not sep or cast is None:
+            continue
+        try:
+            fields[key] = cast(float(value)) if cast is int else cast(value)
+        except ValueError:
+            pass
+    return fields
+
+
+class TelloTelemetry:
+    """
+    Listens to the state stream the Tello pushes on port 8890 (about 10 Hz).
+    Readers call snapshot(); the receiver thread replaces the snapshot as a
+    whole, so reading it needs no lock.
+    """
+
+    def __init__(self, local_port=TELLO_STATE_PORT):
+        self.LOCAL_PORT = local_port
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(('', self.LOCAL_PORT))
+        except OSError as e:
+            print(f"Error binding to state port: {e}")
+            print("Please ensure no other Tello scripts are running and try again.")
+            exit()
+
+        self._snapshot = None
+        self._seq = 0
+        self._thread = None
+
+        # Optional FlightRecorder that logs the raw state packets
+        self.recorder = None
+
+        # Statistics
+        self.packets_received = 0
+        self.packets_invalid = 0
+
+    def start(self):
+        """Starts the state receiver thread."""
+        self._thread = threading.Thread(target=self.state_receiver)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def state_receiver(self):
+        """Receives and parses state packets from the Tello drone."""
+        while True:
+            try:
+                data, server = self.sock.recvfrom(1024)
+            except Exception:
+                # This will trigger if the socket is closed
+                break
+            self.handle_packet(data)
+
+    def handle_packet(self, data, timestamp=None):
+        """Parses one state packet and publishes it as the current snapshot."""
+        if self.recorder is not None:
+            self.recorder.record_state(data)
+        fields = parse_state(data)
+        if not fields:
+            self.packets_invalid += 1
+            state_invalid.inc()
+            return None
+        self._seq += 1
+        snapshot = TelemetrySnapshot(self._seq, timestamp or time.time(), **fields)
+        if self._snapshot is not None:
+            state_interval.record(snapshot.timestamp - self._snapshot.timestamp)
+        self._snapshot = snapshot
+        self.packets_received += 1
+        state_packets.inc()
+        return snapshot
+
+    def snapshot(self):
+        """Returns the latest TelemetrySnapshot, or None if nothing arrived yet."""
+        return self._snapshot
+
+    def close(self):
+        """Closes the state socket, which also ends the receiver thread."""
+        self.sock.close()
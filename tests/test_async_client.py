@@ -0,0 +1,14 @@
+import asyncio
+
+from async_client import AsyncTelloClient
+from networking import rc_sent
+
+
+def test_rc_is_not_counted_while_closed():
+    async def send():
+        client = AsyncTelloClient('127.0.0.1')
+        before = rc_sent.value
+        client.send_rc('rc 0 0 0 0')
+        return rc_sent.value - before
+
+    assert asyncio.run(send()) == 0
@@ -0,0 +1,36 @@
+import pytest
+
+from controller import PID
+
+
+def test_integral_stops_while_saturated():
+    pid = PID(kp=1.0, ki=1.0, limit=10.0)
+    for _ in range(100):
+        assert pid.update(20.0, 0.1) == 10.0
+    # Saturated from the first step: nothing was integrated
+    assert pid.integral == 0.0
+    # So the output leaves the limit as soon as the error changes sign
+    assert pid.update(-5.0, 0.1) < 0.0
+
+
+def test_integral_unwinds_while_saturated():
+    pid = PID(kp=1.0, ki=1.0, limit=10.0)
+    pid.integral = 20.0
+    assert pid.update(-1.0, 0.1) == 10.0
+    # Saturated, but the error pulls the output back: keep integrating
+    assert pid.integral == pytest.approx(19.9)
+
+
+def test_integral_limit():
+    pid = PID(kp=0.0, ki=1.0, integral_limit=2.0)
+    for _ in range(50):
+        pid.update(1.0, 0.1)
+    assert pid.integral == 2.0
+    assert pid.update(1.0, 0.1) == pytest.approx(2.0)
+
+
+def test_deadband():
+    pid = PID(kp=1.0, ki=1.0, deadband=5.0)
+    assert pid.update(4.0, 0.1) == 0.0
+    assert pid.integral == 0.0
+    assert pid.update(6.0, 0.1) == 6.0
@@ -0,0 +1,67 @@
+import pytest
+
+from frame_bus import FrameBus
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(slots=3, shape=(4, 4, 3), channels=2)
+    yield bus
+    bus.close()
+
+
+def publish(bus, seq, channel=0):
+    frame = bus.acquire(channel)
+    frame.image[:] = seq
+    bus.publish(frame, seq, float(seq))
+
+
+def test_latest_frame_holds_a_reference(bus):
+    assert bus.latest() is None
+    publish(bus, 1)
+    assert bus.stats()['slots_in_use'] == 1
+    with bus.latest() as frame:
+        assert frame.seq == 1 and frame.timestamp == 1.0
+        assert (frame.image == 1).all()
+        publish(bus, 2)
+        # The reader keeps the old slot alive
+        assert bus.stats()['slots_in_use'] == 2
+    assert frame.image is None
+    assert bus.stats()['slots_in_use'] == 1
+
+
+def test_referenced_slots_are_never_reused(bus):
+    publish(bus, 1)
+    held = [bus.latest()]
+    publish(bus, 2)
+    held.append(bus.latest())
+    publish(bus, 3)
+    # Slots of frames 1 and 2 are read, frame 3 is the newest
+    assert bus.acquire() is None
+    assert bus.stats()['channels'][0]['dropped'] == 1
+    for frame in held:
+        assert (frame.image == frame.seq).all()
+        frame.release()
+    # Releasing twice does not free someone else's reference
+    held[0].release()
+    assert bus.stats()['slots_in_use'] == 1
+    assert bus.acquire() is not None
+
+
+def test_abandoned_slot_is_freed(bus):
+    frame = bus.acquire()
+    assert bus.stats()['slots_in_use'] == 1
+    bus.abandon(frame)
+    assert bus.stats()['slots_in_use'] == 0
+    assert bus.latest() is None
+
+
+def test_channels_are_independent(bus):
+    publish(bus, 5, channel=0)
+    publish(bus, 7, channel=1)
+    assert bus.wait_next(0, after_seq=5, timeout=0.01) is None
+    with bus.wait_next(1, after_seq=5, timeout=0.01) as frame:
+        assert frame.seq == 7 and frame.channel == 1
+    stats = bus.stats()
+    assert [channel['seq'] for channel in stats['channels']] == [5, 7]
+    assert [channel['published'] for channel in stats['channels']] == [1, 1]
@@ -0,0 +1,98 @@
+from h264_ingest import NAL_IDR, NAL_PPS, NAL_SLICE, NAL_SPS, AccessUnitAssembler, parse_sps, split_nal_units
+
+START = b'\x00\x00\x00\x01'
+PACKET_SIZE = 64
+
+
+def bits_to_bytes(bits):
+    # rbsp_stop_one_bit, then pad to whole bytes
+    bits += '1'
+    bits += '0' * (-len(bits) % 8)
+    return bytes(int(bits[i:i + 8], 2) for i in range(0, len(bits), 8))
+
+
+def ue(value):
+    code = bin(value + 1)[2:]
+    return '0' * (len(code) - 1) + code
+
+
+def sps(profile=66, sps_id=0, log2_max_frame_num=4):
+    # profile, constraint flags + level, sps_id, log2_max_frame_num_minus4
+    return bytes([0x67]) + bits_to_bytes(f'{profile:08b}' + '0' * 8 + f'{40:08b}'
+                                        + ue(sps_id) + ue(log2_max_frame_num - 4))
+
+
+def high_sps(log2_max_frame_num=6):
+    # chroma_format_idc 1, bit depths 8, no transform bypass, no scaling matrices
+    return bytes([0x67]) + bits_to_bytes(f'{100:08b}' + '0' * 8 + f'{40:08b}' + ue(0)
+                                        + ue(1) + ue(0) + ue(0) + '0' + '0' + ue(log2_max_frame_num - 4))
+
+
+def slice_nal(frame_num, idr=False, reference=True):
+    header = 0x65 if idr else (0x41 if reference else 0x01)
+    # first_mb_in_slice 0, slice_type, pps_id 0, frame_num (4 bits)
+    return bytes([header]) + bits_to_bytes(ue(0) + ue(7 if idr else 5) + ue(0) + f'{frame_num:04b}')
+
+
+def frame(frame_num, idr=False, reference=True):
+    """One frame as the drone sends it: datagrams of PACKET_SIZE and a shorter last one."""
+    data = START + slice_nal(frame_num, idr, reference) + b'\x55' * 80
+    if idr:
+        data = START + sps() + START + bytes([0x68, 0xce, 0x38, 0x80]) + data
+    return [data[i:i + PACKET_SIZE] for i in range(0, len(data), PACKET_SIZE)]
+
+
+def feed(assembler, datagrams):
+    units = []
+    for data in datagrams:
+        units += assembler.feed(data, 0.0)
+    return units
+
+
+def test_parse_sps():
+    info = parse_sps(sps(sps_id=1, log2_max_frame_num=7))
+    assert (info.sps_id, info.profile, info.log2_max_frame_num, info.separate_colour_plane) == (1, 66, 7, 0)
+    info = parse_sps(high_sps(log2_max_frame_num=6))
+    assert (info.profile, info.log2_max_frame_num) == (100, 6)
+    assert parse_sps(b'\x67\x42') is None
+
+
+def test_split_nal_units():
+    data = START + b'\x67\x01' + b'\x00\x00\x01' + b'\x68\x02'
+    assert [data[start:end] for start, end in split_nal_units(data)] == [b'\x67\x01', b'\x68\x02']
+
+
+def test_frames_are_reassembled():
+    assembler = AccessUnitAssembler(PACKET_SIZE)
+    units = feed(assembler, frame(0, idr=True) + frame(1) + frame(2, reference=False))
+    assert len(units) == 3
+    assert units[0].keyframe and units[0].nal_types == (NAL_SPS, NAL_PPS, NAL_IDR)
+    assert units[1].nal_types == (NAL_SLICE,) and units[1].frame_num == 1 and units[1].reference
+    assert not units[2].reference
+    assert [unit.lost_before for unit in units] == [0, 0, 0]
+    assert not any(unit.truncated for unit in units)
+    assert assembler.sps.log2_max_frame_num == 4
+
+
+def test_lost_frames_are_counted():
+    assembler = AccessUnitAssembler(PACKET_SIZE)
+    units = feed(assembler, frame(0, idr=True) + frame(1) + frame(4))
+    assert units[2].lost_before == 2
+    assert assembler.frames_lost == 2
+
+
+def test_frame_num_wraps_around():
+    assembler = AccessUnitAssembler(PACKET_SIZE)
+    datagrams = frame(0, idr=True)
+    for n in range(1, 20):
+        datagrams += frame(n % 16)
+    units = feed(assembler, datagrams)
+    assert len(units) == 20
+    assert assembler.frames_lost == 0
+
+
+def test_unit_without_its_last_datagram_is_truncated():
+    assembler = AccessUnitAssembler(PACKET_SIZE)
+    units = feed(assembler, frame(0, idr=True) + frame(1)[:-1] + frame(2))
+    assert [unit.truncated for unit in units] == [False, True, False]
+    assert assembler.units_truncated == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from instrumentation import Histogram
+
+
+def test_percentiles_within_bucket_resolution():
+    histogram = Histogram('test')
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000.0)
+    assert histogram.count == 1000
+    assert histogram.percentile(50) == pytest.approx(0.5, rel=0.07)
+    assert histogram.percentile(90) == pytest.approx(0.9, rel=0.07)
+    assert histogram.percentile(99) == pytest.approx(0.99, rel=0.07)
+    # Middle of the top bucket, never above the largest value
+    assert histogram.percentile(100) == pytest.approx(1.0, rel=0.07)
+    assert histogram.percentile(100) <= histogram.max == 1.0
+
+
+def test_small_values_are_exact():
+    histogram = Histogram('test')
+    for us in (3, 5, 7):
+        histogram.record(us * 1e-6)
+    assert histogram.percentile(0) == pytest.approx(3e-6)
+    assert histogram.percentile(50) == pytest.approx(5e-6)
+
+
+def test_empty_and_reset():
+    histogram = Histogram('test')
+    assert histogram.percentile(50) is None
+    assert histogram.summary() == {'count': 0}
+    histogram.record(0.01)
+    histogram.record(-1.0)
+    assert histogram.summary()['count'] == 2
+    histogram.reset()
+    assert histogram.percentile(50) is None
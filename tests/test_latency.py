@@ -0,0 +1,78 @@
+import numpy as np
+
+from latency import LatencyTrace, LatencyTracer, ReceiptClock
+from line_tracker import DEFAULT_BOUNDS, LineTracker
+from recorder import VIDEO_PACKET_SIZE
+
+SPS = b'\x00\x00\x00\x01\x67' + b'\x42' * 10
+PPS = b'\x00\x00\x00\x01\x68' + b'\xce' * 4
+SLICE = b'\x00\x00\x00\x01\x41'
+
+
+def receive_frame(clock, start):
+    """One frame of two datagrams, 5 ms apart."""
+    clock.on_packet(SLICE + bytes(VIDEO_PACKET_SIZE - len(SLICE)), start)
+    clock.on_packet(b'\x55' * 100, start + 0.005)
+
+
+def test_undecoded_frames_do_not_shift_later_matches():
+    clock = ReceiptClock()
+    for n in range(10):
+        receive_frame(clock, n * 0.1)
+    # Frames 0-4 were never decoded; each decode follows its frame by 20 ms
+    for n in range(5, 10):
+        assert clock.match(n * 0.1 + 0.02) == n * 0.1
+    assert clock.frames_unmatched == 5
+
+
+def test_headers_belong_to_the_next_frame():
+    clock = ReceiptClock()
+    clock.on_packet(SPS, 0.0)
+    clock.on_packet(PPS, 0.001)
+    receive_frame(clock, 0.002)
+    assert clock.frames_received == 1
+    assert clock.match(0.03) == 0.0
+
+
+def test_no_match_before_the_frame_is_complete():
+    clock = ReceiptClock(max_delay=1.0)
+    receive_frame(clock, 0.0)
+    assert clock.match(0.001) is None
+    assert clock.match(0.01) == 0.0
+    receive_frame(clock, 1.0)
+    assert clock.match(3.0) is None
+
+
+def test_tracker_stamps_every_stage():
+    tracker = LineTracker(*DEFAULT_BOUNDS)
+    tracer = LatencyTracer()
+    trace = tracer.begin(1, 0.0, received=-0.01)
+    tracker.process(np.zeros((720, 960, 3), np.uint8), trace)
+    tracer.finish(trace)
+    assert [name for name, _ in trace.stamps] == ['receive', 'decode', 'resize', 'classify', 'morph', 'label', 'send']
+    assert set(tracer.summary()['segments']) == {
+        'receive->decode', 'decode->resize', 'resize->classify', 'classify->morph', 'morph->label', 'label->send'}
+
+
+def test_segments_and_total():
+    trace = LatencyTrace(1)
+    trace.mark('receive', 1.0)
+    trace.mark('decode', 1.25)
+    trace.mark('send', 1.5)
+    assert trace.segments() == [('receive->decode', 0.25), ('decode->send', 0.25)]
+    assert trace.total() == 0.5
+
+
+def test_controller_stamps_handoff_tick_and_send():
+    from controller import LineFollowController
+
+    sent = []
+    tracer = LatencyTracer()
+    controller = LineFollowController(sent.append, tracer=tracer)
+    controller.enabled = True
+    trace = tracer.begin(1, 0.0)
+    controller.set_measurement(240, trace=trace)
+    controller._tick(trace.stamps[-1][1] + 0.01, 0.033)
+    assert sent == [(0, 0, 0, 0)]
+    assert [name for name, _ in trace.stamps] == ['decode', 'handoff', 'tick', 'send']
+    assert tracer.traces_finished == 1
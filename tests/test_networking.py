@@ -0,0 +1,121 @@
+import pytest
+
+from networking import LATE_REPLY_WAIT, CommandChannel, CommandTimeout, PendingCommand, resolve
+
+
+def submit(channel, command, timeout=1.0, retries=None):
+    pending = PendingCommand(command, timeout, retries)
+    channel.submit(pending)
+    return pending
+
+
+def reply(channel, text, now):
+    resolve(channel.on_reply(text, now))
+
+
+def poll(channel, now):
+    to_send, finished = channel.poll(now)
+    resolve(finished)
+    return to_send
+
+
+def test_commands_go_out_one_at_a_time():
+    channel = CommandChannel()
+    first = submit(channel, 'command')
+    second = submit(channel, 'battery?')
+    assert poll(channel, 0.0) == ['command']
+    assert poll(channel, 0.1) == []
+    reply(channel, 'ok', 0.2)
+    assert first.future.result(0) == 'ok'
+    assert poll(channel, 0.2) == ['battery?']
+    reply(channel, '87', 0.3)
+    assert second.future.result(0) == '87'
+    assert channel.last_rtt == pytest.approx(0.1)
+
+
+def test_idempotent_command_is_resent():
+    channel = CommandChannel()
+    pending = submit(channel, 'battery?', retries=1)
+    assert poll(channel, 0.0) == ['battery?']
+    assert poll(channel, 1.0) == ['battery?']
+    reply(channel, '87', 1.1)
+    assert pending.future.result(0) == '87'
+    assert pending.attempts == 2
+    assert channel.commands_retried == 1
+
+
+def test_non_idempotent_command_is_never_resent():
+    channel = CommandChannel()
+    pending = submit(channel, 'forward 50', retries=3)
+    assert pending.retries == 0
+    assert poll(channel, 0.0) == ['forward 50']
+    assert poll(channel, 1.0) == []
+    with pytest.raises(CommandTimeout):
+        pending.future.result(0)
+    assert channel.commands_timed_out == 1
+
+
+def test_late_reply_is_drained_before_the_next_command():
+    channel = CommandChannel()
+    submit(channel, 'takeoff')
+    following = submit(channel, 'battery?')
+    poll(channel, 0.0)
+    # takeoff timed out: battery? waits for its late reply
+    assert poll(channel, 1.0) == []
+    assert channel.next_deadline() == pytest.approx(1.0 + LATE_REPLY_WAIT)
+    reply(channel, 'ok', 1.2)
+    assert channel.unexpected_replies == 1
+    assert poll(channel, 1.0 + LATE_REPLY_WAIT) == ['battery?']
+    reply(channel, '87', 1.6)
+    assert following.future.result(0) == '87'
+
+
+def test_reply_that_cannot_answer_the_command_is_dropped():
+    channel = CommandChannel()
+    query = submit(channel, 'battery?')
+    poll(channel, 0.0)
+    reply(channel, 'ok', 0.1)
+    assert not query.future.done()
+    reply(channel, '87', 0.2)
+    assert query.future.result(0) == '87'
+
+    move = submit(channel, 'cw 90')
+    poll(channel, 0.3)
+    reply(channel, '86', 0.4)
+    assert not move.future.done()
+    assert channel.unexpected_replies == 2
+
+
+def test_urgent_command_gets_its_own_reply():
+    channel = CommandChannel()
+    query = submit(channel, 'battery?')
+    poll(channel, 0.0)
+    stop = PendingCommand('stop', 1.0, 0)
+    channel.submit_urgent(stop, 0.1)
+    reply(channel, 'ok', 0.2)
+    assert stop.future.result(0) == 'ok'
+    assert not query.future.done()
+    reply(channel, '87', 0.3)
+    assert query.future.result(0) == '87'
+
+
+def test_urgent_command_times_out():
+    channel = CommandChannel()
+    stop = PendingCommand('stop', 1.0, 0)
+    channel.submit_urgent(stop, 0.0)
+    assert channel.next_deadline() == 1.0
+    poll(channel, 1.0)
+    with pytest.raises(CommandTimeout):
+        stop.future.result(0)
+
+
+def test_cancel_fails_every_waiting_command():
+    channel = CommandChannel()
+    in_flight = submit(channel, 'command')
+    queued = submit(channel, 'streamon')
+    poll(channel, 0.0)
+    resolve(channel.cancel("cancelled."))
+    for pending in (in_flight, queued):
+        with pytest.raises(CommandTimeout):
+            pending.future.result(0)
+    assert channel.next_deadline() is None
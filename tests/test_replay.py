@@ -0,0 +1,49 @@
+import pytest
+
+from recorder import HEADER, VIDEO_PACKET_SIZE, FlightRecorder
+from replay import FlightLog
+
+SPS = b'\x00\x00\x00\x01\x67'
+SLICE = b'\x00\x00\x00\x01\x41'
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    """Ten frames of two datagrams, 0.1 s apart; every fifth frame starts with an SPS."""
+    path = str(tmp_path / 'flight.log')
+    recorder = FlightRecorder(path)
+    recorder.start()
+    start = recorder._start_mono
+    for n in range(10):
+        head = SPS if n % 5 == 0 else SLICE
+        recorder.record_video(head + bytes(VIDEO_PACKET_SIZE - len(head)), start + n * 0.1)
+        recorder.record_video(b'\x55' * 100, start + n * 0.1 + 0.01)
+        recorder.record_state(b'bat:90;', start + n * 0.1 + 0.02)
+    recorder.stop()
+    return path
+
+
+def test_access_units_and_seek(log_path):
+    with FlightLog(log_path) as log:
+        units = list(log.access_units())
+        assert len(units) == 10
+        assert all(len(data) == VIDEO_PACKET_SIZE + 100 for _, data in units)
+        assert log.seek(0.0) == log.seek(0.45)
+        offset = log.seek(0.75)
+        assert offset > HEADER.size
+        assert log.count_access_units(offset) == 5
+        assert list(log.access_units(offset)) == units[5:]
+
+
+def test_closed_when_leaving_the_block(log_path):
+    with pytest.raises(RuntimeError):
+        with FlightLog(log_path) as log:
+            raise RuntimeError
+    assert log.mm.closed
+
+
+def test_not_a_flight_log(tmp_path):
+    path = tmp_path / 'empty.log'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        FlightLog(str(path))
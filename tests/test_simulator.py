@@ -0,0 +1,95 @@
+import socket
+import time
+
+import pytest
+
+from simulator import TAKEOFF_HEIGHT, TELLO_PORT, TelloSimulator
+
+# The simulator binds its command port on its own loopback address
+HOST = '127.0.0.61'
+
+
+@pytest.fixture
+def simulator():
+    simulator = TelloSimulator(HOST, latency=0.001, jitter=0.0)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def client():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    yield sock
+    sock.close()
+
+
+def send(client, command):
+    client.sendto(command.encode('utf-8'), (HOST, TELLO_PORT))
+
+
+def receive(client, timeout=1.0):
+    """Returns the next reply, or None if none arrived within timeout."""
+    client.settimeout(timeout)
+    try:
+        data, addr = client.recvfrom(1024)
+    except socket.timeout:
+        return None
+    assert addr[0] == HOST
+    return data.decode('utf-8')
+
+
+def execute(client, command, timeout=1.0):
+    send(client, command)
+    return receive(client, timeout)
+
+
+def test_commands_need_sdk_mode(simulator, client):
+    assert execute(client, 'battery?', timeout=0.2) is None
+    assert execute(client, 'command') == 'ok'
+    assert execute(client, 'battery?') == '100'
+    assert execute(client, 'speed 100') == 'ok'
+    assert execute(client, 'speed?') == '100'
+    assert execute(client, 'flip x') == 'error'
+
+
+def test_takeoff_and_land_reply_when_finished(simulator, client):
+    execute(client, 'command')
+    execute(client, 'speed 100')
+    start = time.monotonic()
+    send(client, 'takeoff')
+    # rc is ignored and other maneuvers are refused while climbing
+    send(client, 'rc 0 50 0 0')
+    assert receive(client, timeout=0.1) is None
+    assert simulator.drone.rc == (0, 0, 0, 0)
+    assert execute(client, 'forward 50') == 'error'
+    assert receive(client, timeout=3.0) == 'ok'
+    assert time.monotonic() - start >= TAKEOFF_HEIGHT / 100.0 - 0.1
+    assert simulator.drone.z == pytest.approx(TAKEOFF_HEIGHT)
+    assert execute(client, 'takeoff') == 'error'
+
+    assert execute(client, 'land', timeout=3.0) == 'ok'
+    assert not simulator.drone.flying
+    assert simulator.drone.z == 0.0
+
+
+def test_move_replies_when_finished(simulator, client):
+    execute(client, 'command')
+    assert execute(client, 'forward 20') == 'error'
+    execute(client, 'speed 100')
+    assert execute(client, 'takeoff', timeout=3.0) == 'ok'
+    send(client, 'cw 30')
+    assert receive(client, timeout=0.1) is None
+    assert receive(client) == 'ok'
+    assert simulator.drone.yaw == pytest.approx(30.0)
+
+
+def test_stop_fails_the_running_maneuver(simulator, client):
+    execute(client, 'command')
+    send(client, 'takeoff')
+    time.sleep(0.1)
+    send(client, 'stop')
+    assert [receive(client), receive(client)] == ['error', 'ok']
+    assert simulator.drone.maneuver is None
+    assert simulator.drone.move is None
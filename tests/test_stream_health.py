@@ -0,0 +1,53 @@
+from h264_ingest import AccessUnit, H264Receiver
+from stream_health import DEGRADED, OK, StreamHealth
+
+
+def unit(seq, keyframe=False, reference=True, lost_before=0):
+    return AccessUnit(seq, b'', 0.0, 0.0, (), keyframe, reference, seq, lost_before, False)
+
+
+def test_stream_starts_at_the_first_keyframe():
+    requests = []
+    health = StreamHealth(request_keyframe=lambda: requests.append(1))
+    health.poll(0.0)
+    # Nothing to resync before the first access unit
+    assert requests == []
+    assert not health.admit(unit(1), 0.0)
+    assert health.admit(unit(2, keyframe=True), 0.05)
+    assert health.admit(unit(3), 0.1)
+    assert health.status(0.1) == OK
+
+
+def test_lost_reference_frame_breaks_the_chain():
+    requests = []
+    health = StreamHealth(request_keyframe=lambda: requests.append(1))
+    health.admit(unit(1, keyframe=True), 0.0)
+    assert not health.admit(unit(3, lost_before=1), 0.1)
+    assert health.status(0.1) == DEGRADED
+    assert health.chain_breaks == 1
+    assert not health.admit(unit(4), 0.5)
+    assert requests == [1]
+    assert health.admit(unit(5, keyframe=True), 0.6)
+    assert health.status(0.6) == OK
+
+
+def test_units_dropped_on_overflow_break_the_chain():
+    health = StreamHealth()
+    receiver = H264Receiver(max_queued=1)
+    receiver.put([unit(1, keyframe=True)])
+    assert [health.admit(u, 0.0) for u in receiver.get_all(0)] == [True]
+    # The decoder fell behind: P1 and P2 are dropped, P3 needs them
+    receiver.put([unit(2), unit(3), unit(4)])
+    units = receiver.get_all(0)
+    assert [u.seq for u in units] == [4]
+    assert units[0].lost_before == 2
+    assert not health.admit(units[0], 0.1)
+    assert health.chain_breaks == 1
+    assert health.status(0.1) == DEGRADED
+
+
+def test_dropped_non_reference_frames_are_harmless():
+    receiver = H264Receiver(max_queued=1)
+    receiver.put([unit(1, reference=False), unit(2)])
+    assert receiver.get_all(0)[0].lost_before == 0
+    assert receiver.units_dropped == 1
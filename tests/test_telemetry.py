@@ -0,0 +1,31 @@
+from telemetry import STATE_FIELDS, TelemetrySnapshot, parse_state
+
+STATE = (b"mid:-1;x:0;y:0;z:0;mpry:0,0,0;pitch:1;roll:-2;yaw:90;vgx:0;vgy:0;vgz:0;"
+         b"templ:60;temph:62;tof:10;h:0;bat:87;baro:123.45;time:0;agx:-3.00;agy:1.00;agz:-999.00;\r\n")
+
+
+def test_parse_state():
+    fields = parse_state(STATE)
+    assert set(fields) == {name for name, _ in STATE_FIELDS}
+    assert fields['yaw'] == 90
+    assert fields['roll'] == -2
+    assert fields['bat'] == 87
+    assert fields['baro'] == 123.45
+    assert fields['agz'] == -999.0
+    assert isinstance(fields['tof'], int)
+
+
+def test_parse_state_skips_malformed_values():
+    assert parse_state("bat:87.0;h:abc;pitch;yaw:") == {'bat': 87}
+    assert parse_state(b"") == {}
+
+
+def test_snapshot_defaults_missing_fields():
+    snapshot = TelemetrySnapshot(3, 1.5, **parse_state("bat:50;baro:1.5"))
+    values = snapshot.as_dict()
+    assert values['seq'] == 3
+    assert values['timestamp'] == 1.5
+    assert values['bat'] == 50
+    assert values['baro'] == 1.5
+    assert values['h'] == 0
+    assert values['agx'] == 0.0
@@ -0,0 +1,67 @@
+import time
+
+import cv2
+
+# Trackbar name, index in (h, s, v) and maximum value
+TRACKBARS = (
+    ('H_min', 0, 179), ('H_max', 0, 179),   # Hue goes up to 179 in OpenCV
+    ('S_min', 1, 255), ('S_max', 1, 255),
+    ('V_min', 2, 255), ('V_max', 2, 255),
+)
+
+# Default preview rate (Hz)
+DISPLAY_RATE = 15
+
+
+class HsvTuner:
+    """
+    HSV range trackbars with cached values.
+    The bounds are only updated by the trackbar callbacks, so reading them
+    costs nothing per frame. The preview is shown at most display_rate times
+    per second, independently of how fast frames are processed.
+    """
+
+    def __init__(self, window_title, lower, upper, display_rate=DISPLAY_RATE):
+        self.window_title = window_title
+        self.lower = list(lower)
+        self.upper = list(upper)
+        self._changed = True
+
+        self.display_period = 1.0 / display_rate if display_rate else 0.0
+        self._next_display = 0.0
+
+        cv2.namedWindow(window_title, cv2.WINDOW_NORMAL)
+        for name, channel, maximum in TRACKBARS:
+            bounds = self.lower if name.endswith('_min') else self.upper
+            cv2.createTrackbar(name, window_title, bounds[channel], maximum,
+                               self._make_callback(bounds, channel))
+
+    def _make_callback(self, bounds, channel):
+        def on_trackbar(val):
+            bounds[channel] = val
+            self._changed = True
+        return on_trackbar
+
+    def bounds(self):
+        """Returns the current (lower, upper) HSV bounds."""
+        return tuple(self.lower), tuple(self.upper)
+
+    def poll(self):
+        """Returns (lower, upper) if a trackbar moved since the last call, otherwise None."""
+        if not self._changed:
+            return None
+        self._changed = False
+        return self.bounds()
+
+    def preview_due(self):
+        """True if the preview should be drawn for this frame."""
+        return time.monotonic() >= self._next_display
+
+    def show(self, image):
+        """Shows image in the window and schedules the next preview."""
+        cv2.imshow(self.window_title, image)
+        now = time.monotonic()
+        self._next_display += self.display_period
+        if self._next_display <= now:
+            # Do not try to catch up after a slow frame
+            self._next_display = now + self.display_period
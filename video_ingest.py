@@ -0,0 +1,193 @@
+"""
+Video of several drones at once.
+
+    swarm = TelloSwarm(['192.168.0.11', '192.168.0.12'])
+    swarm.start()
+    swarm.connect()
+    ingest = VideoIngest(swarm.drones)
+    ingest.configure(swarm)     # 'port' + 'streamon': one video port per drone
+    ingest.start()
+    with ingest.latest('192.168.0.11') as frame:
+        ...
+
+Every drone streams to its own local port (11111, 11112, ...). The streams
+are decoded by a pool of worker processes, as many as there are CPU cores,
+each owning some of the streams. Frames are decoded straight into a
+FrameBus (see frame_bus.py) with one channel per drone, so they reach the
+consumer, or any other process the bus is handed to, without being copied
+or pickled.
+"""
+import multiprocessing
+import os
+import threading
+import time
+
+from capture import STALE_FRAME_TIMEOUT
+from frame_bus import FRAME_SHAPE, FrameBus, capture_into
+from instrumentation import counter, histogram
+from networking import CommandTimeout
+
+# First local video port; the drones get consecutive ports
+VIDEO_PORT = 11111
+
+# Frame slots per stream: the newest frame plus the ones consumers still hold
+SLOTS = 4
+
+# Metrics (see instrumentation.py). video.ingest_lag: decode -> handed out by wait_next().
+frames_decoded = counter('video.frames')
+ingest_lag = histogram('video.ingest_lag')
+
+
+def stream_address(port):
+    """OpenCV address of a Tello video stream on a local port."""
+    return f'udp://@0.0.0.0:{port}?overrun_nonfatal=1&fifo_size=50000000'
+
+
+def _ingest_worker(streams, bus, failures, stop):
+    """Worker process: decodes its streams, one thread each (OpenCV releases the GIL)."""
+    threads = []
+    for channel, port in streams:
+        def on_failure(channel=channel):
+            with failures.get_lock():
+                failures[channel] += 1
+        thread = threading.Thread(target=capture_into, args=(bus, stream_address(port), channel, stop, on_failure))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    stop.wait()
+    for thread in threads:
+        thread.join(timeout=2.0)
+    if not any(thread.is_alive() for thread in threads):
+        bus.close()
+
+
+class VideoIngest:
+    """
+    Decodes the video streams of several drones in worker processes.
+    names: the drones (e.g. TelloSwarm.drones); the n-th one streams to base_port + n.
+    workers: number of decoding processes, default one per CPU core (at most one per stream).
+    The frames are BusFrames: release them (or use them with `with`) when done.
+    """
+
+    def __init__(self, names, base_port=VIDEO_PORT, workers=None, shape=FRAME_SHAPE, slots=SLOTS):
+        self.ports = {name: base_port + i for i, name in enumerate(names)}
+        self.channels = {name: i for i, name in enumerate(self.ports)}
+        self.workers = min(workers or os.cpu_count() or 1, len(self.ports))
+        self.shape = tuple(shape)
+        self.slots = slots
+
+        self.bus = None
+        self._failures = None
+        self._stop = None
+        self._processes = []
+        self._monitor = None
+        self._running = False
+
+        # Statistics
+        self._published = [0] * len(self.ports)
+        self._frame_counters = {name: counter(f'video.{name}.frames') for name in self.ports}
+
+    def configure(self, swarm):
+        """
+        Assigns each drone its video port ('port <state port> <video port>')
+        and starts its stream. Returns {name: True/False}.
+        """
+        futures = {}
+        for name, port in self.ports.items():
+            futures[name] = [swarm.send_command(name, f'port {swarm.STATE_PORT} {port}'),
+                             swarm.send_command(name, 'streamon')]
+        result = {}
+        for name, pending in futures.items():
+            replies = []
+            for future in pending:
+                try:
+                    replies.append(future.result())
+                except CommandTimeout as e:
+                    print(f"{name}: {e}")
+                    replies.append(None)
+            result[name] = all(reply == 'ok' for reply in replies)
+            if not result[name]:
+                print(f"{name}: could not start the video on port {self.ports[name]} ({replies}).")
+        return result
+
+    def start(self):
+        """Creates the frame bus and starts the worker processes."""
+        self.bus = FrameBus(self.slots * len(self.ports), self.shape, len(self.ports))
+        self._failures = multiprocessing.Array('q', len(self.ports))
+        self._stop = multiprocessing.Event()
+
+        assignment = [[] for _ in range(self.workers)]
+        for name, port in self.ports.items():
+            channel = self.channels[name]
+            assignment[channel % self.workers].append((channel, port))
+        for streams in assignment:
+            process = multiprocessing.Process(
+                target=_ingest_worker, args=(streams, self.bus, self._failures, self._stop), daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        self._running = True
+        self._monitor = threading.Thread(target=self._count_frames)
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def stop(self):
+        """Stops the workers and frees the shared memory."""
+        self._running = False
+        if self._stop is not None:
+            self._stop.set()
+        for process in self._processes:
+            process.join(timeout=3.0)
+            if process.is_alive():
+                # Still blocked in cap.read()
+                process.terminate()
+                process.join()
+        self._processes = []
+        if self._monitor is not None:
+            self._monitor.join(timeout=1.0)
+            self._monitor = None
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+    def _count_frames(self):
+        # The workers publish into the bus directly; feed the metrics from its counters
+        while self._running:
+            time.sleep(0.2)
+            channels = self.bus.stats()['channels']
+            for name, channel in self.channels.items():
+                published = channels[channel]['published']
+                new = published - self._published[channel]
+                if new:
+                    self._published[channel] = published
+                    self._frame_counters[name].inc(new)
+                    frames_decoded.inc(new)
+
+    def latest(self, name):
+        """Returns the newest BusFrame of a drone, or None."""
+        return self.bus.latest(self.channels[name])
+
+    def wait_next(self, name, after_seq, timeout=None):
+        """Waits for a frame of a drone newer than after_seq. Returns its BusFrame, or None on timeout."""
+        frame = self.bus.wait_next(self.channels[name], after_seq, timeout)
+        if frame is not None:
+            ingest_lag.record(time.monotonic() - frame.timestamp)
+        return frame
+
+    def is_stale(self, frame, timeout=STALE_FRAME_TIMEOUT):
+        """Returns True if frame is missing or older than timeout seconds."""
+        return frame is None or time.monotonic() - frame.timestamp > timeout
+
+    def stats(self):
+        """Returns the counters of every stream."""
+        channels = self.bus.stats()['channels'] if self.bus is not None else None
+        return {
+            name: {
+                'port': port,
+                'frames': channels[self.channels[name]]['published'] if channels else 0,
+                'dropped': channels[self.channels[name]]['dropped'] if channels else 0,
+                'read_failures': self._failures[self.channels[name]] if self._failures is not None else 0,
+                'fps': self._frame_counters[name].rate(),
+            }
+            for name, port in self.ports.items()
+        }